@@ -3,439 +3,418 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+from functools import partial
 from io import BytesIO
 import re
 
-
-
-def run():
-    
-    st.title("📊 Take all data WS and GT")
-    st.write("covert sku into upper case")
-
-    # -----------------------
-    # Page / theme
-    # -----------------------
-    st.set_page_config(page_title="Analysis on all", layout="wide")
-    st.markdown("""
-        <style>
-            body { background-color: black; color: green; }
-            .stApp { background-color: black; color: green; }
-            table { color: green; background-color: black; }
-        </style>
-    """, unsafe_allow_html=True)
-    st.title("🥤 Brand vs Competitor Analyzer")
-
-    # -----------------------
-    # Reference Invoice Dictionary (from your table)
-    # (kept exactly as you provided)
-    # -----------------------
-    invoice_reference_raw = {
-        "LHE": {
-            "300-350ML PET": {"PEPSI": 700, "COKE": 691},
-            "500ML PET": {"PEPSI": 1022, "COKE": 869},
-            "1LTR PET": {"PEPSI": 741, "COKE": 823},
-            "1.5LTR PET": {"PEPSI": 856, "COKE": 822},
-            "2LTR PET": {"PEPSI": 938, "COKE": 999},
-            "2.25LTR PET": {"PEPSI": 1191, "COKE": 950},
-        },
-        "ISB": {
-            "300-350ML PET": {"PEPSI": 680, "COKE": 680},
-            "500ML PET": {"PEPSI": 1054, "COKE": 1050},
-            "1LTR PET": {"PEPSI": 810, "COKE": 835},
-            "1.5LTR PET": {"PEPSI": 838, "COKE": 874},
-            "2LTR PET": {"PEPSI": 0, "COKE": 999},
-            "2.25LTR PET": {"PEPSI": 1185, "COKE": 0},
-        },
-        "PSH": {
-            "300-350ML PET": {"PEPSI": 690, "COKE": 680},
-            "500ML PET": {"PEPSI": 1173, "COKE": 1173},
-            "1LTR PET": {"PEPSI": 785, "COKE": 851},
-            "1.5LTR PET": {"PEPSI": 877, "COKE": 940},
-            "2LTR PET": {"PEPSI": 0, "COKE": 940},
-            "2.25LTR PET": {"PEPSI": 1245, "COKE": 0},
-        },
-        "FSD": {
-            "300-350ML PET": {"PEPSI": 735, "COKE": 680},
-            "500ML PET": {"PEPSI": 1050, "COKE": 1050},
-            "1LTR PET": {"PEPSI": 750, "COKE": 800},
-            "1.5LTR PET": {"PEPSI": 830, "COKE": 865},
-            "2LTR PET": {"PEPSI": 0, "COKE": 999},
-            "2.25LTR PET": {"PEPSI": 1187, "COKE": 0},
-        },
-        "GUJ": {
-            "300-350ML PET": {"PEPSI": 717, "COKE": 691},
-            "500ML PET": {"PEPSI": 1052, "COKE": 1052},
-            "1LTR PET": {"PEPSI": 780, "COKE": 828},
-            "1.5LTR PET": {"PEPSI": 840, "COKE": 873},
-            "2LTR PET": {"PEPSI": 938, "COKE": 1035},
-            "2.25LTR PET": {"PEPSI": 0, "COKE": 0},
-        },
-        "MUL": {
-            "300-350ML PET": {"PEPSI": 720, "COKE": 713},
-            "500ML PET": {"PEPSI": 1050, "COKE": 1050},
-            "1LTR PET": {"PEPSI": 780, "COKE": 828},
-            "1.5LTR PET": {"PEPSI": 860, "COKE": 840},
-            "2LTR PET": {"PEPSI": 1125, "COKE": 1028},
-            "2.25LTR PET": {"PEPSI": 0, "COKE": 0},
-        },
-        "KHI": {
-            "300-350ML PET": {"PEPSI": 782, "COKE": 713},
-            "500ML PET": {"PEPSI": 1087, "COKE": 1087},
-            "1LTR PET": {"PEPSI": 782, "COKE": 845},
-            "1.5LTR PET": {"PEPSI": 1079, "COKE": 873},
-            "2LTR PET": {"PEPSI": 1071, "COKE": 1196},
-            "2.25LTR PET": {"PEPSI": 1304, "COKE": 1152},
-        },
-        "SUK": {
-            "300-350ML PET": {"PEPSI": 715, "COKE": 680},
-            "500ML PET": {"PEPSI": 1050, "COKE": 1050},
-            "1LTR PET": {"PEPSI": 800, "COKE": 847},
-            "1.5LTR PET": {"PEPSI": 889, "COKE": 865},
-            "2LTR PET": {"PEPSI": 1017, "COKE": 1017},
-            "2.25LTR PET": {"PEPSI": 1250, "COKE": 0},
-        },
-    }
-
-    city_pairs = [("KHI", "HYD"), ("MUL", "BWP"), ("SUK", "RYK"), ("GJW", "SKT")]
-
-    alias_map = {
-        "GJW": "GUJ",
-        "LHR": "LHE",
-    }
-
-    # -----------------------
-    # Canonical SKUs used in your app (keep same order)
-    # -----------------------
-    skus_required = [
-        "SSRB",
-        "300-350 ML PET",
-        "500ML PET",
-        "1LTR PET",
-        "1.5LTR PET",
-        "2LTR PET",
-        "2.25LTR PET"
-    ]
-
-    pet_skus_to_fill = [
-        "300-350 ML PET",
-        "500ML PET",
-        "1LTR PET",
-        "1.5LTR PET",
-        "2LTR PET",
-        "2.25LTR PET"
-    ]
-
-    def normalize_text(s):
-        if pd.isna(s):
-            return ""
-        s = str(s).lower()
-        s = re.sub(r'[^a-z0-9]', '', s)
-        return s
-
-    norm_to_canonical = {normalize_text(s): s for s in skus_required}
-
-    invoice_reference = {}
-    for city, sku_map in invoice_reference_raw.items():
-        invoice_reference.setdefault(city, {})
+from chunked import read_columns
+from datasets import load_cube, load_dataset
+from pivot_kernel import pivot
+from preview import exact_or_preview, show_preview
+from result_cache import cached_result, normalize
+from query_engine import (AGG_FUNCS, PARTIALS_ATTR, add_totals, agg_column, distinct, engine_selector,
+                          filter_mask, finalize, merge_partials, partial_aggregates, value_columns)
+from table_viewer import paged_table
+from time_buckets import GRAINS, bucket_table, index_against, rolling_trend, series_partials
+
+
+# -----------------------
+# Reference Invoice Dictionary (from your table)
+# (kept exactly as you provided)
+# -----------------------
+INVOICE_REFERENCE_RAW = {
+    "LHE": {
+        "300-350ML PET": {"PEPSI": 700, "COKE": 691},
+        "500ML PET": {"PEPSI": 1022, "COKE": 869},
+        "1LTR PET": {"PEPSI": 741, "COKE": 823},
+        "1.5LTR PET": {"PEPSI": 856, "COKE": 822},
+        "2LTR PET": {"PEPSI": 938, "COKE": 999},
+        "2.25LTR PET": {"PEPSI": 1191, "COKE": 950},
+    },
+    "ISB": {
+        "300-350ML PET": {"PEPSI": 680, "COKE": 680},
+        "500ML PET": {"PEPSI": 1054, "COKE": 1050},
+        "1LTR PET": {"PEPSI": 810, "COKE": 835},
+        "1.5LTR PET": {"PEPSI": 838, "COKE": 874},
+        "2LTR PET": {"PEPSI": 0, "COKE": 999},
+        "2.25LTR PET": {"PEPSI": 1185, "COKE": 0},
+    },
+    "PSH": {
+        "300-350ML PET": {"PEPSI": 690, "COKE": 680},
+        "500ML PET": {"PEPSI": 1173, "COKE": 1173},
+        "1LTR PET": {"PEPSI": 785, "COKE": 851},
+        "1.5LTR PET": {"PEPSI": 877, "COKE": 940},
+        "2LTR PET": {"PEPSI": 0, "COKE": 940},
+        "2.25LTR PET": {"PEPSI": 1245, "COKE": 0},
+    },
+    "FSD": {
+        "300-350ML PET": {"PEPSI": 735, "COKE": 680},
+        "500ML PET": {"PEPSI": 1050, "COKE": 1050},
+        "1LTR PET": {"PEPSI": 750, "COKE": 800},
+        "1.5LTR PET": {"PEPSI": 830, "COKE": 865},
+        "2LTR PET": {"PEPSI": 0, "COKE": 999},
+        "2.25LTR PET": {"PEPSI": 1187, "COKE": 0},
+    },
+    "GUJ": {
+        "300-350ML PET": {"PEPSI": 717, "COKE": 691},
+        "500ML PET": {"PEPSI": 1052, "COKE": 1052},
+        "1LTR PET": {"PEPSI": 780, "COKE": 828},
+        "1.5LTR PET": {"PEPSI": 840, "COKE": 873},
+        "2LTR PET": {"PEPSI": 938, "COKE": 1035},
+        "2.25LTR PET": {"PEPSI": 0, "COKE": 0},
+    },
+    "MUL": {
+        "300-350ML PET": {"PEPSI": 720, "COKE": 713},
+        "500ML PET": {"PEPSI": 1050, "COKE": 1050},
+        "1LTR PET": {"PEPSI": 780, "COKE": 828},
+        "1.5LTR PET": {"PEPSI": 860, "COKE": 840},
+        "2LTR PET": {"PEPSI": 1125, "COKE": 1028},
+        "2.25LTR PET": {"PEPSI": 0, "COKE": 0},
+    },
+    "KHI": {
+        "300-350ML PET": {"PEPSI": 782, "COKE": 713},
+        "500ML PET": {"PEPSI": 1087, "COKE": 1087},
+        "1LTR PET": {"PEPSI": 782, "COKE": 845},
+        "1.5LTR PET": {"PEPSI": 1079, "COKE": 873},
+        "2LTR PET": {"PEPSI": 1071, "COKE": 1196},
+        "2.25LTR PET": {"PEPSI": 1304, "COKE": 1152},
+    },
+    "SUK": {
+        "300-350ML PET": {"PEPSI": 715, "COKE": 680},
+        "500ML PET": {"PEPSI": 1050, "COKE": 1050},
+        "1LTR PET": {"PEPSI": 800, "COKE": 847},
+        "1.5LTR PET": {"PEPSI": 889, "COKE": 865},
+        "2LTR PET": {"PEPSI": 1017, "COKE": 1017},
+        "2.25LTR PET": {"PEPSI": 1250, "COKE": 0},
+    },
+}
+
+CITY_PAIRS = [("KHI", "HYD"), ("MUL", "BWP"), ("SUK", "RYK"), ("GJW", "SKT")]
+
+ALIAS_MAP = {
+    "GJW": "GUJ",
+    "LHR": "LHE",
+}
+
+# -----------------------
+# Canonical SKUs used in your app (keep same order)
+# -----------------------
+SKUS_REQUIRED = [
+    "SSRB",
+    "300-350 ML PET",
+    "500ML PET",
+    "1LTR PET",
+    "1.5LTR PET",
+    "2LTR PET",
+    "2.25LTR PET"
+]
+
+PET_SKUS_TO_FILL = [
+    "300-350 ML PET",
+    "500ML PET",
+    "1LTR PET",
+    "1.5LTR PET",
+    "2LTR PET",
+    "2.25LTR PET"
+]
+
+
+def normalize_text(s):
+    if pd.isna(s):
+        return ""
+    s = str(s).lower()
+    s = re.sub(r'[^a-z0-9]', '', s)
+    return s
+
+
+NORM_TO_CANONICAL = {normalize_text(s): s for s in SKUS_REQUIRED}
+
+
+def _build_invoice_reference():
+    reference = {}
+    for city, sku_map in INVOICE_REFERENCE_RAW.items():
+        reference.setdefault(city, {})
         for sku_key, brand_map in sku_map.items():
             norm = normalize_text(sku_key)
-            canonical = norm_to_canonical.get(norm)
+            canonical = NORM_TO_CANONICAL.get(norm)
             if not canonical:
                 continue
-            invoice_reference[city].setdefault(canonical, {})
+            reference[city].setdefault(canonical, {})
             for br, val in brand_map.items():
-                invoice_reference[city][canonical][str(br).upper()] = val
-
-    def find_invoice_city_key(region):
-        if pd.isna(region):
-            return None
-        region = str(region).strip()
-        if region in invoice_reference:
-            return region
-        if region in alias_map and alias_map[region] in invoice_reference:
-            return alias_map[region]
-        for a, b in city_pairs:
-            if region == a and b in invoice_reference:
-                return b
-            if region == b and a in invoice_reference:
-                return a
-        if region.upper() in invoice_reference:
-            return region.upper()
-        return None
+                reference[city][canonical][str(br).upper()] = val
+    return reference
 
-    # -----------------------
-    # Upload dataset
-    # -----------------------
-    uploaded_file = st.file_uploader("Upload file", type=["xlsx", "csv"], key="alldata_file")
-    if not uploaded_file:
-        st.info("Please upload a dataset to begin.")
-        st.stop()
 
-    if uploaded_file.name.endswith(".csv"):
-        df = pd.read_csv(uploaded_file)
-    else:
-        df = pd.read_excel(uploaded_file)
+INVOICE_REFERENCE = _build_invoice_reference()
 
-    st.success("✅ Dataset uploaded successfully!")
 
-    def find_col(df, target_name):
-        for col in df.columns:
-            if str(col).strip().lower() == target_name.strip().lower():
-                return col
+def find_invoice_city_key(region):
+    if pd.isna(region):
         return None
-
-    invoice_col = find_col(df, "invoice") or "Invoice"
-
-    df["_NORM_SKU"] = df.get("SKUS", "").fillna("").apply(normalize_text)
-    df["_BR_UP"] = df.get("BRAND", "").fillna("").astype(str).str.upper()
-    df["_REGION"] = df.get("REGION", "").fillna("")
-
-    region_order = [
-        "National", "FSD", "GJW", "SKT", "ISB", "KHI", "HYD", "LHR", "MUL",
-        "BWP", "PSH", "SUK", "RYK"
-    ]
-
-    # -----------------------
-    # User filters UI
-    # -----------------------
-    col1, col2, col3, col4, col5 = st.columns(5)
-    with col1:
-        channel = st.selectbox("Select Channel", sorted(df["CHANNEL"].dropna().unique()))
-    with col2:
-        year = st.selectbox("Select Year", sorted(df["YEAR"].dropna().unique()))
-    with col3:
-        month = st.selectbox("Select Month", sorted(df["MON"].dropna().unique()))
-    with col4:
-        week = st.multiselect("Select Week(s)", sorted(df["WEEK"].dropna().unique()), default=[sorted(df["WEEK"].dropna().unique())[0]])
-    with col5:
-        period = st.multiselect("Select Period(s)", sorted(df["PERIOD"].dropna().unique()), default=[sorted(df["PERIOD"].dropna().unique())[0]])
-
-    cat_filter = st.selectbox("Select Category (CAT)", ["All"] + sorted(df["CAT"].dropna().unique().tolist()))
-
-    metric_map = {
-        "NTP": find_col(df, "NTP/6P") or "NTP/6P",
-        "Promo": find_col(df, "PROMO") or "PROMO",
-        "TP": find_col(df, "REG TP") or "REG TP",
-        "CP": find_col(df, "CP") or "CP",
-        "Invoice": invoice_col
-    }
-
-    colm1, colm2, colm3, colm4 = st.columns(4)
-    with colm1:
-        metric = st.selectbox("Select Metric", list(metric_map.keys()))
-    with colm2:
-        agg_type = st.radio("Choose Aggregation", ["Average", "Minimum", "Maximum"])
-    with colm3:
-        if cat_filter != "All":
-            brand_list = df[df["CAT"] == cat_filter]["BRAND"].dropna().unique()
-        else:
-            brand_list = df["BRAND"].dropna().unique()
-        brand = st.selectbox("Select Brand", sorted(brand_list))
-    with colm4:
-        if cat_filter != "All":
-            competitor_list = df[df["CAT"] == cat_filter]["BRAND"].dropna().unique()
-        else:
-            competitor_list = df["BRAND"].dropna().unique()
-        competitor = st.selectbox("Select Competitor", sorted(competitor_list))
-
-    if brand == competitor:
-        st.warning("⚠️ Both Brand and Competitor are the same. Showing only the selected brand table.")
-        same_brand_mode = True
-    else:
-        same_brand_mode = False
-
-    brands_to_keep = [b for b in [brand, competitor] if pd.notna(b)]
-    df_filtered = df[
-        (df["CHANNEL"] == channel) &
-        (df["YEAR"] == year) &
-        (df["MON"] == month) &
-        (df["WEEK"].isin(week)) &
-        (df["PERIOD"].isin(period)) &
-        (df["BRAND"].isin(brands_to_keep))
-    ].copy()
-
-    if cat_filter != "All":
-        df_filtered = df_filtered[df_filtered["CAT"] == cat_filter].copy()
-
-    df_filtered["_NORM_SKU"] = df_filtered.get("SKUS", "").fillna("").apply(normalize_text)
-    df_filtered["_BR_UP"] = df_filtered.get("BRAND", "").fillna("").astype(str).str.upper()
-    df_filtered["_REGION"] = df_filtered.get("REGION", "").fillna("")
-
-    # -----------------------
-    # Fill missing PET SKU rows from invoice_reference (kept as you wrote)
-    # -----------------------
-    brands_in_scope = [b.upper() for b in {brand, competitor} if isinstance(b, str) and b.strip() != ""]
-    brands_in_scope = [b for b in brands_in_scope if b in {"PEPSI", "COKE"}]
-
-    if brands_in_scope:
-        added_rows = []
-        added_count = 0
-        target_regions = [r for r in region_order if str(r).upper() != "NATIONAL"]
-
-        for region in target_regions:
-            for b in brands_in_scope:
-                for pet_sku in pet_skus_to_fill:
-                    norm_pet_sku = normalize_text(pet_sku)
-                    exists_mask = (
-                        (df_filtered["_REGION"] == region) &
-                        (df_filtered["_BR_UP"] == b) &
-                        (df_filtered["_NORM_SKU"] == norm_pet_sku)
-                    )
-                    if exists_mask.any():
-                        continue
-                    inv_city = find_invoice_city_key(region)
-                    if inv_city is None and region in alias_map:
-                        inv_city = alias_map.get(region)
-                    if inv_city is None:
-                        for a, bpair in city_pairs:
-                            if region == a and bpair in invoice_reference:
-                                inv_city = bpair
-                                break
-                            if region == bpair and a in invoice_reference:
-                                inv_city = a
-                                break
-                    if inv_city is None:
-                        continue
-
-                    city_map = invoice_reference.get(inv_city, {})
-                    sku_map = city_map.get(pet_sku)
-                    if sku_map is None:
-                        found_val = None
-                        for sk_key, brands_map in city_map.items():
-                            if normalize_text(sk_key) == norm_pet_sku:
-                                found_val = brands_map.get(b)
-                                break
-                        if found_val is None:
-                            continue
-                        invoice_val = found_val
-                    else:
-                        invoice_val = sku_map.get(b)
-
-                    if invoice_val is None:
-                        continue
-                    try:
-                        invoice_val_num = float(invoice_val)
-                    except Exception:
-                        continue
-                    if np.isnan(invoice_val_num) or invoice_val_num == 0:
+    region = str(region).strip()
+    if region in INVOICE_REFERENCE:
+        return region
+    if region in ALIAS_MAP and ALIAS_MAP[region] in INVOICE_REFERENCE:
+        return ALIAS_MAP[region]
+    for a, b in CITY_PAIRS:
+        if region == a and b in INVOICE_REFERENCE:
+            return b
+        if region == b and a in INVOICE_REFERENCE:
+            return a
+    if region.upper() in INVOICE_REFERENCE:
+        return region.upper()
+    return None
+
+
+REGION_ORDER = [
+    "National", "FSD", "GJW", "SKT", "ISB", "KHI", "HYD", "LHR", "MUL",
+    "BWP", "PSH", "SUK", "RYK"
+]
+
+AGG_KEYS = ["REGION", "BRAND", "SKUS"]
+
+# What a chunked read keeps: the columns the page filters on besides AGG_KEYS,
+# and the metric columns (matched case-insensitively, like find_col in run())
+FILTER_KEYS = ["CHANNEL", "YEAR", "MON", "WEEK", "PERIOD", "CAT", "COMPANY"]
+METRIC_NAMES = ["ntp/6p", "promo", "reg tp", "cp", "invoice"]
+
+
+@cached_result("alldata", depends=("chunked.py",))
+def metric_partials(dataset_key, metric_col, filters, engine, _df):
+    """Partial aggregates of the metric per AGG_KEYS for the page's filters."""
+    return partial_aggregates(_df, AGG_KEYS, metric_col, filters, engine, dataset_key)
+
+
+# Keys of the per-dataset trend buckets besides the time keys
+TREND_KEYS = ["CHANNEL", "CAT"] + AGG_KEYS
+
+
+@cached_result("alldata", depends=("chunked.py", "time_buckets.py"))
+def trend_buckets(dataset_key, engine, _df):
+    """Time-bucket partials of every metric per TREND_KEYS; built once per dataset."""
+    values = [c for c in value_columns(_df) if str(c).strip().lower() in METRIC_NAMES]
+    keys = [k for k in TREND_KEYS if k in _df.columns]
+    return bucket_table(_df, keys, values, engine, dataset_key)
+
+
+def load_chunked(uploaded_file):
+    """load_cube() of the upload, keyed by everything the page filters and groups on."""
+    columns = read_columns(uploaded_file.name, uploaded_file.getvalue())
+    values = [c for c in columns if str(c).strip().lower() in METRIC_NAMES]
+    return load_cube(uploaded_file, FILTER_KEYS + AGG_KEYS, values)
+
+
+def invoice_gap_rows(existing, brands_in_scope, regions=REGION_ORDER):
+    """Reference invoice rows for PET SKUs missing from the filtered data.
+
+    `existing` holds the (REGION, BRAND, SKUS) keys present after filtering.
+    Returns (region, BRAND, PET SKU, invoice value) for every non-National
+    region x brand in scope x PET SKU that has no row yet and has a non-zero
+    reference invoice.
+    """
+    present = {(region, str(b).upper(), normalize_text(sku)) for region, b, sku in existing}
+    added_rows = []
+    target_regions = [r for r in regions if str(r).upper() != "NATIONAL"]
+
+    for region in target_regions:
+        for b in brands_in_scope:
+            for pet_sku in PET_SKUS_TO_FILL:
+                norm_pet_sku = normalize_text(pet_sku)
+                if (region, b, norm_pet_sku) in present:
+                    continue
+                inv_city = find_invoice_city_key(region)
+                if inv_city is None and region in ALIAS_MAP:
+                    inv_city = ALIAS_MAP.get(region)
+                if inv_city is None:
+                    for a, bpair in CITY_PAIRS:
+                        if region == a and bpair in INVOICE_REFERENCE:
+                            inv_city = bpair
+                            break
+                        if region == bpair and a in INVOICE_REFERENCE:
+                            inv_city = a
+                            break
+                if inv_city is None:
+                    continue
+
+                city_map = INVOICE_REFERENCE.get(inv_city, {})
+                sku_map = city_map.get(pet_sku)
+                if sku_map is None:
+                    found_val = None
+                    for sk_key, brands_map in city_map.items():
+                        if normalize_text(sk_key) == norm_pet_sku:
+                            found_val = brands_map.get(b)
+                            break
+                    if found_val is None:
                         continue
+                    invoice_val = found_val
+                else:
+                    invoice_val = sku_map.get(b)
+
+                if invoice_val is None:
+                    continue
+                try:
+                    invoice_val_num = float(invoice_val)
+                except Exception:
+                    continue
+                if np.isnan(invoice_val_num) or invoice_val_num == 0:
+                    continue
+
+                added_rows.append((region, b, pet_sku, invoice_val_num))
+    return added_rows
+
+
+def with_invoice_gaps(partials, gap_rows, value_col, invoice_col, keys=AGG_KEYS):
+    """Append the gap rows as partial aggregates; they carry a value only when the metric is the invoice."""
+    if not gap_rows:
+        return partials
+    gap = pd.DataFrame(gap_rows, columns=keys + ["_INVOICE"])
+    has_value = value_col == invoice_col
+    value = gap["_INVOICE"] if has_value else np.nan
+    gap[agg_column(value_col, "sum")] = value if has_value else 0.0
+    gap[agg_column(value_col, "count")] = 1 if has_value else 0
+    gap[agg_column(value_col, "min")] = value
+    gap[agg_column(value_col, "max")] = value
+    return pd.concat([partials, gap.drop(columns="_INVOICE")], ignore_index=True)
+
+
+def superbrand_means(partials, pep_brands, ko_brands, value_col):
+    """Mean of `value_col` per REGION × _SUPERBRAND (PEP/KO) × SKUS.
+
+    `partials` are the page's REGION × BRAND × SKUS partial aggregates
+    (invoice gap rows and totals included). The selected brands' sums and
+    counts are pooled per superbrand, so the mean is over rows exactly as if
+    the rows had been relabelled.
+    """
+    parts = partials[partials["BRAND"].isin(pep_brands + ko_brands)]
+    parts = parts.assign(_SUPERBRAND=np.where(parts["BRAND"].isin(pep_brands), "PEP", "KO"))
+    keys = ["REGION", "_SUPERBRAND", "SKUS"]
+    return finalize(merge_partials(parts, keys, value_col), keys, value_col, "mean")
+
+
+CSD_PARTS = ["PEP", "KO", "PEP vs KO %"]
+
+
+@cached_result("alldata", depends=("chunked.py",))
+def csd_result(dataset_key, metric_col, filters, national, pep_brands, ko_brands, _partials):
+    """csd_table() for the chosen PEP and KO brands; `_partials` are the page's for the other arguments."""
+    return csd_table(superbrand_means(_partials, pep_brands, ko_brands, metric_col), metric_col)
+
+
+def csd_table(agg_df, value_col):
+    """Side-by-side PEP / KO / PEP vs KO % table from superbrand_means() output.
+
+    One row per REGION and three columns per SKU (SKU_PEP, SKU_KO,
+    SKU_PEP vs KO %), regions and SKUs sorted. Gaps in a superbrand's row are
+    forward- then back-filled from its neighbouring SKUs. The ratio is
+    rounded to a whole percent and left empty where KO is 0 or missing.
+    """
+    regions = sorted(agg_df["REGION"].unique())
+    skus = sorted(agg_df["SKUS"].unique())
+    wide = pivot(agg_df, ["REGION", "_SUPERBRAND"], "SKUS", value_col, "first")
+    wide = wide.reindex(index=pd.MultiIndex.from_product([regions, ["PEP", "KO"]]), columns=skus)
+    wide = wide.astype(float).ffill(axis=1).bfill(axis=1)
+
+    values = wide.to_numpy().reshape(len(regions), 2, len(skus))
+    pep, ko = values[:, 0, :], values[:, 1, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(ko != 0, pep / ko * 100, np.nan).round(0)
+
+    def part_columns(part):
+        return [f"{sku}_{part}" for sku in skus]
+
+    table = pd.concat([
+        pd.DataFrame({"REGION": regions}),
+        pd.DataFrame(pep, columns=part_columns("PEP")),
+        pd.DataFrame(ko, columns=part_columns("KO")),
+        pd.DataFrame(ratio, columns=part_columns("PEP vs KO %")).astype("Int64"),
+    ], axis=1)
+    return table[["REGION"] + [f"{sku}_{part}" for sku in skus for part in CSD_PARTS]]
+
+
+def shorten(name):
+    if not isinstance(name, str):
+        return str(name)[:3]
+    parts = [w for w in name.split() if w]
+    return "".join([w[:3] for w in parts][:2])
+
+
+def shorten_codes(brands):
+    """{brand: shorten(brand)} for many brands at once; repeated codes get a running number."""
+    names = pd.Series(list(brands), dtype=object)
+    codes = names.map(shorten)
+    seen = codes.groupby(codes).cumcount()
+    codes = codes.where(seen == 0, codes + (seen + 1).astype(str))
+    return dict(zip(names, codes))
+
+
+def brand_comparison(result, value_col, brands, skus=SKUS_REQUIRED, regions=REGION_ORDER):
+    """REGION rows x SKU_BrandCode columns (SKUs, then brands, in the given order)."""
+    wide = pivot(result, "REGION", ["SKUS", "BRAND"], value_col, "first")
+    order = pd.MultiIndex.from_product([skus, brands], names=["SKUS", "BRAND"])
+    wide = wide.reindex(columns=order[order.isin(wide.columns)])
+    codes = shorten_codes(brands)
+    wide.columns = (wide.columns.get_level_values("SKUS").astype(str) + "_"
+                    + wide.columns.get_level_values("BRAND").map(codes).astype(str))
+    comparison = wide.reset_index()
+    try:
+        comparison["REGION"] = pd.Categorical(comparison["REGION"], categories=regions, ordered=True)
+        comparison = comparison.sort_values("REGION").reset_index(drop=True)
+    except Exception:
+        comparison = comparison.sort_values("REGION").reset_index(drop=True)
+    return comparison
 
-                    new_row = {col: np.nan for col in df.columns}
-                    new_row["CHANNEL"] = channel
-                    new_row["YEAR"] = year
-                    new_row["MON"] = month
-                    new_row["WEEK"] = week[0] if isinstance(week, (list, tuple)) and len(week) > 0 else np.nan
-                    new_row["PERIOD"] = period[0] if isinstance(period, (list, tuple)) and len(period) > 0 else np.nan
-                    new_row["REGION"] = region
-                    new_row["BRAND"] = b
-                    new_row["SKUS"] = pet_sku
-                    new_row[invoice_col] = invoice_val_num
-                    new_row["_NORM_SKU"] = normalize_text(pet_sku)
-                    new_row["_BR_UP"] = str(b).upper()
-                    new_row["_REGION"] = region
-
-                    added_rows.append(new_row)
-                    added_count += 1
-
-        if added_rows:
-            df_new = pd.DataFrame(added_rows)
-            for c in df_new.columns:
-                if c not in df_filtered.columns:
-                    df_filtered[c] = np.nan
-            df_filtered = pd.concat([df_filtered, df_new[df_filtered.columns]], ignore_index=True, sort=False)
-        if added_count:
-            st.info(f"ℹ️ Inserted {added_count} invoice row(s) from reference table for missing PET SKUs (Pepsi/Coke).")
 
-    # -----------------------
-    # Prepare metric column & aggregate
-    # -----------------------
-    metric_col = metric_map.get(metric, metric_map["Invoice"])
-    if metric_col not in df_filtered.columns:
-        df_filtered[metric_col] = np.nan
+# Above this many brands the per Brand-SKU bar chart is replaced by the heatmap
+MAX_BAR_BRANDS = 4
 
-    if agg_type == "Average":
-        result = df_filtered.groupby(["REGION", "BRAND", "SKUS"])[metric_col].mean().reset_index()
-    elif agg_type == "Minimum":
-        result = df_filtered.groupby(["REGION", "BRAND", "SKUS"])[metric_col].min().reset_index()
-    else:
-        result = df_filtered.groupby(["REGION", "BRAND", "SKUS"])[metric_col].max().reset_index()
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
-    def shorten(name):
-        if not isinstance(name, str):
-            return str(name)[:3]
-        parts = [w for w in name.split() if w]
-        return "".join([w[:3] for w in parts][:2])
 
-    brand_map = {}
-    brand_map[brand] = shorten(str(brand))
-    if not same_brand_mode:
-        brand_map[competitor] = shorten(str(competitor))
+def excel_bytes(table, sheet_name):
+    """`table` as an .xlsx file; passed to download buttons so it is only built on click."""
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+        table.to_excel(writer, index=False, sheet_name=sheet_name)
+    return buffer.getvalue()
 
-    # -----------------------
-    # Build comparison pivot table
-    # -----------------------
-    if same_brand_mode:
-        comparison = result[result["BRAND"] == brand].pivot_table(index="REGION", columns="SKUS", values=metric_col, aggfunc="first").reset_index()
-        cols = ["REGION"] + [sku for sku in skus_required if sku in comparison.columns]
-        comparison = comparison[cols]
-    else:
-        comparison = result.pivot_table(index="REGION", columns=["SKUS", "BRAND"], values=metric_col, aggfunc="first")
-        # flatten into safe column names using brand_map.get()
-        flat_cols = []
-        for sku, br in comparison.columns:
-            short_br = brand_map.get(br, shorten(br))
-            flat_cols.append(f"{sku}_{short_br}")
-        comparison.columns = flat_cols
-        comparison = comparison.reset_index()
-        cols = ["REGION"]
-        for sku in skus_required:
-            for b in [brand, competitor]:
-                col_name = f"{sku}_{brand_map.get(b, shorten(b))}"
-                if col_name in comparison.columns:
-                    cols.append(col_name)
-        cols_final = [c for c in cols if c in comparison.columns] if cols else comparison.columns.tolist()
-        comparison = comparison[cols_final]
 
-    try:
-        comparison["REGION"] = pd.Categorical(comparison["REGION"], categories=region_order, ordered=True)
-        comparison = comparison.sort_values("REGION").reset_index(drop=True)
-    except Exception:
-        comparison = comparison.sort_values("REGION").reset_index(drop=True)
+# The result sections are fragments: a widget inside one reruns only that
+# section, so e.g. picking CSD brands doesn't redraw the main table and charts.
 
+@st.fragment
+def main_table_section(comparison, metric, agg_type):
     st.subheader(f"{metric} ({agg_type}) - by Region & SKUS")
     st.dataframe(comparison)
 
     # -----------------------
     # Download main table
     # -----------------------
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-        comparison.to_excel(writer, index=False, sheet_name="Main_Table")
     st.download_button(
         label="📥 Download Main Table as Excel",
-        data=buffer.getvalue(),
+        data=partial(excel_bytes, comparison, "Main_Table"),
         file_name="main_table.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        mime=XLSX_MIME,
+        on_click="ignore",
     )
 
+
+@st.fragment
+def charts_section(result, brands, metric, metric_col):
     # -----------------------
     # Visualization Section (kept as in your code)
     # -----------------------
     st.markdown("---")
     st.subheader("📊 Data Visualizations")
 
-    viz_data = result.copy()
+    viz_data = result
 
     if len(viz_data) > 0:
-        st.write("### Brand vs Competitor Comparison by Region")
-        if same_brand_mode:
-            viz_data_filtered = viz_data[viz_data["BRAND"] == brand]
-        else:
-            viz_data_filtered = viz_data[viz_data["BRAND"].isin([brand, competitor])]
+        viz_data_filtered = viz_data[viz_data["BRAND"].isin(brands)]
 
-        if len(viz_data_filtered) > 0:
-            viz_data_filtered["Brand_SKU"] = viz_data_filtered["BRAND"] + " - " + viz_data_filtered["SKUS"]
+        if 0 < len(viz_data_filtered) and len(brands) <= MAX_BAR_BRANDS:
+            st.write("### Brand vs Competitor Comparison by Region")
+            viz_data_filtered = viz_data_filtered.assign(
+                Brand_SKU=viz_data_filtered["BRAND"].astype(str) + " - " + viz_data_filtered["SKUS"].astype(str))
             fig_bar = px.bar(
                 viz_data_filtered,
                 x="REGION",
@@ -454,13 +433,11 @@ def run():
             st.plotly_chart(fig_bar, use_container_width=True)
 
         st.write("### Heatmap: Metric Values Across Regions and SKUs")
-        if not same_brand_mode:
-            heatmap_data = viz_data_filtered.pivot_table(
-                index="REGION",
-                columns=["BRAND", "SKUS"],
-                values=metric_col,
-                aggfunc='first'
-            ).fillna(0)
+        if len(brands) > MAX_BAR_BRANDS:
+            st.caption(f"More than {MAX_BAR_BRANDS} brands selected: the per Brand-SKU bar chart is "
+                       "replaced by this heatmap.")
+        if len(viz_data_filtered) > 0:
+            heatmap_data = pivot(viz_data_filtered, "REGION", ["BRAND", "SKUS"], metric_col, "first").fillna(0)
             if not heatmap_data.empty:
                 fig_heatmap = px.imshow(
                     heatmap_data,
@@ -538,75 +515,259 @@ def run():
     else:
         st.info("No data available for visualization with current filters.")
 
-    # -----------------------
+
+@st.fragment
+def trend_section(df, dataset_key, engine, metric, metric_col, agg_type, brands, filters):
+    st.markdown("---")
+    st.subheader("📈 Trend over time")
+
+    buckets = trend_buckets(dataset_key, engine, df)
+    grains = [g for g, keys in GRAINS.items() if all(k in buckets.columns for k in keys)]
+    if not grains or agg_column(metric_col, "sum") not in buckets.columns:
+        st.info("The dataset needs YEAR, MON and WEEK or PERIOD columns and the metric for a trend.")
+        return
+
+    t1, t2, t3, t4, t5 = st.columns([1, 1, 1, 1, 1])
+    with t1:
+        grain = st.radio("Trend by", grains, key="alldata_trend_grain")
+    with t2:
+        window = st.slider("Rolling window (buckets)", min_value=1, max_value=12, value=1, key="alldata_trend_window")
+    with t3:
+        region = st.selectbox("Region", ["National (all regions)"] + sorted(buckets["REGION"].dropna().unique().tolist()),
+                              key="alldata_trend_region")
+    with t4:
+        skus = buckets.loc[buckets["BRAND"].isin(brands), "SKUS"].dropna().unique().tolist()
+        skus = [s for s in SKUS_REQUIRED if s in skus] + sorted(s for s in skus if s not in SKUS_REQUIRED)
+        sku = st.selectbox("SKU", ["All SKUs"] + skus, index=1 if skus else 0, key="alldata_trend_sku")
+    with t5:
+        base = st.selectbox("Index against", ["(none)"] + list(brands), key="alldata_trend_base")
+
+    # The page's channel, category and brands; every YEAR/MON/WEEK/PERIOD
+    trend_filters = {k: v for k, v in filters.items() if k in ("CHANNEL", "CAT", "BRAND")}
+    if region != "National (all regions)":
+        trend_filters["REGION"] = region
+    if sku != "All SKUs":
+        trend_filters["SKUS"] = sku
+    parts, grain_keys = series_partials(buckets, grain, ["BRAND"], metric_col, trend_filters)
+    if parts.empty:
+        st.info("No data for this trend.")
+        return
+    trend = rolling_trend(parts, grain_keys, ["BRAND"], metric_col, AGG_FUNCS[agg_type], window)
+    order = {"Bucket": list(trend["Bucket"].cat.categories)}
+    label = f"{metric} ({agg_type}{f', rolling {window}' if window > 1 else ''})"
+
+    fig_trend = px.line(trend.assign(Bucket=trend["Bucket"].astype(str)), x="Bucket", y=metric_col, color="BRAND",
+                        markers=True, category_orders=order, title=f"{label} by {grain.lower()}",
+                        labels={metric_col: label, "Bucket": grain})
+    fig_trend.update_layout(plot_bgcolor='black', paper_bgcolor='black', font_color='green', xaxis_tickangle=-45)
+    st.plotly_chart(fig_trend, use_container_width=True)
+
+    if base != "(none)":
+        indexed = index_against(trend, "BRAND", metric_col, base)
+        fig_index = px.line(indexed.assign(Bucket=indexed["Bucket"].astype(str)), x="Bucket", y=metric_col,
+                            color="BRAND", markers=True, category_orders=order,
+                            title=f"{label} index vs {base} (= 100)",
+                            labels={metric_col: f"Index vs {base}", "Bucket": grain})
+        fig_index.update_layout(plot_bgcolor='black', paper_bgcolor='black', font_color='green', xaxis_tickangle=-45)
+        st.plotly_chart(fig_index, use_container_width=True)
+
+
+@st.fragment
+def csd_section(df, dataset_key, partials_key, partials, filters, metric_col, compute_national, engine):
     st.subheader("🥤 CSD Table (PEP vs KO by COMPANY)")
 
     # Select companies
-    companies = sorted(df_filtered["COMPANY"].dropna().unique())
+    companies = distinct(df, "COMPANY", filters, engine, dataset_key)
     pep_company = st.selectbox("Select PEP Company", companies, index=0 if "PEP" in companies else 0)
     ko_company = st.selectbox("Select KO Company", companies, index=0 if "KO" in companies else 0)
 
     # Select brands for each company
     pep_brands = st.multiselect(
         "Select Brands for PEP",
-        sorted(df_filtered.loc[df_filtered["COMPANY"] == pep_company, "BRAND"].unique())
+        distinct(df, "BRAND", {**filters, "COMPANY": pep_company}, engine, dataset_key)
     )
     ko_brands = st.multiselect(
         "Select Brands for KO",
-        sorted(df_filtered.loc[df_filtered["COMPANY"] == ko_company, "BRAND"].unique())
+        distinct(df, "BRAND", {**filters, "COMPANY": ko_company}, engine, dataset_key)
     )
 
     if pep_brands and ko_brands:
-        # Filter for selected brands
-        csd_df = df_filtered[df_filtered["BRAND"].isin(pep_brands + ko_brands)].copy()
-
-        # Map to superbrand
-        csd_df["_SUPERBRAND"] = np.where(csd_df["BRAND"].isin(pep_brands), "PEP", "KO")
-
-        # Aggregate: REGION × SUPERBRAND × SKUS
-        agg_df = csd_df.groupby(["REGION", "_SUPERBRAND", "SKUS"])[metric_col].mean().reset_index()
-
-        # Pivot to get side by side PEP vs KO
-        pep_table = agg_df[agg_df["_SUPERBRAND"] == "PEP"].pivot(index="REGION", columns="SKUS", values=metric_col)
-        ko_table = agg_df[agg_df["_SUPERBRAND"] == "KO"].pivot(index="REGION", columns="SKUS", values=metric_col)
-
-        # Align indexes and fill missing values with other company's values for same SKU
-        all_regions = sorted(set(pep_table.index).union(ko_table.index))
-        all_skus = sorted(set(pep_table.columns).union(ko_table.columns))
-
-        pep_table = pep_table.reindex(index=all_regions, columns=all_skus)
-        ko_table = ko_table.reindex(index=all_regions, columns=all_skus)
-
-        pep_table = pep_table.fillna(method="ffill", axis=1).fillna(method="bfill", axis=1)
-        ko_table = ko_table.fillna(method="ffill", axis=1).fillna(method="bfill", axis=1)
-
-        # Compute comparison % (PEP vs KO)
-        compare_table = (pep_table / ko_table) * 100
-        compare_table = compare_table.round(0).astype("Int64")
-
-        # Merge into one styled DataFrame
-        final_table = pd.DataFrame(index=all_regions)
-        for sku in all_skus:
-            final_table[(sku, "PEP")] = pep_table[sku]
-            final_table[(sku, "KO")] = ko_table[sku]
-            final_table[(sku, "PEP vs KO %")] = compare_table[sku]
-
-        # Flatten MultiIndex for export
-        final_table.columns = [f"{sku}_{col}" for sku, col in final_table.columns]
-        final_table = final_table.reset_index().rename(columns={"index": "REGION"})
+        # REGION × SUPERBRAND × SKUS means side by side: PEP / KO / PEP vs KO % per SKU
+        final_table = csd_result(partials_key, metric_col, filters, compute_national, pep_brands, ko_brands, partials)
 
         # Display
         st.dataframe(final_table)
 
         # Excel download
-        output_csd = BytesIO()
-        with pd.ExcelWriter(output_csd, engine="xlsxwriter") as writer:
-            final_table.to_excel(writer, index=False, sheet_name="CSD Table")
         st.download_button(
             label="⬇️ Download CSD Table (Excel)",
-            data=output_csd.getvalue(),
+            data=partial(excel_bytes, final_table, "CSD Table"),
             file_name="csd_table.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            mime=XLSX_MIME,
+            on_click="ignore",
         )
     else:
         st.info("Please select at least one brand for both PEP and KO to see the CSD table.")
+
+
+@st.fragment
+def rows_section(df, dataset_key, filters):
+    st.subheader("🔎 Filtered rows")
+    if st.toggle("Browse the rows behind the tables", key="alldata_rows"):
+        mask = filter_mask(df, filters)
+        rows = df if mask is None else df[mask]
+        paged_table(rows, key="alldata_rows_table", result_key=f"{dataset_key}-{normalize(filters)!r}")
+
+
+def run():
+    
+    st.title("📊 Take all data WS and GT")
+    st.write("covert sku into upper case")
+
+    # -----------------------
+    # Page / theme
+    # -----------------------
+    st.set_page_config(page_title="Analysis on all", layout="wide")
+    st.markdown("""
+        <style>
+            body { background-color: black; color: green; }
+            .stApp { background-color: black; color: green; }
+            table { color: green; background-color: black; }
+        </style>
+    """, unsafe_allow_html=True)
+    st.title("🥤 Brand vs Competitor Analyzer")
+
+    # -----------------------
+    # Upload dataset
+    # -----------------------
+    uploaded_file = st.file_uploader("Upload file", type=["xlsx", "csv"], key="alldata_file")
+    if not uploaded_file:
+        st.info("Please upload a dataset to begin.")
+        st.stop()
+
+    chunked = st.sidebar.checkbox("Large file: aggregate while reading", key="alldata_chunked",
+                                  help="Reads the upload in chunks into per-group sums, counts, minima "
+                                       "and maxima instead of loading every row.")
+    dataset_key, df = load_chunked(uploaded_file) if chunked else load_dataset(uploaded_file)
+    engine = engine_selector()
+
+    st.success("✅ Dataset uploaded successfully!")
+
+    def find_col(df, target_name):
+        for col in value_columns(df):
+            if str(col).strip().lower() == target_name.strip().lower():
+                return col
+        return None
+
+    invoice_col = find_col(df, "invoice") or "Invoice"
+
+    region_order = REGION_ORDER
+    skus_required = SKUS_REQUIRED
+
+    # -----------------------
+    # User filters UI (applied on submit)
+    # -----------------------
+    with st.form("alldata_filters"):
+        col1, col2, col3, col4, col5 = st.columns(5)
+        with col1:
+            channel = st.selectbox("Select Channel", sorted(df["CHANNEL"].dropna().unique()))
+        with col2:
+            year = st.selectbox("Select Year", sorted(df["YEAR"].dropna().unique()))
+        with col3:
+            month = st.selectbox("Select Month", sorted(df["MON"].dropna().unique()))
+        with col4:
+            week = st.multiselect("Select Week(s)", sorted(df["WEEK"].dropna().unique()), default=[sorted(df["WEEK"].dropna().unique())[0]])
+        with col5:
+            period = st.multiselect("Select Period(s)", sorted(df["PERIOD"].dropna().unique()), default=[sorted(df["PERIOD"].dropna().unique())[0]])
+
+        cat_filter = st.selectbox("Select Category (CAT)", ["All"] + sorted(df["CAT"].dropna().unique().tolist()))
+        compute_national = st.checkbox("Compute National row from all regions", value=True,
+                                       help="National is pooled from the regions' sums and counts; "
+                                            "National rows in the upload are replaced.")
+
+        metric_map = {
+            "NTP": find_col(df, "NTP/6P") or "NTP/6P",
+            "Promo": find_col(df, "PROMO") or "PROMO",
+            "TP": find_col(df, "REG TP") or "REG TP",
+            "CP": find_col(df, "CP") or "CP",
+            "Invoice": invoice_col
+        }
+
+        # Brands of the applied category; a new category's brands are listed after Apply,
+        # keeping the picked brands it also has (or the first two if it has none of them)
+        cat_filters = {"CAT": cat_filter} if cat_filter != "All" else None
+        brand_list = distinct(df, "BRAND", cat_filters, engine, dataset_key)
+        picked = st.session_state.get("alldata_brands")
+        kept = [b for b in picked if b in brand_list] if picked is not None else []
+        st.session_state["alldata_brands"] = kept if kept or picked == [] else brand_list[:2]
+
+        colm1, colm2, colm3 = st.columns([1, 1, 2])
+        with colm1:
+            metric = st.selectbox("Select Metric", list(metric_map.keys()))
+        with colm2:
+            agg_type = st.radio("Choose Aggregation", ["Average", "Minimum", "Maximum"])
+        with colm3:
+            brands = st.multiselect("Select Brands", brand_list, key="alldata_brands")
+
+        st.form_submit_button("Apply filters", type="primary")
+
+    if not brands:
+        st.info("Please select at least one brand.")
+        st.stop()
+
+    brands_to_keep = list(brands)
+    filters = {
+        "CHANNEL": channel,
+        "YEAR": year,
+        "MON": month,
+        "WEEK": week,
+        "PERIOD": period,
+        "BRAND": brands_to_keep,
+    }
+    if cat_filter != "All":
+        filters["CAT"] = cat_filter
+
+    # -----------------------
+    # Prepare metric column & aggregate
+    # -----------------------
+    metric_col = metric_map.get(metric, metric_map["Invoice"])
+    partials, preview_job = exact_or_preview(metric_partials, df, dataset_key, metric_col, filters, engine)
+    if preview_job is not None:
+        sample_counts = add_totals(partials, AGG_KEYS, metric_col, {"REGION": "National"}) if compute_national else partials
+        sample_counts = finalize(sample_counts, AGG_KEYS, metric_col, "count")
+        show_preview(preview_job, brand_comparison(sample_counts, metric_col, brands, skus_required, region_order))
+
+    # -----------------------
+    # Fill missing PET SKU rows from invoice_reference (kept as you wrote)
+    # -----------------------
+    brands_in_scope = [b.upper() for b in dict.fromkeys(brands) if isinstance(b, str) and b.strip() != ""]
+    brands_in_scope = [b for b in brands_in_scope if b in {"PEPSI", "COKE"}]
+
+    gap_rows = []
+    if brands_in_scope:
+        gap_rows = invoice_gap_rows(partials[AGG_KEYS].itertuples(index=False, name=None), brands_in_scope, region_order)
+        partials = with_invoice_gaps(partials, gap_rows, metric_col, invoice_col)
+        if gap_rows:
+            st.info(f"ℹ️ Inserted {len(gap_rows)} invoice row(s) from reference table for missing PET SKUs (Pepsi/Coke).")
+
+    if compute_national:
+        partials = add_totals(partials, AGG_KEYS, metric_col, {"REGION": "National"})
+    result = finalize(partials, AGG_KEYS, metric_col, AGG_FUNCS[agg_type])
+
+    # -----------------------
+    # Build comparison pivot table
+    # -----------------------
+    comparison = brand_comparison(result, metric_col, brands, skus_required, region_order)
+    main_table_section(comparison, metric, agg_type)
+
+    charts_section(result, brands, metric, metric_col)
+
+    trend_section(df, dataset_key, engine, metric, metric_col, agg_type, brands, filters)
+
+    # -----------------------
+    partials_key = dataset_key if preview_job is None else f"{dataset_key}-preview"
+    csd_section(df, dataset_key, partials_key, partials, filters, metric_col, compute_national, engine)
+
+    # A chunked read keeps partial aggregates, not rows
+    if PARTIALS_ATTR not in df.attrs:
+        rows_section(df, dataset_key, filters)
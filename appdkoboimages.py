@@ -9,7 +9,11 @@ Enhanced Features:
 - Creates folders as: images_downloaded/BrandName/CityName/
 - File names: City_BrPrefix_bill_xxx.ext (e.g., Karachi_PE_bill_1.jpg).
 - Uses Basic Auth for all requests.
-- Downloads images with retries and detects file type.
+- Downloads images with retries (exponential backoff, honours Retry-After) and detects file type.
+- Adapts the number of parallel downloads to how fast KoBo responds (AIMD).
+- Optionally resizes/recompresses the images (strips EXIF) in a process pool after download.
+- Paginated thumbnail gallery per Brand/City to review the downloaded bills.
+- Runs each download as a background job that survives reruns/refreshes and can be cancelled.
 - Shows progress, allows downloading a ZIP of all images, and logs failed links.
 """
 
@@ -19,76 +23,594 @@ import requests
 from requests.auth import HTTPBasicAuth
 from urllib.parse import urlparse
 import os
+import hashlib
 import mimetypes
 import time
+import random
+import threading
+import queue
+from email.utils import parsedate_to_datetime
+from functools import partial
 from io import BytesIO
 import zipfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import filetype
 
+import jobs
+from kobo_compress import compact_images
+from kobo_gallery import show_gallery
+from kobo_metrics import DownloadMetrics, TimedHTTPAdapter, pop_connect_time
+from table_viewer import paged_table
+
+
+# ------- Helper functions -------
+
+# Status codes KoBo (and the proxies in front of it) use to say "slow down"
+THROTTLE_STATUSES = {429, 503}
+# Status codes worth another attempt; anything else (401, 403, 404...) fails fast
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def sanitize_name(s):
+    """Clean folder/file names."""
+    return "".join(c for c in str(s) if c.isalnum() or c in (' ','_','-')).strip().replace(" ", "_")
+
+
+def detect_extension(content, content_type, url):
+    """Detect proper file extension."""
+    kind = filetype.guess(content)
+    if kind:
+        return kind.extension
+    if content_type:
+        guessed = mimetypes.guess_extension(content_type.split(';')[0].strip())
+        if guessed:
+            return guessed.lstrip('.')
+    path = urlparse(url).path
+    ext2 = os.path.splitext(path)[1]
+    if ext2 and len(ext2) <= 6:
+        return ext2.lstrip('.')
+    return 'jpg'
+
+
+def parse_retry_after(value):
+    """Return the Retry-After header as seconds to wait, or None if absent/unparseable."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0, retry_after=None):
+    """Exponential backoff with full jitter; never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap * 4))
+    return delay
+
+
+class AdaptiveConcurrency:
+    """AIMD limiter for in-flight requests.
+
+    The window grows by one slot after every `limit` healthy completions
+    (roughly one round of requests) and is cut multiplicatively when the
+    server throttles (429/503), when errors pile up, or when latency climbs
+    well above the best latency seen so far.
+    """
+
+    def __init__(self, initial=3, minimum=1, maximum=32, backoff_factor=0.5,
+                 latency_factor=3.0, error_threshold=0.2):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff_factor = backoff_factor
+        self.latency_factor = latency_factor
+        self.error_threshold = error_threshold
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.base_latency = None
+        self._latency_ewma = None
+        self._healthy = 0
+        self._errors = 0
+        self._completed = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def _decrease(self, factor):
+        # One cut per "round trip": a burst of 429s from the same window counts once.
+        now = time.monotonic()
+        hold = self._latency_ewma or 1.0
+        if now - self._last_decrease < hold:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.minimum), self.limit * factor)
+        self._healthy = 0
+
+    def record(self, latency, ok, throttled=False):
+        """Feed back the outcome of one request attempt."""
+        with self._cond:
+            self._completed += 1
+            if latency is not None:
+                self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+                # Baseline is the best *smoothed* latency, so one lucky fast request doesn't set it
+                if ok and (self.base_latency is None or self._latency_ewma < self.base_latency):
+                    self.base_latency = self._latency_ewma
+
+            if throttled:
+                self._decrease(self.backoff_factor)
+            elif not ok:
+                self._errors += 1
+                if self._errors / self._completed > self.error_threshold:
+                    self._decrease(self.backoff_factor)
+                    self._errors = 0
+                    self._completed = 0
+                elif self._completed >= 50:
+                    # Judge the error rate over a sliding batch, not the whole job
+                    self._errors = 0
+                    self._completed = 0
+            elif (self.base_latency and self._latency_ewma
+                  and self._latency_ewma > self.latency_factor * self.base_latency
+                  and self.limit > self.minimum):
+                # Queueing on the server side: ease off before it starts throttling.
+                self._decrease(0.75)
+            else:
+                self._healthy += 1
+                if self._healthy >= int(self.limit) and self.limit < self.maximum:
+                    self.limit = min(float(self.maximum), self.limit + 1)
+                    self._healthy = 0
+            self._cond.notify_all()
+
+
+def download_one(session, url, dest_name, folder, timeout=20, max_retries=2, limiter=None, stats=None):
+    """Download a single file with retries.
+
+    Retries use exponential backoff with jitter and honour Retry-After on
+    throttled responses. If a limiter is given, every attempt holds one of
+    its slots and reports its outcome back to it. If a `stats` dict is given
+    it is filled with the timings, size, status code and retry count of the
+    request (see kobo_metrics.METRIC_COLUMNS).
+    """
+    last_exc = None
+    stats = {} if stats is None else stats
+    stats.update(status_code=None, retries=0, connect_s=None, first_byte_s=None, bytes=0)
+    job_started = time.monotonic()
+    try:
+        for attempt in range(max_retries+1):
+            stats["retries"] = attempt
+            retry_after = None
+            if limiter is not None:
+                limiter.acquire()
+            started = time.monotonic()
+            ok = throttled = healthy = False
+            try:
+                with session.get(url, stream=True, timeout=timeout) as resp:
+                    stats["first_byte_s"] = time.monotonic() - started
+                    stats["connect_s"] = pop_connect_time(resp)
+                    stats["status_code"] = resp.status_code
+                    if resp.status_code == 200:
+                        content = resp.content
+                        stats["bytes"] = len(content)
+                        ok = healthy = True
+                    else:
+                        last_exc = f'HTTP {resp.status_code}'
+                        throttled = resp.status_code in THROTTLE_STATUSES
+                        retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                        if resp.status_code not in RETRYABLE_STATUSES:
+                            # A 404/401 says nothing about server load
+                            healthy = True
+                            return False, None, last_exc
+            except Exception as e:
+                last_exc = str(e)
+            finally:
+                if limiter is not None:
+                    limiter.record(time.monotonic() - started, healthy, throttled)
+                    limiter.release()
+
+            if ok:
+                content_type = resp.headers.get('Content-Type', '')
+                ext = detect_extension(content, content_type, url)
+                final_name = f"{dest_name}.{ext}"
+                final_path = os.path.join(folder, final_name)
+                with open(final_path, 'wb') as f:
+                    f.write(content)
+                return True, final_name, None
+            if attempt < max_retries:
+                time.sleep(backoff_delay(attempt, retry_after=retry_after))
+        return False, None, last_exc
+    finally:
+        stats["total_s"] = time.monotonic() - job_started
 
-def run():
-    st.title("📊 Download images from KOBO")
-    st.write("This app downloads images from KOBO for both GT and WS")
-    st.write("col must be this for both start	end	Auditor Name	City	Survey Date	Bill Date	Shop Name	PEPSI BILL PICTURE_URL	COKE BILL PICTURE_URL	Cola Next Bill Picture_URL	NESTLE BILL PICTURE_URL")
-    st.write("for WS regin col name change into city")
-    st.write("For WS the PPT dashbord img col is P1 for PEP,IK1 for KO, PO1 for colanext, On1 for Nestle, SJ1 for Gourmet")
-    st.write("For GT the PPT dashbord img col is T1 for PEP, WE1 for KO, AMP1 for colanext, AKE1 for Nestle,ASV1 for Gourmet")
 
-    # ------- Helper functions -------
+def extract_brand_name(col):
+    """Extract brand name from column header."""
+    clean = col.replace("_", " ").strip()
+    parts = clean.split()
+    if parts:
+        return parts[0].capitalize()  # e.g., 'PEPSI BILL PICTURE_URL' → 'Pepsi'
+    return "Unknown"
 
-    def sanitize_name(s):
-        """Clean folder/file names."""
-        return "".join(c for c in str(s) if c.isalnum() or c in (' ','_','-')).strip().replace(" ", "_")
 
+# Survey columns that never hold image links
+FIXED_COLS = ["start", "end", "Auditor Name", "City", "Survey Date", "Bill Date", "Shop Name"]
+TASK_COLUMNS = ["url", "brand", "city", "dest_name", "folder"]
 
-    def detect_extension(content, content_type, url):
-        """Detect proper file extension."""
-        kind = filetype.guess(content)
-        if kind:
-            return kind.extension
-        if content_type:
-            guessed = mimetypes.guess_extension(content_type.split(';')[0].strip())
-            if guessed:
-                return guessed.lstrip('.')
-        path = urlparse(url).path
-        ext2 = os.path.splitext(path)[1]
-        if ext2 and len(ext2) <= 6:
-            return ext2.lstrip('.')
-        return 'jpg'
 
+def build_tasks(df, folder_name, start_index=1, fixed_cols=FIXED_COLS):
+    """Build the download task table in one vectorized pass.
 
-    def download_one(session, url, dest_name, folder, timeout=20, max_retries=2):
-        """Download a single file with retries."""
-        last_exc = None
-        for attempt in range(max_retries+1):
+    URL columns are melted into a long table (column by column, rows in file
+    order, so numbering matches the old per-column loop), invalid links are
+    dropped, and every unique Brand/City folder is created once.
+    """
+    url_cols = [col for col in df.columns if col not in fixed_cols]
+    if not url_cols:
+        return pd.DataFrame(columns=TASK_COLUMNS)
+
+    long = df[["City"] + url_cols].melt(id_vars="City", value_vars=url_cols, var_name="column", value_name="url")
+    long["url"] = long["url"].fillna("").astype(str).str.strip()
+    long = long[long["url"].str.startswith(("http://", "https://"))].reset_index(drop=True)
+    if long.empty:
+        return pd.DataFrame(columns=TASK_COLUMNS)
+
+    brand_of = {col: sanitize_name(extract_brand_name(col)) for col in url_cols}
+    long["brand"] = long["column"].map(brand_of)
+
+    city_codes, city_values = pd.factorize(long["City"], use_na_sentinel=False)
+    long["city"] = pd.Series([sanitize_name(c) for c in city_values], dtype=object).to_numpy()[city_codes]
+
+    counter = pd.Series(range(start_index, start_index + len(long)), index=long.index).astype(str)
+    long["dest_name"] = long["city"] + "_" + long["brand"].str[:2].str.upper() + "_bill_" + counter
+    long["folder"] = folder_name + os.sep + long["brand"] + os.sep + long["city"]
+
+    for folder in long["folder"].unique():
+        os.makedirs(folder, exist_ok=True)
+
+    return long[TASK_COLUMNS]
+
+
+_DONE = object()
+
+# Minimum time between progress refreshes pushed to the browser (at most 4 per second)
+UI_REFRESH_SECONDS = 0.25
+
+
+def stream_downloads(session, tasks, timeout=20, max_retries=2, limiter=None, workers=4,
+                     queue_size=None, stop_event=None, metrics=None):
+    """Download `tasks` through a bounded producer/consumer queue.
+
+    A producer thread feeds task rows into a queue of at most `queue_size`
+    items and `workers` long-lived threads drain it, so memory and scheduling
+    cost stay flat however many rows the export has. Yields (task, result)
+    pairs in completion order. Setting `stop_event` (or closing the
+    generator) stops new downloads; in-flight ones are allowed to finish.
+    Each finished URL is recorded in `metrics` (a DownloadMetrics) if given.
+    """
+    queue_size = queue_size or workers * 4
+    todo = queue.Queue(maxsize=queue_size)
+    done = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def stopped():
+        return stop.is_set() or (stop_event is not None and stop_event.is_set())
+
+    def produce():
+        try:
+            for task in tasks:
+                if stopped():
+                    break
+                todo.put(task)
+        finally:
+            for _ in range(workers):
+                todo.put(_DONE)
+
+    def work():
+        while True:
+            task = todo.get()
+            if task is _DONE:
+                done.put(_DONE)
+                return
+            if stopped():
+                continue
+            stats = {}
             try:
-                resp = session.get(url, stream=True, timeout=timeout)
-                if resp.status_code == 200:
-                    content = resp.content
-                    content_type = resp.headers.get('Content-Type', '')
-                    ext = detect_extension(content, content_type, url)
-                    final_name = f"{dest_name}.{ext}"
-                    final_path = os.path.join(folder, final_name)
-                    with open(final_path, 'wb') as f:
-                        f.write(content)
-                    return True, final_name, None
-                else:
-                    last_exc = f'HTTP {resp.status_code}'
+                result = download_one(session, task.url, task.dest_name, task.folder, timeout, max_retries,
+                                      limiter, stats)
             except Exception as e:
-                last_exc = str(e)
-            time.sleep(0.5 * (attempt+1))
-        return False, None, last_exc
-
+                result = (False, None, str(e))
+            if metrics is not None:
+                metrics.record(url=task.url, host=urlparse(task.url).hostname, brand=task.brand, city=task.city,
+                               ok=result[0], error=result[2], **stats)
+            done.put((task, result))
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+
+    finished = 0
+    try:
+        while finished < workers:
+            item = done.get()
+            if item is _DONE:
+                finished += 1
+                continue
+            yield item
+    finally:
+        stop.set()
+        while finished < workers:
+            if done.get() is _DONE:
+                finished += 1
+
+
+def zip_results(results, folder_name, zip_path, substitutes=None):
+    """Write the successfully downloaded files to `zip_path` and return it.
+
+    `substitutes` maps a result's relative path to the file that should be
+    zipped instead (the compact variant written next to the original).
+    """
+    substitutes = substitutes or {}
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for _, fname, ok, _ in results:
+            if ok and fname:
+                fname = substitutes.get(fname, fname)
+                fpath = os.path.join(folder_name, fname)
+                if os.path.exists(fpath):
+                    zipf.write(fpath, fname)
+    return zip_path
+
+
+def read_bytes(path):
+    """Contents of `path`, for download buttons that only read the file when clicked."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def compress_results(status, results, folder_name, max_dim, quality, replace):
+    """Run the resize/recompress stage over the downloaded files.
+
+    In replace mode `results` is rewritten to point at the new .jpg files;
+    otherwise the compact variants are returned as {original: compact} for
+    zipping.
+    """
+    index = {fname: i for i, (_, fname, ok, _) in enumerate(results) if ok and fname}
+    paths = [os.path.join(folder_name, fname) for fname in index]
+    saved = [0, 0]
+    substitutes = {}
+
+    def progress(done, total):
+        status.update(message=f"Compressing images {done}/{total}...")
+
+    for path, (ok, out_path, before, after, error) in compact_images(paths, max_dim, quality, replace,
+                                                                       progress=progress):
+        if not ok:
+            continue
+        saved[0] += before
+        saved[1] += after
+        fname = os.path.relpath(path, folder_name)
+        new_fname = os.path.relpath(out_path, folder_name)
+        if replace:
+            url, _, _, err = results[index[fname]]
+            results[index[fname]] = (url, new_fname, True, err)
+        else:
+            substitutes[fname] = new_fname
+    return substitutes, saved
+
+
+def download_job(job, session, tasks, folder_name, timeout, max_retries, limiter, workers, compress=None):
+    """Background job body: download every task, optionally compact the images, then zip what succeeded.
+
+    `compress` is None or a dict of compress_results options (max_dim, quality, replace).
+    """
+    status = job.status
+    metrics = DownloadMetrics()
+    status.log_to(f"{folder_name}_{job.id}.log")
+    status.update(total=len(tasks), message="Downloading...", extra={"metrics": metrics})
+    results = []
+    stream = stream_downloads(session, tasks.itertuples(index=False), timeout, max_retries,
+                              limiter, workers=workers, stop_event=job.cancel_event, metrics=metrics)
+    for task, (success, final_name, error) in stream:
+        url, brand, city = task.url, task.brand, task.city
+        if success:
+            results.append((url, os.path.join(brand, city, final_name), True, None))
+            status.advance("succeeded", f'✅ {brand}/{city}: {url} -> {final_name}')
+        else:
+            results.append((url, None, False, error))
+            status.advance("failed", f'❌ {brand}/{city}: {url} -> {error}')
+
+    zip_path = None
+    substitutes, compressed = {}, None
+    if compress and not job.cancel_event.is_set():
+        substitutes, compressed = compress_results(status, results, folder_name, **compress)
+    if any(ok for _, _, ok, _ in results):
+        status.update(message="Zipping images...")
+        zip_path = zip_results(results, folder_name, f"{folder_name}_{job.id}.zip", substitutes)
+    status.update(message="")
+    return {
+        "results": results,
+        "zip_path": zip_path,
+        "folder_name": folder_name,
+        "concurrency": limiter.current,
+        "compressed": compressed,
+    }
+
+
+@st.cache_resource
+def get_job_registry():
+    """One job registry per server process, shared by every session."""
+    return jobs.JobRegistry(max_workers=2)
+
+
+def show_metrics(metrics, live=True):
+    """Throughput tiles plus latency percentiles per host and per brand."""
+    frame = metrics.to_frame()
+    if frame.empty:
+        return
+    rates = metrics.throughput(frame)
+    c1, c2, c3, c4 = st.columns(4)
+    if live:
+        c1.metric("MB/s (last 10s)", f"{rates['recent_mb_per_s']:.2f}")
+        c2.metric("Images/s (last 10s)", f"{rates['recent_images_per_s']:.1f}")
+    c3.metric("MB/s (job)", f"{rates['mb_per_s']:.2f}")
+    c4.metric("Images/s (job)", f"{rates['images_per_s']:.1f}")
+    with st.expander("Latency by host and brand", expanded=live):
+        st.caption("Total request time in seconds, including retries and backoff.")
+        st.dataframe(metrics.latency_summary("host", frame), hide_index=True)
+        st.dataframe(metrics.latency_summary("brand", frame), hide_index=True)
+        codes = frame["status_code"].value_counts(dropna=False).rename_axis("status_code").reset_index(name="requests")
+        st.dataframe(codes, hide_index=True)
+
+
+def show_job(job_id):
+    """Poll one download job: live progress while it runs, results once it ends."""
+    job = get_job_registry().get(job_id)
+    if job is None:
+        st.warning("That download job is no longer available (the server may have restarted).")
+        return
+    snap = job.status.snapshot()
+    st.markdown(f"**Job `{job.id}`** — {job.label} — _{snap['state']}_")
+
+    if job.active:
+        if st.button('Cancel download', key=f"cancel_{job.id}"):
+            job.cancel()
+        # One placeholder, replaced on every poll, instead of a new element per update
+        box = st.empty()
+        with box.container():
+            total = snap["total"] or 1
+            st.progress(min(snap["done"] / total, 1.0))
+            st.write(f"{snap['done']}/{snap['total']} processed · "
+                     f"✅ {snap['counts'].get('succeeded', 0)} · ❌ {snap['counts'].get('failed', 0)} · "
+                     f"⏳ {max(snap['total'] - snap['done'], 0)} {snap['message']}")
+            if snap["log"]:
+                st.text("\n".join(snap["log"]))
+            if "metrics" in snap["extra"]:
+                show_metrics(snap["extra"]["metrics"])
+        return
+
+    if snap["state"] == "failed":
+        st.error(f"Download job failed: {snap['error']}")
+        return
+
+    result = snap["result"] or {}
+    results = result.get("results", [])
+    succ = sum(1 for r in results if r[2])
+    fail = sum(1 for r in results if not r[2])
+    if snap["state"] == "cancelled":
+        st.warning(f"Download cancelled. Successful: {succ}, Failed: {fail}")
+    else:
+        st.success(f"Download complete ✅ Successful: {succ}, Failed: {fail}")
+    if result.get("concurrency"):
+        st.caption(f"Concurrency settled at {result['concurrency']} parallel downloads.")
+    if result.get("compressed") and result["compressed"][0]:
+        before, after = result["compressed"]
+        st.caption(f"Compressed images: {before / 1e6:.1f} MB → {after / 1e6:.1f} MB "
+                   f"({100 * (1 - after / before):.0f}% smaller).")
+
+    metrics = snap["extra"].get("metrics")
+    if metrics is not None and len(metrics):
+        show_metrics(metrics, live=False)
+        m1, m2 = st.columns(2)
+        with m1:
+            st.download_button('Download metrics CSV', data=partial(metrics.export, "csv"),
+                               file_name=f'{job.id}_metrics.csv', mime='text/csv', on_click="ignore",
+                               key=f"metrics_csv_{job.id}")
+        with m2:
+            st.download_button('Download metrics Parquet', data=partial(metrics.export, "parquet"),
+                               file_name=f'{job.id}_metrics.parquet', mime='application/octet-stream',
+                               on_click="ignore", key=f"metrics_parquet_{job.id}")
+
+    zip_path = result.get("zip_path")
+    if zip_path and os.path.exists(zip_path):
+        # Read only when clicked: the panel reruns on every widget change in it (e.g. gallery pages)
+        st.download_button('Download ZIP of images', data=partial(read_bytes, zip_path),
+                           file_name=os.path.basename(zip_path), mime='application/zip', on_click="ignore",
+                           key=f"zip_{job.id}")
+
+    if fail > 0:
+        failed_links = [url for url, _, ok, _ in results if not ok]
+        fail_df = pd.DataFrame(failed_links, columns=['failed_url'])
+        csv_buffer = BytesIO()
+        fail_df.to_csv(csv_buffer, index=False)
+        st.download_button('Download failed links CSV', data=csv_buffer.getvalue(), file_name='failed_links.csv',
+                           mime='text/csv', key=f"failed_{job.id}")
+
+    if succ > 0 and result.get("folder_name"):
+        with st.expander("🖼️ Review downloaded images"):
+            show_gallery(result["folder_name"], key=f"gallery_{job.id}")
+
+    if snap["log_path"] and os.path.exists(snap["log_path"]):
+        st.download_button('Download full log', data=partial(read_bytes, snap["log_path"]),
+                           file_name=os.path.basename(snap["log_path"]), mime='text/plain', on_click="ignore",
+                           key=f"log_{job.id}")
+
+    if st.button('Clear finished job', key=f"clear_{job.id}"):
+        st.session_state.pop("kobo_job", None)
+        st.query_params.pop("kobo_job", None)
+        st.rerun()
+
+
+def job_owner(username, password):
+    """Owner key of a user's jobs: a hash of the KoBo credentials, so the username alone can't find them."""
+    return hashlib.sha256(f"{username}\0{password}".encode()).hexdigest()
+
+
+def show_jobs(owner):
+    """Reattach to the job this browser started (kept in the URL) or to any running job of `owner`."""
+    job_id = st.session_state.get("kobo_job") or st.query_params.get("kobo_job")
+    registry = get_job_registry()
+    if owner:
+        running = [j for j in registry.list(owner=owner, active_only=True) if j.id != job_id]
+        if running:
+            labels = {j.id: f"{j.id} — {j.label}" for j in running}
+            picked = st.selectbox('Running download jobs', [""] + list(labels), format_func=lambda i: labels.get(i, "—"))
+            if picked:
+                job_id = picked
+    if not job_id:
+        return
+
+    st.session_state["kobo_job"] = job_id
+    st.query_params["kobo_job"] = job_id
+    st.markdown("---")
+    job = registry.get(job_id)
+    # Poll on a timer only while the job is running; the rest of the page is not rerun.
+    run_every = UI_REFRESH_SECONDS if job is not None and job.active else None
+
+    @st.fragment(run_every=run_every)
+    def job_panel():
+        show_job(job_id)
+        if run_every and not registry.get(job_id).active:
+            st.rerun()
+
+    job_panel()
+    st.markdown("---")
 
-    def extract_brand_name(col):
-        """Extract brand name from column header."""
-        clean = col.replace("_", " ").strip()
-        parts = clean.split()
-        if parts:
-            return parts[0].capitalize()  # e.g., 'PEPSI BILL PICTURE_URL' → 'Pepsi'
-        return "Unknown"
 
+def run():
+    st.title("📊 Download images from KOBO")
+    st.write("This app downloads images from KOBO for both GT and WS")
+    st.write("col must be this for both start	end	Auditor Name	City	Survey Date	Bill Date	Shop Name	PEPSI BILL PICTURE_URL	COKE BILL PICTURE_URL	Cola Next Bill Picture_URL	NESTLE BILL PICTURE_URL")
+    st.write("for WS regin col name change into city")
+    st.write("For WS the PPT dashbord img col is P1 for PEP,IK1 for KO, PO1 for colanext, On1 for Nestle, SJ1 for Gourmet")
+    st.write("For GT the PPT dashbord img col is T1 for PEP, WE1 for KO, AMP1 for colanext, AKE1 for Nestle,ASV1 for Gourmet")
 
     # ------- Streamlit app -------
 
@@ -100,10 +622,19 @@ def run():
     username = st.text_input('Kobo Username', '')
     password = st.text_input('Kobo Password', type='password')
 
-    concurrency = st.slider('Concurrent downloads', min_value=1, max_value=10, value=3)
+    adaptive = st.checkbox('Adapt concurrency automatically', value=True,
+                           help='Grow parallel downloads while KoBo responds quickly and back off when it throttles (HTTP 429/503).')
+    if adaptive:
+        concurrency = st.slider('Maximum concurrent downloads', min_value=1, max_value=32, value=16)
+    else:
+        concurrency = st.slider('Concurrent downloads', min_value=1, max_value=10, value=3)
     timeout = st.number_input('Request timeout (seconds)', value=20, min_value=5, max_value=120)
     max_retries = st.number_input('Max retries per URL', value=2, min_value=0, max_value=5)
 
+    # Other running jobs are only offered once the same credentials are entered again
+    owner = job_owner(username, password) if username and password else None
+    show_jobs(owner)
+
     uploaded_file = st.file_uploader('Upload Excel or CSV file with links (must include "City" column)', type=['xlsx','xls','csv'])
 
     if uploaded_file is not None and username and password:
@@ -117,7 +648,7 @@ def run():
             st.stop()
 
         st.markdown('**Preview of file**')
-        st.dataframe(df.head(50))
+        paged_table(df, key="kobo_preview", page_size=50)
 
         if "City" not in df.columns:
             st.error("Error: No 'City' column found in file. Please check header names.")
@@ -126,88 +657,47 @@ def run():
         folder_name = st.text_input('Grand folder to save images', value='images_downloaded')
         start_index = st.number_input('Start numbering from', min_value=1, value=1)
 
+        compress = None
+        if st.checkbox('Compress images after download', value=False,
+                       help='Resize, recompress and strip EXIF so the images are small enough for the PPT dashboards.'):
+            cc1, cc2, cc3 = st.columns(3)
+            with cc1:
+                max_dim = st.number_input('Max width/height (px)', value=1600, min_value=320, max_value=6000, step=80)
+            with cc2:
+                quality = st.slider('JPEG quality', min_value=30, max_value=95, value=70)
+            with cc3:
+                keep = st.radio('Compact images', ['Next to originals', 'Replace originals'])
+            compress = {"max_dim": int(max_dim), "quality": int(quality), "replace": keep == 'Replace originals'}
+
         if st.button('Start download'):
-            with st.spinner("Downloading..."):
-                try:
-                    session = requests.Session()
-                    session.auth = HTTPBasicAuth(username, password)
-                    os.makedirs(folder_name, exist_ok=True)
-
-                    results = []
-                    counter = start_index - 1
-
-                    # Skip first fixed columns
-                    fixed_cols = ["start", "end", "Auditor Name", "City", "Survey Date", "Bill Date", "Shop Name"]
-
-                    url_cols = [col for col in df.columns if col not in fixed_cols]
-
-                    future_to_row = {}
-                    with ThreadPoolExecutor(max_workers=concurrency) as executor:
-                        for col in url_cols:
-                            if not df[col].astype(str).str.startswith(("http://","https://")).any():
-                                continue
-
-                            brand_name = sanitize_name(extract_brand_name(col))
-                            brand_prefix = brand_name[:2].upper()
-
-                            for _, row in df.iterrows():
-                                city = sanitize_name(row["City"])
-                                url = str(row[col]).strip()
-                                if not (url.startswith("http://") or url.startswith("https://")):
-                                    continue
-
-                                counter += 1
-                                city_folder = os.path.join(folder_name, brand_name, city)
-                                os.makedirs(city_folder, exist_ok=True)
-
-                                dest_name = f"{city}_{brand_prefix}_bill_{counter}"
-                                future = executor.submit(download_one, session, url, dest_name, city_folder, timeout, max_retries)
-                                future_to_row[future] = (url, brand_name, city)
-
-                        progress_bar = st.progress(0)
-                        done = 0
-                        total = len(future_to_row)
-                        log_lines = []
-
-                        for future in as_completed(future_to_row):
-                            url, brand, city = future_to_row[future]
-                            success, final_name, error = future.result()
-                            done += 1
-                            progress_bar.progress(done/total)
-                            if success:
-                                log_lines.append(f'✅ {brand}/{city}: {url} -> {final_name}')
-                                results.append((url, os.path.join(brand, city, final_name), True, None))
-                            else:
-                                log_lines.append(f'❌ {brand}/{city}: {url} -> {error}')
-                                results.append((url, None, False, error))
-                            if done % 10 == 0:
-                                st.text("\n".join(log_lines[-20:]))
-
-                    # Summary
-                    succ = sum(1 for r in results if r[2])
-                    fail = sum(1 for r in results if not r[2])
-                    st.success(f"Download complete ✅ Successful: {succ}, Failed: {fail}")
-
-                    if succ > 0:
-                        zip_buffer = BytesIO()
-                        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                            for _, fname, ok, _ in results:
-                                if ok and fname:
-                                    fpath = os.path.join(folder_name, fname)
-                                    if os.path.exists(fpath):
-                                        zipf.write(fpath, fname)
-                        zip_buffer.seek(0)
-                        st.download_button('Download ZIP of images', data=zip_buffer, file_name=f'{folder_name}.zip')
-
-                    if fail > 0:
-                        failed_links = [url for url, _, ok, _ in results if not ok]
-                        fail_df = pd.DataFrame(failed_links, columns=['failed_url'])
-                        csv_buffer = BytesIO()
-                        fail_df.to_csv(csv_buffer, index=False)
-                        st.download_button('Download failed links CSV', data=csv_buffer.getvalue(), file_name='failed_links.csv', mime='text/csv')
-
-                except Exception as e:
-                    st.error(f"Error: {e}")
+            try:
+                session = requests.Session()
+                session.auth = HTTPBasicAuth(username, password)
+                adapter = TimedHTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if adaptive:
+                    limiter = AdaptiveConcurrency(initial=min(3, concurrency), maximum=concurrency)
+                else:
+                    limiter = AdaptiveConcurrency(initial=concurrency, minimum=concurrency, maximum=concurrency)
+                os.makedirs(folder_name, exist_ok=True)
+
+                tasks = build_tasks(df, folder_name, start_index)
+                if tasks.empty:
+                    st.warning("No image links (http/https) found in the uploaded file.")
+                else:
+                    job = get_job_registry().submit(
+                        download_job, session, tasks, folder_name, timeout, max_retries, limiter, concurrency,
+                        compress=compress,
+                        label=f"{uploaded_file.name} → {folder_name} ({len(tasks)} images)",
+                        owner=owner,
+                    )
+                    st.session_state["kobo_job"] = job.id
+                    st.query_params["kobo_job"] = job.id
+                    st.rerun()
+
+            except Exception as e:
+                st.error(f"Error: {e}")
 
     else:
 
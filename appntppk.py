@@ -1,6 +1,212 @@
+import re
+from functools import partial
+from io import BytesIO
+
+import numpy as np
 import streamlit as st
 import pandas as pd
 
+from datasets import load_cube, load_dataset
+from pivot_kernel import pivot
+from preview import exact_or_preview, sample_dataset, show_preview
+from result_cache import cached_result
+from query_engine import AGG_FUNCS, add_totals, engine_selector, finalize, partial_aggregates, value_columns
+
+
+# --- Fixed SKUS list ---
+SKUS_REQUIRED = [
+    "SSRB",
+    "300ml/345ml/350ml PET",
+    "500ml PET",
+    "1Ltr PET",
+    "1.5Ltr PET",
+    "2Ltr PET",
+    "2.25Ltr PET"
+]
+
+# --- Region order ---
+REGION_ORDER = [
+    "National",
+    "Faisalabad",
+    "Gujranwala",
+    "Sialkot",
+    "Islamabad",
+    "Karachi",
+    "Hyderabad",
+    "Lahore",
+    "Multan",
+    "Bahawalpur",
+    "Peshawar",
+    "Sukkur",
+    "Rahim Yar Khan"
+]
+
+METRICS = ["NTP", "TP", "CONSUMER PRICE", "Disc per case"]
+KEYS = ["REGION", "Brand", "SKUS"]
+
+
+# --- Create short brand codes ---
+def shorten(name):
+    return "".join([w[:3] for w in name.split()][:2])  # first 2–3 words, 3 letters each
+
+
+def metric_partials(df, filters, engine, dataset_key, national):
+    """Partial aggregates (sum/count/min/max) of every metric present, plus the National rows."""
+    metrics = [m for m in METRICS if m in value_columns(df)]
+    partials = partial_aggregates(df, KEYS, metrics, filters, engine, dataset_key)
+    if national:
+        partials = add_totals(partials, KEYS, metrics, {"REGION": "National"})
+    return partials
+
+
+@cached_result("ntppk")
+def brand_stats(dataset_key, brand, competitor, engine, national, _df):
+    """Every metric's partial aggregates for one brand pair, in a single groupby.
+
+    Any metric x Average/Minimum/Maximum is then a finalize() away.
+    """
+    filters = {"Brand": [brand, competitor], "SKUS": SKUS_REQUIRED}
+    return metric_partials(_df, filters, engine, dataset_key, national)
+
+
+@cached_result("ntppk")
+def comparison_table(dataset_key, brand, competitor, metric, agg_type, engine, national, _df):
+    """REGION x SKU_BrandCode table for one metric and aggregation, sliced from brand_stats()."""
+    stats = brand_stats(dataset_key, brand, competitor, engine, national, _df)
+    return stats_table(stats, brand, competitor, metric, AGG_FUNCS[agg_type])
+
+
+def stats_table(stats, brand, competitor, metric, how):
+    """Lay one metric of brand_stats() reduced with `how` out as the comparison table."""
+    result = finalize(stats, KEYS, metric, how)
+    brand_map = {brand: shorten(brand), competitor: shorten(competitor)}
+
+    # --- Pivot: REGION as rows, SKUS+Brand as columns ---
+    comparison = pivot(result, "REGION", ["SKUS", "Brand"], metric, "first")
+
+    # --- Flatten column MultiIndex into "SKU_BrandCode" ---
+    comparison.columns = [f"{sku}_{brand_map[b]}" for sku, b in comparison.columns]
+
+    # --- Reset index and enforce region order ---
+    comparison = comparison.reset_index()
+    comparison["REGION"] = pd.Categorical(comparison["REGION"], categories=REGION_ORDER, ordered=True)
+    comparison = comparison.sort_values("REGION").reset_index(drop=True)
+
+    # --- Reorder columns (ensure no duplicates) ---
+    ordered_cols = ["REGION"]
+    for sku in SKUS_REQUIRED:
+        for b in [brand, competitor]:
+            col_name = f"{sku}_{brand_map[b]}"
+            if col_name in comparison.columns and col_name not in ordered_cols:
+                ordered_cols.append(col_name)
+
+    comparison = comparison[ordered_cols]
+
+    # --- Deduplicate columns just in case ---
+    return comparison.loc[:, ~comparison.columns.duplicated()]
+
+
+# --- All brand pairs ---
+
+@cached_result("ntppk")
+def all_brand_stats(dataset_key, engine, national, _df):
+    """brand_stats() for every brand at once."""
+    return metric_partials(_df, {"SKUS": SKUS_REQUIRED}, engine, dataset_key, national)
+
+
+def price_index_pairs(stats, value_col):
+    """Price index (brand / competitor x 100) for every ordered brand pair, region and SKU.
+
+    `stats` has one row per REGION x Brand x SKUS. The index is one NumPy
+    broadcast over a (region·SKU) x brand x brand cube; pairs where either
+    value is missing or the competitor's is 0 are left out. Returns the long
+    form: REGION, SKUS, Brand, Competitor, Brand value, Competitor value, Index.
+    """
+    cube = pivot(stats, ["REGION", "SKUS"], "Brand", value_col, "first")
+    brands = cube.columns.to_numpy()
+    values = cube.to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        index = values[:, :, None] / values[:, None, :] * 100
+    valid = np.isfinite(index) & ~np.eye(len(brands), dtype=bool)
+    cell, b, c = np.nonzero(valid)
+
+    return pd.DataFrame({
+        "REGION": pd.Categorical(cube.index.get_level_values("REGION")[cell]),
+        "SKUS": pd.Categorical(cube.index.get_level_values("SKUS")[cell]),
+        "Brand": pd.Categorical.from_codes(b, brands),
+        "Competitor": pd.Categorical.from_codes(c, brands),
+        "Brand value": values[cell, b],
+        "Competitor value": values[cell, c],
+        "Index": index[cell, b, c],
+    })
+
+
+def pair_matrix(pairs, rows=("Brand", "Competitor")):
+    """Price index with `rows` as rows and REGION columns (in region order)."""
+    matrix = pivot(pairs, list(rows), "REGION", "Index", "first")
+    regions = [r for r in REGION_ORDER if r in matrix.columns]
+    regions += [r for r in matrix.columns if r not in regions]
+    matrix = matrix[regions]
+    matrix.columns = pd.Index(regions, name="REGION")
+    return matrix.reset_index()
+
+
+def sheet_name(name):
+    """Excel-safe sheet name (no []:*?/\\, at most 31 characters)."""
+    return re.sub(r"[\[\]:*?/\\]", "-", str(name))[:31]
+
+
+def pairs_workbook(pairs):
+    """One sheet per SKU with the Brand x Competitor by region matrix."""
+    output = BytesIO()
+    skus = [s for s in SKUS_REQUIRED if s in set(pairs["SKUS"])]
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        for sku in skus:
+            pair_matrix(pairs[pairs["SKUS"] == sku]).to_excel(writer, index=False, sheet_name=sheet_name(sku))
+    return output.getvalue()
+
+
+def pairs_parquet(pairs):
+    """Long-form pairs as Parquet; the categorical columns are stored dictionary-encoded."""
+    output = BytesIO()
+    pairs.to_parquet(output, index=False)
+    return output.getvalue()
+
+
+def show_all_pairs(dataset_key, engine, df, metric, agg_type, national):
+    stats = all_brand_stats(dataset_key, engine, national, df)
+    pairs = price_index_pairs(finalize(stats, KEYS, metric, AGG_FUNCS[agg_type]), metric)
+    if pairs.empty:
+        st.warning("⚠️ No brand pairs with data for the required SKUs.")
+        return
+
+    n_brands = len(pairs["Brand"].cat.categories)
+    st.subheader(f"{metric} ({agg_type}) price index - all brand pairs")
+    st.caption(f"{len(pairs):,} region × SKU × pair values across {n_brands} brands "
+               "(Index = brand / competitor × 100).")
+
+    view_brand = st.selectbox("Show brand", list(pairs["Brand"].cat.categories), key="ntppk_pairs_brand")
+    st.dataframe(pair_matrix(pairs[pairs["Brand"] == view_brand], rows=("Competitor", "SKUS")).round(0))
+
+    d1, d2 = st.columns(2)
+    with d1:
+        st.download_button(
+            label="📥 Download all pairs (Excel, one sheet per SKU)",
+            data=partial(pairs_workbook, pairs),
+            file_name="brand_pairs_price_index.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore",
+        )
+    with d2:
+        st.download_button(
+            label="📥 Download all pairs (Parquet, long form)",
+            data=partial(pairs_parquet, pairs),
+            file_name="brand_pairs_price_index.parquet",
+            mime="application/octet-stream",
+            on_click="ignore",
+        )
+
+
 def run():
     st.title("📊 NTP PEP vs KO App")
     st.write("This app performs to find NTP using file Raw data from date to date.")
@@ -33,96 +239,49 @@ def run():
 
     if uploaded_file:
         # Load file
-        if uploaded_file.name.endswith(".csv"):
-            df = pd.read_csv(uploaded_file)
+        chunked = st.sidebar.checkbox("Large file: aggregate while reading", key="ntppk_chunked",
+                                      help="Reads the upload in chunks into per-group sums, counts, minima "
+                                           "and maxima instead of loading every row.")
+        if chunked:
+            dataset_key, df = load_cube(uploaded_file, KEYS, METRICS)
         else:
-            df = pd.read_excel(uploaded_file)
+            dataset_key, df = load_dataset(uploaded_file)
+        engine = engine_selector()
 
         st.success("✅ Dataset uploaded successfully!")
 
-        # --- Fixed SKUS list ---
-        skus_required = [
-            "SSRB",
-            "300ml/345ml/350ml PET",
-            "500ml PET",
-            "1Ltr PET",
-            "1.5Ltr PET",
-            "2Ltr PET",
-            "2.25Ltr PET"
-        ]
-
-        # --- Region order ---
-        region_order = [
-            "National",
-            "Faisalabad",
-            "Gujranwala",
-            "Sialkot",
-            "Islamabad",
-            "Karachi",
-            "Hyderabad",
-            "Lahore",
-            "Multan",
-            "Bahawalpur",
-            "Peshawar",
-            "Sukkur",
-            "Rahim Yar Khan"
-        ]
-
         # --- User options ---
-        col1, col2 = st.columns(2)
-
-        with col1:
-            brand = st.selectbox("Select Brand", df["Brand"].unique())
-        with col2:
-            competitor = st.selectbox("Select Competitor", df["Brand"].unique())
-
-        metric = st.selectbox("Select Metric", ["NTP", "TP", "CONSUMER PRICE", "Disc per case"])
-        agg_type = st.radio("Choose Aggregation", ["Average", "Minimum", "Maximum"])
+        mode = st.radio("Mode", ["Brand vs Competitor", "All brand pairs"], horizontal=True)
 
-        # --- Filter dataset ---
-        df_filtered = df[df["Brand"].isin([brand, competitor]) & df["SKUS"].isin(skus_required)]
-
-        # --- Group and aggregate ---
-        if agg_type == "Average":
-            result = df_filtered.groupby(["REGION", "Brand", "SKUS"])[metric].mean().reset_index()
-        elif agg_type == "Minimum":
-            result = df_filtered.groupby(["REGION", "Brand", "SKUS"])[metric].min().reset_index()
-        else:  # Maximum
-            result = df_filtered.groupby(["REGION", "Brand", "SKUS"])[metric].max().reset_index()
-
-        # --- Create short brand codes ---
-        def shorten(name):
-            return "".join([w[:3] for w in name.split()][:2])  # first 2–3 words, 3 letters each
-        brand_map = {brand: shorten(brand), competitor: shorten(competitor)}
-
-        # --- Pivot: REGION as rows, SKUS+Brand as columns ---
-        comparison = result.pivot_table(
-            index="REGION",
-            columns=["SKUS", "Brand"],
-            values=metric,
-            aggfunc="first"
-        )
+        if mode == "Brand vs Competitor":
+            col1, col2 = st.columns(2)
 
-        # --- Flatten column MultiIndex into "SKU_BrandCode" ---
-        comparison.columns = [f"{sku}_{brand_map[b]}" for sku, b in comparison.columns]
+            with col1:
+                brand = st.selectbox("Select Brand", df["Brand"].unique())
+            with col2:
+                competitor = st.selectbox("Select Competitor", df["Brand"].unique())
 
-        # --- Reset index and enforce region order ---
-        comparison = comparison.reset_index()
-        comparison["REGION"] = pd.Categorical(comparison["REGION"], categories=region_order, ordered=True)
-        comparison = comparison.sort_values("REGION").reset_index(drop=True)
+        metric = st.selectbox("Select Metric", METRICS)
+        agg_type = st.radio("Choose Aggregation", ["Average", "Minimum", "Maximum"])
+        national = st.checkbox("Compute National row from all regions", value=True,
+                               help="National is pooled from the regions' sums and counts; "
+                                    "National rows in the upload are replaced.")
 
-        # --- Reorder columns (ensure no duplicates) ---
-        ordered_cols = ["REGION"]
-        for sku in skus_required:
-            for b in [brand, competitor]:
-                col_name = f"{sku}_{brand_map[b]}"
-                if col_name in comparison.columns and col_name not in ordered_cols:  
-                    ordered_cols.append(col_name)
+        if metric not in value_columns(df):
+            st.error(f"❌ Column '{metric}' not found in the dataset.")
+            return
 
-        comparison = comparison[ordered_cols]
+        if mode == "All brand pairs":
+            show_all_pairs(dataset_key, engine, df, metric, agg_type, national)
+            return
 
-        # --- Deduplicate columns just in case ---
-        comparison = comparison.loc[:, ~comparison.columns.duplicated()]
+        # --- All metrics x aggregations are computed once per brand pair; this only slices ---
+        comparison, preview_job = exact_or_preview(comparison_table, df, dataset_key, brand, competitor, metric,
+                                                   agg_type, engine, national, strata=KEYS)
+        if preview_job is not None:
+            sample_key, sample = sample_dataset(df, dataset_key, KEYS)
+            sample_stats = brand_stats(sample_key, brand, competitor, engine, national, sample)
+            show_preview(preview_job, stats_table(sample_stats, brand, competitor, metric, "count"))
 
         # --- Show table ---
         st.subheader(f"{metric} - {agg_type} by Region & SKUs")
@@ -0,0 +1,107 @@
+from functools import partial
+from io import BytesIO
+
+import pandas as pd
+import streamlit as st
+
+from datasets import load_dataset
+from query_engine import distinct, engine_selector
+from snapshot_diff import KEYS, METRICS, STATUSES, week_diff
+from table_viewer import paged_table
+
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def diff_workbook(diff, metrics):
+    """The full diff on one sheet, plus one sheet per metric with its four columns."""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        diff.to_excel(writer, index=False, sheet_name="All metrics")
+        for m in metrics:
+            cols = KEYS + ["Status"] + [f"{m}_{part}" for part in ("last", "this", "change", "change_%")]
+            diff[cols].to_excel(writer, index=False, sheet_name=m.replace("/", "-")[:31])
+    return output.getvalue()
+
+
+def filter_options(frames, column):
+    """["All"] + the values of `column` in any of the snapshots that have it."""
+    values = set()
+    for dataset_key, df in frames:
+        if column in df.columns:
+            values.update(distinct(df, column, dataset_key=dataset_key))
+    return ["All"] + sorted(values, key=str)
+
+
+def run():
+    st.title("📅 Week over Week")
+    st.write("Upload last week's and this week's All Data files to compare their prices per Region, Brand and SKU.")
+
+    c1, c2 = st.columns(2)
+    with c1:
+        previous_file = st.file_uploader("Last week's file", type=["xlsx", "csv"], key="weekdiff_previous")
+    with c2:
+        current_file = st.file_uploader("This week's file", type=["xlsx", "csv"], key="weekdiff_current")
+    if not previous_file or not current_file:
+        st.info("Please upload both files to begin.")
+        st.stop()
+
+    previous_key, previous = load_dataset(previous_file)
+    current_key, current = load_dataset(current_file)
+    engine = engine_selector()
+    if previous_key == current_key:
+        st.warning("⚠️ Both uploads are the same file.")
+
+    missing = [k for k in KEYS if k not in previous.columns or k not in current.columns]
+    if missing:
+        st.error(f"❌ Both files need the columns {', '.join(KEYS)}; missing: {', '.join(missing)}")
+        st.stop()
+
+    # --- Filters applied to both weeks ---
+    frames = [(previous_key, previous), (current_key, current)]
+    f1, f2, f3 = st.columns([1, 1, 1])
+    with f1:
+        channel = st.selectbox("Select Channel", filter_options(frames, "CHANNEL"))
+    with f2:
+        cat = st.selectbox("Select Category (CAT)", filter_options(frames, "CAT"))
+    with f3:
+        national = st.checkbox("Compute National row from all regions", value=True)
+    filters = {col: value for col, value in (("CHANNEL", channel), ("CAT", cat)) if value != "All"}
+    for col in filters:
+        if col not in previous.columns or col not in current.columns:
+            st.error(f"❌ Only one of the files has a {col} column, so it can't filter both weeks.")
+            st.stop()
+
+    diff = week_diff(current_key, previous_key, filters, national, engine, current, previous)
+    metrics = [m for m in METRICS if f"{m}_last" in diff.columns]
+    if diff.empty or not metrics:
+        st.warning("⚠️ No data to compare for the selected filters.")
+        st.stop()
+
+    # --- Summary ---
+    counts = diff["Status"].value_counts()
+    s1, s2, s3 = st.columns(3)
+    s1.metric("Groups in both weeks", f"{counts.get(STATUSES['both'], 0):,}")
+    s2.metric("Appeared this week", f"{counts.get(STATUSES['right_only'], 0):,}")
+    s3.metric("Vanished since last week", f"{counts.get(STATUSES['left_only'], 0):,}")
+
+    # --- One metric's changes ---
+    v1, v2 = st.columns([1, 2])
+    with v1:
+        metric = st.selectbox("Select Metric", metrics)
+    with v2:
+        statuses = st.multiselect("Show", list(STATUSES.values()), default=list(STATUSES.values()))
+    cols = KEYS + ["Status"] + [f"{metric}_{part}" for part in ("last", "this", "change", "change_%")]
+    view = diff.loc[diff["Status"].isin(statuses), cols].round(2).reset_index(drop=True)
+
+    st.subheader(f"{metric}: last week vs this week")
+    paged_table(view, key="weekdiff_table",
+                result_key=f"{previous_key}-{current_key}-{sorted(filters.items())}-{national}-{metric}-{statuses}")
+
+    st.download_button(
+        label="📥 Download comparison (Excel, all metrics)",
+        data=partial(diff_workbook, diff, metrics),
+        file_name="week_over_week.xlsx",
+        mime=XLSX_MIME,
+        on_click="ignore",
+    )
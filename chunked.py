@@ -0,0 +1,126 @@
+"""
+Out-of-core aggregation for exports that don't fit in memory once parsed.
+
+Instead of parsing the whole upload into one DataFrame, scan_cube() reads it
+in chunks (pd.read_csv(chunksize=...) for CSV, openpyxl's read-only row
+stream for Excel), reduces every chunk to mergeable sum/count/min/max
+partials per key combination and folds them into a running "cube". Only one
+chunk and the cube are in memory at a time, and the cube has one row per
+distinct key combination, not per data row.
+
+The keys are the page's grouping keys (REGION x BRAND x SKUS) plus the
+columns its filters look at, so query_engine.partial_aggregates() can apply
+the filters to the cube and merge it down to the page's groups exactly as it
+would on the raw rows (see query_engine.PARTIALS_ATTR). Filters known before
+reading can also be applied to each chunk to keep the cube smaller.
+"""
+
+from io import BytesIO
+
+import pandas as pd
+
+from query_engine import PARTIAL_AGGS, PARTIALS_ATTR, _MERGE, agg_column, filter_mask
+
+
+CHUNK_ROWS = 200_000
+
+
+def _is_csv(name):
+    return name.lower().endswith(".csv")
+
+
+def _header(row):
+    return [f"Unnamed: {i}" if c is None else str(c) for i, c in enumerate(row)]
+
+
+def read_columns(name, data):
+    """Column names of a CSV/Excel upload without parsing its rows."""
+    if _is_csv(name):
+        return list(pd.read_csv(BytesIO(data), nrows=0).columns)
+    from openpyxl import load_workbook
+
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        return _header(next(wb.worksheets[0].iter_rows(max_row=1, values_only=True), ()))
+    finally:
+        wb.close()
+
+
+def _excel_chunks(data, chunksize, usecols):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        columns = _header(next(rows, ()))
+        keep = [i for i, c in enumerate(columns) if usecols is None or c in usecols]
+        total = ws.max_row or 0
+        batch, done = [], 1
+        for row in rows:
+            batch.append([row[i] if i < len(row) else None for i in keep])
+            if len(batch) == chunksize:
+                done += len(batch)
+                yield pd.DataFrame(batch, columns=[columns[i] for i in keep]), min(done / total, 1.0) if total else None
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=[columns[i] for i in keep]), 1.0
+    finally:
+        wb.close()
+
+
+def iter_chunks(name, data, chunksize=CHUNK_ROWS, usecols=None):
+    """Yield (chunk DataFrame, fraction of the file read or None) for CSV/Excel bytes."""
+    if not _is_csv(name):
+        yield from _excel_chunks(data, chunksize, usecols)
+        return
+    buffer = BytesIO(data)
+    with pd.read_csv(buffer, chunksize=chunksize, usecols=usecols) as reader:
+        for chunk in reader:
+            yield chunk, min(buffer.tell() / max(len(data), 1), 1.0)
+
+
+def chunk_partials(chunk, keys, values, filters=None):
+    """sum/count/min/max of `values` per combination of `keys` (null keys kept) in one chunk."""
+    mask = filter_mask(chunk, filters)
+    if mask is not None:
+        chunk = chunk[mask]
+    grouped = chunk.groupby(keys, sort=False, dropna=False)
+    if not values:
+        return grouped.size().reset_index()[keys]
+    parts = grouped[values].agg(PARTIAL_AGGS)
+    parts.columns = [agg_column(v, h) for v, h in parts.columns]
+    return parts.reset_index()
+
+
+def merge_cube(parts, keys, values):
+    """Merge partials frames into one row per key combination, keeping null keys and first-seen order."""
+    merged = pd.concat(parts, ignore_index=True)
+    grouped = merged.groupby(keys, sort=False, dropna=False)
+    if not values:
+        return grouped.size().reset_index()[keys]
+    spec = {agg_column(v, h): _MERGE[h] for v in values for h in PARTIAL_AGGS}
+    return grouped[list(spec)].agg(spec).reset_index()
+
+
+def scan_cube(name, data, keys, values, filters=None, chunksize=CHUNK_ROWS, progress=None):
+    """Stream a CSV/Excel upload into a cube of partial aggregates of `values` per `keys`.
+
+    `filters` (query_engine format) are applied to every chunk. `progress`
+    is called after each chunk with (chunks read, rows read, fraction of the
+    file read or None). The cube lists its value columns in
+    cube.attrs[PARTIALS_ATTR].
+    """
+    keys, values = list(keys), list(values)
+    usecols = set(keys) | set(values) | set(filters or ())
+    cube, rows = None, 0
+    for i, (chunk, done) in enumerate(iter_chunks(name, data, chunksize, usecols)):
+        part = chunk_partials(chunk, keys, values, filters)
+        cube = part if cube is None else merge_cube([cube, part], keys, values)
+        rows += len(chunk)
+        if progress is not None:
+            progress(i + 1, rows, done)
+    if cube is None:
+        cube = pd.DataFrame(columns=keys + [agg_column(v, h) for v in values for h in PARTIAL_AGGS])
+    cube.attrs[PARTIALS_ATTR] = values
+    return cube
@@ -0,0 +1,124 @@
+"""
+Uploaded datasets, parsed once per server process.
+
+Every analysis page used to re-parse its upload on each rerun. load_dataset()
+keys the upload by the SHA-1 of its bytes and keeps the parsed DataFrame in
+st.cache_resource, so reruns and other sessions asking about the same file get
+the same frame back together with its dataset key. Pages must treat that
+frame as read-only and work on filtered copies.
+
+The parsed frame is also published to the machine's shared dataset registry
+(see shared_datasets.py), so the other server processes map the same copy
+instead of parsing and holding their own.
+
+Exports too large to parse whole can be loaded with load_cube() instead: the
+file is streamed in chunks into a cube of partial aggregates (see
+chunked.py), with a progress bar while it is read. The cubes are kept in a
+process-wide store rather than in st.cache_resource: a cached function
+replays the elements it drew, so the progress bar has to be drawn by the
+page. A session that asks for a cube another session is reading waits for
+it under a spinner.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+import streamlit as st
+
+from chunked import CHUNK_ROWS, read_columns, scan_cube
+from shared_datasets import get_shared_datasets
+
+
+def dataset_key(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def read_table(name, data):
+    """Parse CSV/Excel bytes into a DataFrame, picking the reader from the file name."""
+    if name.lower().endswith(".csv"):
+        return pd.read_csv(BytesIO(data))
+    return pd.read_excel(BytesIO(data))
+
+
+@st.cache_resource(max_entries=8, show_spinner="Reading dataset...")
+def _load(key, name, _data):
+    shared = get_shared_datasets()
+    if shared is None:
+        return read_table(name, _data)
+    df = shared.attach(key)
+    if df is None:
+        df = shared.publish(key, read_table(name, _data))
+    return df
+
+
+def load_dataset(uploaded_file):
+    """(dataset key, DataFrame) for a Streamlit upload; parsed once per distinct file content."""
+    data = uploaded_file.getvalue()
+    key = dataset_key(data)
+    return key, _load(key, uploaded_file.name, data)
+
+
+# Cubes kept per server process; the least recently used are dropped
+MAX_CUBES = 8
+
+
+@st.cache_resource
+def _cube_store():
+    """Cubes read so far plus one lock per cube being read, so each is read once."""
+    return {"cubes": OrderedDict(), "reading": {}, "lock": threading.Lock()}
+
+
+def _read_cube(name, data, keys, values, chunksize):
+    bar = st.progress(0.0, text="Reading in chunks...")
+
+    def progress(chunks, rows, done):
+        bar.progress(done or 0.0, text=f"Reading in chunks: {chunks} chunks, {rows:,} rows")
+
+    cube = scan_cube(name, data, keys, values, chunksize=chunksize, progress=progress)
+    bar.empty()
+    return cube
+
+
+def _load_cube(key, name, keys, values, chunksize, data):
+    store = _cube_store()
+    call = (key, keys, values, chunksize)
+    with store["lock"]:
+        reading = store["reading"].setdefault(call, threading.Lock())
+    if not reading.acquire(blocking=False):
+        with st.spinner("Another session is reading this file..."):
+            reading.acquire()
+    try:
+        with store["lock"]:
+            cube = store["cubes"].get(call)
+            if cube is not None:
+                store["cubes"].move_to_end(call)
+        if cube is None:
+            cube = _read_cube(name, data, keys, values, chunksize)
+            with store["lock"]:
+                store["cubes"][call] = cube
+                while len(store["cubes"]) > MAX_CUBES:
+                    store["cubes"].popitem(last=False)
+    finally:
+        with store["lock"]:
+            reading.release()
+            store["reading"].pop(call, None)
+    return cube
+
+
+def load_cube(uploaded_file, keys, values, chunksize=CHUNK_ROWS):
+    """(cube key, cube) for a Streamlit upload read in chunks; see chunked.scan_cube().
+
+    Keys and values the file doesn't have are left out. The cube key differs
+    from the upload's dataset key, so engine and result caches keep the cube
+    apart from the fully parsed frame.
+    """
+    data = uploaded_file.getvalue()
+    key = dataset_key(data)
+    columns = read_columns(uploaded_file.name, data)
+    keys = [c for c in keys if c in columns]
+    values = [c for c in values if c in columns]
+    cube = _load_cube(key, uploaded_file.name, tuple(keys), tuple(values), chunksize, data)
+    return f"{key}-cube-{dataset_key(repr((tuple(keys), tuple(values))).encode())[:8]}", cube
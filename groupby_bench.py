@@ -0,0 +1,90 @@
+"""
+Benchmark the partitioned process-pool groupby against single-threaded pandas.
+
+Builds a synthetic upload (REGION x SKUS x BRAND plus CHANNEL/WEEK filter
+columns and four price metrics), runs the All Data style query
+"filter, group by REGION/BRAND/SKUS, sum/count/min/max every metric" with
+query_engine's pandas path and with parallel_groupby.ParallelBackend for
+each worker count, checks the results are equal and reports the timings.
+The first parallel run per dataset, which exports the columns to shared
+memory, is reported separately.
+
+Usage:
+    python groupby_bench.py --rows 1000000,10000000 --workers 1,4,16
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from parallel_groupby import ParallelBackend
+from pivot_bench import make_table, timed
+from query_engine import PARTIAL_AGGS, _aggregate_pandas
+
+
+KEYS = ["REGION", "BRAND", "SKUS"]
+VALUES = ["NTP", "TP", "CP", "PROMO"]
+
+
+def make_upload(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = make_table(rows, seed=seed).rename(columns={"VALUE": "NTP"})
+    for i, col in enumerate(VALUES[1:], 1):
+        df[col] = df["NTP"] * (1 + 0.05 * i) + rng.normal(0, 10, rows)
+    df["CHANNEL"] = np.array(["GT", "WS"], dtype=object)[rng.integers(0, 2, rows)]
+    df["WEEK"] = np.array([f"W{i}" for i in range(1, 5)], dtype=object)[rng.integers(0, 4, rows)]
+    return df
+
+
+def bench(df, workers, repeat=3):
+    """Report rows for one dataset: pandas once, then every worker count."""
+    filters = {"CHANNEL": "GT", "WEEK": ["W1", "W2"]}
+    pandas_s, expected = timed(lambda: _aggregate_pandas(df, KEYS, VALUES, PARTIAL_AGGS, filters), repeat)
+    report = []
+    for n in workers:
+        backend = ParallelBackend(workers=n)
+        try:
+            # Warm the pool and export the columns once; that cost is reported on its own
+            export_s, _ = timed(lambda: backend.aggregate(df, "bench", KEYS, VALUES, PARTIAL_AGGS, filters), 1)
+            parallel_s, got = timed(lambda: backend.aggregate(df, "bench", KEYS, VALUES, PARTIAL_AGGS, filters),
+                                    repeat)
+        finally:
+            backend.close()
+        pd.testing.assert_frame_equal(expected, got, check_dtype=False, rtol=1e-9)
+        report.append({
+            "rows": len(df),
+            "workers": n,
+            "pandas_s": round(pandas_s, 4),
+            "first_parallel_s": round(export_s, 4),
+            "parallel_s": round(parallel_s, 4),
+            "speedup": round(pandas_s / parallel_s, 1),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", default="1000000,10000000", help="comma-separated row counts")
+    parser.add_argument("--workers", default=",".join(str(n) for n in sorted({1, 4, os.cpu_count() or 1})),
+                        help="comma-separated process pool sizes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default=None, help="also write the report to this CSV")
+    args = parser.parse_args()
+
+    report = []
+    for rows in [int(r) for r in args.rows.split(",")]:
+        df = make_upload(rows)
+        for row in bench(df, [int(n) for n in args.workers.split(",")], args.repeat):
+            report.append(row)
+            print(row, flush=True)
+
+    report = pd.DataFrame(report)
+    print(report.to_string(index=False))
+    if args.out:
+        report.to_csv(args.out, index=False)
+
+
+if __name__ == "__main__":
+    main()
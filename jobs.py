@@ -0,0 +1,163 @@
+"""
+Process-wide registry of background jobs.
+
+Streamlit reruns the page script on every widget change and drops it when the
+browser refreshes, so anything long-running started from a button handler is
+lost. Jobs submitted here run on the registry's own worker threads, publish
+progress through a shared JobStatus, and can be looked up again by id from any
+session in the same server process.
+"""
+
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+ACTIVE_STATES = ("queued", "running", "cancelling")
+
+
+class JobStatus:
+    """Progress shared between a job's worker thread and the pages polling it.
+
+    Only the last `log_size` log lines are kept in memory; call log_to() to
+    also append every line to a file that can be downloaded afterwards.
+    """
+
+    def __init__(self, log_size=20):
+        self._lock = threading.Lock()
+        self._log_file = None
+        self.state = "queued"
+        self.total = 0
+        self.done = 0
+        self.counts = {}
+        self.log = deque(maxlen=log_size)
+        self.log_path = None
+        self.message = ""
+        self.extra = {}
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def update(self, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                setattr(self, key, value)
+
+    def advance(self, outcome, line=None):
+        """Count one finished unit of work under `outcome` and optionally log a line."""
+        with self._lock:
+            self.done += 1
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            if line is not None:
+                self.log.append(line)
+                if self._log_file is not None:
+                    self._log_file.write(line + "\n")
+
+    def log_to(self, path):
+        """Also write every log line to `path` (the full log; the in-memory one is a ring buffer)."""
+        with self._lock:
+            self._log_file = open(path, "w", encoding="utf-8")
+            self.log_path = path
+
+    def close_log(self):
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+
+    def snapshot(self):
+        """Consistent copy of the status for rendering."""
+        with self._lock:
+            return {
+                "state": self.state,
+                "total": self.total,
+                "done": self.done,
+                "counts": dict(self.counts),
+                "log": list(self.log),
+                "log_path": self.log_path,
+                "message": self.message,
+                "extra": dict(self.extra),
+                "result": self.result,
+                "error": self.error,
+                "started": self.started,
+                "finished": self.finished,
+            }
+
+
+class Job:
+    """One unit of background work; `target(job, *args, **kwargs)` does the work."""
+
+    def __init__(self, target, args, kwargs, label="", owner=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.owner = owner
+        self.created = time.time()
+        self.status = JobStatus()
+        self.cancel_event = threading.Event()
+        self._target = target
+        self._args = args
+        self._kwargs = kwargs
+
+    @property
+    def active(self):
+        return self.status.state in ACTIVE_STATES
+
+    def cancel(self):
+        if self.active:
+            self.cancel_event.set()
+            self.status.update(state="cancelling")
+
+    def _run(self):
+        if self.cancel_event.is_set():
+            self.status.update(state="cancelled", finished=time.time())
+            return
+        self.status.update(state="running", started=time.time())
+        try:
+            result = self._target(self, *self._args, **self._kwargs)
+        except Exception as e:
+            self.status.update(state="failed", error=f"{e}\n{traceback.format_exc()}", finished=time.time())
+        else:
+            state = "cancelled" if self.cancel_event.is_set() else "done"
+            self.status.update(state=state, result=result, finished=time.time())
+        finally:
+            self.status.close_log()
+
+
+class JobRegistry:
+    """Runs jobs on a small pool of worker threads and remembers recent ones."""
+
+    def __init__(self, max_workers=2, keep=20):
+        self.keep = keep
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, target, *args, label="", owner=None, **kwargs):
+        job = Job(target, args, kwargs, label=label, owner=owner)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(job._run)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, owner=None, active_only=False):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if owner is not None:
+            jobs = [j for j in jobs if j.owner == owner]
+        if active_only:
+            jobs = [j for j in jobs if j.active]
+        return sorted(jobs, key=lambda j: j.created, reverse=True)
+
+    def _prune(self):
+        finished = sorted((j for j in self._jobs.values() if not j.active), key=lambda j: j.created)
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job.id]
@@ -0,0 +1,76 @@
+"""
+Post-download resize/recompress stage for KoBo bill photos.
+
+Phone photos arrive at 3-8 MB but only end up as small pictures in the PPT
+dashboards. This stage shrinks each image to a maximum dimension, re-encodes
+it as JPEG at a target quality and drops EXIF (after applying its rotation),
+either next to the original or in place of it. The work is CPU-bound, so it
+runs in a process pool.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from PIL import Image, ImageOps
+
+from spawn_pool import bare_main
+
+
+COMPACT_SUFFIX = "_compact"
+
+
+def compact_path(path, replace=False):
+    """Where the compact JPEG for `path` is written."""
+    stem = os.path.splitext(path)[0]
+    return f"{stem}.jpg" if replace else f"{stem}{COMPACT_SUFFIX}.jpg"
+
+
+def compact_image(path, max_dim=1600, quality=70, replace=False):
+    """Resize/recompress one image; returns (ok, out_path, bytes_before, bytes_after, error)."""
+    try:
+        before = os.path.getsize(path)
+        with Image.open(path) as img:
+            # Bake the EXIF orientation into the pixels before EXIF is dropped
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+            out_path = compact_path(path, replace)
+            tmp_path = out_path + ".tmp"
+            img.save(tmp_path, "JPEG", quality=quality, optimize=True, progressive=True)
+        os.replace(tmp_path, out_path)
+        if replace and os.path.abspath(out_path) != os.path.abspath(path):
+            os.remove(path)
+        return True, out_path, before, os.path.getsize(out_path), None
+    except Exception as e:
+        return False, None, 0, 0, str(e)
+
+
+def _compact_args(args):
+    return compact_image(*args)
+
+
+def compact_images(paths, max_dim=1600, quality=70, replace=False, workers=None, progress=None):
+    """Compact many images in a process pool.
+
+    Yields (path, result) in input order; `progress(done, total)` is called as
+    results come back. A spawn context is used because the caller is usually
+    a threaded Streamlit server, where forking is unsafe; the workers start
+    while the jobs are submitted, so that happens under bare_main().
+    """
+    paths = list(paths)
+    total = len(paths)
+    if not total:
+        return
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    ctx = multiprocessing.get_context("spawn")
+    jobs = [(p, max_dim, quality, replace) for p in paths]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        chunksize = max(1, min(32, total // (workers * 4)))
+        with bare_main():
+            results = pool.map(_compact_args, jobs, chunksize=chunksize)
+        for done, (path, result) in enumerate(zip(paths, results), 1):
+            if progress is not None:
+                progress(done, total)
+            yield path, result
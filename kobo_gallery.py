@@ -0,0 +1,140 @@
+"""
+Lazy thumbnail gallery for downloaded KoBo images.
+
+Lets reviewers page through the photos of one Brand/City folder to spot wrong
+or blank bills without pulling the whole ZIP. Thumbnails are only made for the
+page being viewed and are cached on disk under the SHA-1 of the image bytes,
+so re-downloads of the same photo (or another job's copy) reuse them. The
+cache is capped at THUMB_CACHE_MAX_BYTES; the least recently shown
+thumbnails are deleted first.
+"""
+
+import hashlib
+import math
+import os
+import threading
+
+import streamlit as st
+from PIL import Image, ImageOps
+
+from kobo_compress import COMPACT_SUFFIX
+
+
+THUMB_CACHE_DIR = ".kobo_thumbs"
+THUMB_CACHE_MAX_BYTES = 256 << 20
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tif", ".tiff", ".heic"}
+
+# (path, mtime, size) -> content hash, so unchanged files are hashed once per process
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def content_hash(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _hash_lock:
+        digest = _hash_memo.get(key)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        with _hash_lock:
+            _hash_memo[key] = digest
+    return digest
+
+
+def thumbnail(path, size=256, cache_dir=THUMB_CACHE_DIR):
+    """Path of a cached JPEG thumbnail of `path`, creating it if needed; None if unreadable."""
+    try:
+        thumb_path = os.path.join(cache_dir, f"{content_hash(path)}_{size}.jpg")
+        if os.path.exists(thumb_path):
+            # The mtime marks when a thumbnail was last shown, for trim_thumbnails()
+            os.utime(thumb_path)
+            return thumb_path
+        os.makedirs(cache_dir, exist_ok=True)
+        with Image.open(path) as img:
+            # Let the JPEG decoder downscale while decoding; much cheaper than a full decode
+            img.draft("RGB", (size, size))
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.thumbnail((size, size))
+            tmp_path = thumb_path + ".tmp"
+            img.save(tmp_path, "JPEG", quality=80)
+        os.replace(tmp_path, thumb_path)
+        return thumb_path
+    except Exception:
+        return None
+
+
+def trim_thumbnails(cache_dir=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MAX_BYTES):
+    """Delete the least recently shown thumbnails until the cache fits in `max_bytes`."""
+    try:
+        entries = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(cache_dir) if e.is_file())
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def list_images(folder_name):
+    """{brand: {city: [file names]}} for the downloaded images (compact variants left out)."""
+    layout = {}
+    if not os.path.isdir(folder_name):
+        return layout
+    for brand in sorted(os.listdir(folder_name)):
+        brand_dir = os.path.join(folder_name, brand)
+        if not os.path.isdir(brand_dir):
+            continue
+        for city in sorted(os.listdir(brand_dir)):
+            city_dir = os.path.join(brand_dir, city)
+            if not os.path.isdir(city_dir):
+                continue
+            files = [f for f in sorted(os.listdir(city_dir))
+                     if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS
+                     and not os.path.splitext(f)[0].endswith(COMPACT_SUFFIX)]
+            if files:
+                layout.setdefault(brand, {})[city] = files
+    return layout
+
+
+def show_gallery(folder_name, key="gallery", columns=5):
+    """Paginated thumbnail grid for one Brand/City folder at a time."""
+    layout = list_images(folder_name)
+    if not layout:
+        st.info("No downloaded images to review yet.")
+        return
+
+    g1, g2, g3 = st.columns(3)
+    with g1:
+        brand = st.selectbox("Brand", list(layout), key=f"{key}_brand")
+    with g2:
+        city = st.selectbox("City", list(layout[brand]), key=f"{key}_city")
+    with g3:
+        per_page = st.selectbox("Images per page", [10, 20, 40], index=1, key=f"{key}_per_page")
+
+    files = layout[brand][city]
+    pages = max(1, math.ceil(len(files) / per_page))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"{key}_page")
+    visible = files[(page - 1) * per_page:page * per_page]
+    st.caption(f"{len(files)} images in {brand}/{city}; showing {len(visible)}.")
+
+    city_dir = os.path.join(folder_name, brand, city)
+    grid = st.columns(columns)
+    for i, name in enumerate(visible):
+        with grid[i % columns]:
+            thumb = thumbnail(os.path.join(city_dir, name))
+            if thumb is None:
+                st.warning(f"Can't preview {name}")
+            else:
+                st.image(thumb, caption=name, width='stretch')
+    trim_thumbnails()
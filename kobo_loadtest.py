@@ -0,0 +1,290 @@
+"""
+Local KoBo stand-in server and downloader load-test harness.
+
+Runs the KoBo image downloader (appdkoboimages.build_tasks / stream_downloads /
+download_one) against a local HTTP server instead of real KoBo, so download
+performance can be tuned and regression-tested offline.
+
+The stand-in server requires Basic Auth and serves synthetic JPEGs with
+configurable latency, bandwidth, transient 500s, 429s (random and when more
+than `capacity` requests are in flight), redirects and duplicate URLs. The
+harness runs the downloader at several concurrency levels and reports
+throughput, peak Python memory and whether the Brand/City folder layout and
+file contents came out right.
+
+Usage:
+    python kobo_loadtest.py --rows 500 --concurrency 1,4,8,16 --latency 0.05 --capacity 8
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import requests
+from requests.auth import HTTPBasicAuth
+
+import appdkoboimages as kobo
+from kobo_metrics import DownloadMetrics, TimedHTTPAdapter
+
+
+JPEG_MAGIC = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+
+
+def synthetic_image(image_id, size):
+    """Deterministic JPEG-looking payload of `size` bytes for `image_id`."""
+    seed = hashlib.sha256(str(image_id).encode()).digest()
+    body = (seed * (size // len(seed) + 1))[:max(0, size - len(JPEG_MAGIC))]
+    return JPEG_MAGIC + body
+
+
+# ------- Stand-in server -------
+
+class StandInServer:
+    """Threaded HTTP server that behaves like a (slow, flaky) KoBo media endpoint."""
+
+    def __init__(self, username="kobo", password="secret", latency=0.02, bandwidth=None,
+                 error_rate=0.0, throttle_rate=0.0, capacity=None, image_bytes=200_000, seed=0):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.capacity = capacity
+        self.image_bytes = image_bytes
+        self.hits = {}
+        self.statuses = {}
+        self.in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._expected_auth = "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _count(self, status):
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=b"", headers=None):
+                server._count(status)
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self._send_body(body)
+
+            def _send_body(self, body):
+                if not server.bandwidth:
+                    self.wfile.write(body)
+                    return
+                chunk = 16384
+                for i in range(0, len(body), chunk):
+                    piece = body[i:i + chunk]
+                    self.wfile.write(piece)
+                    time.sleep(len(piece) / server.bandwidth)
+
+            def do_GET(self):
+                if self.headers.get("Authorization") != server._expected_auth:
+                    self._reply(401, b"auth required", {"WWW-Authenticate": 'Basic realm="kobo"'})
+                    return
+
+                parts = self.path.strip("/").split("/")
+                if len(parts) == 2 and parts[0] == "redirect":
+                    self._reply(302, headers={"Location": f"/media/{parts[1]}"})
+                    return
+                if len(parts) != 2 or parts[0] != "media":
+                    self._reply(404, b"not found")
+                    return
+
+                with server._lock:
+                    server.in_flight += 1
+                    overloaded = server.capacity is not None and server.in_flight > server.capacity
+                    roll = server._rng.random()
+                try:
+                    time.sleep(server.latency)
+                    if overloaded or roll < server.throttle_rate:
+                        self._reply(429, b"slow down", {"Retry-After": "1"})
+                        return
+                    if roll < server.throttle_rate + server.error_rate:
+                        self._reply(500, b"server error")
+                        return
+                    image_id = parts[1].split(".")[0]
+                    with server._lock:
+                        server.hits[image_id] = server.hits.get(image_id, 0) + 1
+                    self._reply(200, synthetic_image(image_id, server.image_bytes), {"Content-Type": "image/jpeg"})
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+        return Handler
+
+
+# ------- Harness -------
+
+def make_survey(base_url, rows, brands=("PEPSI", "COKE", "Cola Next", "NESTLE"),
+                cities=("Karachi", "Lahore", "Multan", "Rahim Yar Khan"),
+                duplicate_rate=0.0, redirect_rate=0.0, missing_rate=0.0, seed=0):
+    """Synthetic survey export in the layout the KoBo page expects."""
+    rng = random.Random(seed)
+    data = {
+        "start": range(rows),
+        "City": [cities[i % len(cities)] for i in range(rows)],
+        "Shop Name": [f"Shop {i}" for i in range(rows)],
+    }
+    next_id = 0
+    issued = []
+    for brand in brands:
+        column = []
+        for _ in range(rows):
+            if rng.random() < missing_rate:
+                column.append(None)
+                continue
+            if issued and rng.random() < duplicate_rate:
+                image_id = rng.choice(issued)
+            else:
+                image_id = next_id
+                next_id += 1
+                issued.append(image_id)
+            route = "redirect" if rng.random() < redirect_rate else "media"
+            column.append(f"{base_url}/{route}/{image_id}.jpg")
+        data[f"{brand} BILL PICTURE_URL"] = column
+    return pd.DataFrame(data)
+
+
+def check_layout(tasks, results, folder_name, image_bytes):
+    """Count downloaded files that are missing, misplaced or corrupt."""
+    problems = 0
+    for task, (ok, final_name, _) in results:
+        if not ok:
+            continue
+        path = os.path.join(folder_name, task.brand, task.city, final_name)
+        image_id = task.url.rsplit("/", 1)[-1].split(".")[0]
+        if (not final_name.startswith(f"{task.city}_{task.brand[:2].upper()}_bill_")
+                or not os.path.exists(path)):
+            problems += 1
+            continue
+        with open(path, "rb") as f:
+            if f.read() != synthetic_image(image_id, image_bytes):
+                problems += 1
+    expected_folders = set(tasks["folder"])
+    actual_folders = {os.path.join(folder_name, b, c) for b in os.listdir(folder_name)
+                      for c in os.listdir(os.path.join(folder_name, b))}
+    # Two downloads landing on the same file name would show up as a missing file here
+    files_on_disk = sum(len(os.listdir(f)) for f in actual_folders)
+    succeeded = sum(1 for _, (ok, _, _) in results if ok)
+    return problems + len(expected_folders ^ actual_folders) + abs(files_on_disk - succeeded)
+
+
+def run_once(server, df, concurrency, adaptive=True, timeout=20, max_retries=3):
+    """Download the whole survey once and return one row of the report."""
+    workdir = tempfile.mkdtemp(prefix="kobo_loadtest_")
+    folder_name = os.path.join(workdir, "images_downloaded")
+    try:
+        session = requests.Session()
+        session.auth = HTTPBasicAuth(server.username, server.password)
+        adapter = TimedHTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        session.mount("http://", adapter)
+        if adaptive:
+            limiter = kobo.AdaptiveConcurrency(initial=min(3, concurrency), maximum=concurrency)
+        else:
+            limiter = kobo.AdaptiveConcurrency(initial=concurrency, minimum=concurrency, maximum=concurrency)
+        metrics = DownloadMetrics()
+
+        tracemalloc.start()
+        started = time.monotonic()
+        tasks = kobo.build_tasks(df, folder_name)
+        results = list(kobo.stream_downloads(session, tasks.itertuples(index=False), timeout, max_retries,
+                                             limiter, workers=concurrency, metrics=metrics))
+        elapsed = time.monotonic() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        frame = metrics.to_frame()
+        ok = int(frame["ok"].sum())
+        return {
+            "concurrency": concurrency,
+            "adaptive": adaptive,
+            "final_limit": limiter.current,
+            "tasks": len(tasks),
+            "ok": ok,
+            "failed": len(tasks) - ok,
+            "retries": int(frame["retries"].sum()),
+            "seconds": round(elapsed, 2),
+            "images_per_s": round(ok / elapsed, 1),
+            "MB_per_s": round(frame.loc[frame["ok"].astype(bool), "bytes"].sum() / 1e6 / elapsed, 2),
+            "p95_s": round(frame["total_s"].quantile(0.95), 3),
+            "peak_py_MB": round(peak / 1e6, 1),
+            "layout_errors": check_layout(tasks, results, folder_name, server.image_bytes),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--concurrency", default="1,4,8,16", help="comma-separated levels to try")
+    parser.add_argument("--fixed", action="store_true", help="disable adaptive concurrency")
+    parser.add_argument("--latency", type=float, default=0.02, help="server think time per request (s)")
+    parser.add_argument("--bandwidth", type=float, default=None, help="per-connection bytes/s")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--capacity", type=int, default=None, help="429 when more requests are in flight")
+    parser.add_argument("--redirect-rate", type=float, default=0.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--out", default=None, help="also write the report to this CSV")
+    args = parser.parse_args()
+
+    server = StandInServer(latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                           throttle_rate=args.throttle_rate, capacity=args.capacity,
+                           image_bytes=args.image_kb * 1000)
+    rows = []
+    with server:
+        df = make_survey(server.base_url, args.rows, duplicate_rate=args.duplicate_rate,
+                         redirect_rate=args.redirect_rate)
+        for level in [int(c) for c in args.concurrency.split(",")]:
+            rows.append(run_once(server, df, level, adaptive=not args.fixed))
+            print(rows[-1], flush=True)
+        print("server responses:", dict(sorted(server.statuses.items())))
+
+    report = pd.DataFrame(rows)
+    print(report.to_string(index=False))
+    if args.out:
+        report.to_csv(args.out, index=False)
+
+
+if __name__ == "__main__":
+    main()
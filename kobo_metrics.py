@@ -0,0 +1,132 @@
+"""
+Per-request download metrics for KoBo image jobs.
+
+Every URL the downloader fetches leaves one row here: connect / first-byte /
+total timings, bytes, retries and final status code. The page turns the rows
+into live throughput and per-host / per-brand latency percentiles, and the
+whole table can be exported with the job to size concurrency and spot slow
+KoBo servers.
+"""
+
+import threading
+import time
+from io import BytesIO
+
+import pandas as pd
+import urllib3
+from requests.adapters import HTTPAdapter
+
+
+METRIC_COLUMNS = [
+    "url", "host", "brand", "city", "ok", "status_code", "retries",
+    "connect_s", "first_byte_s", "total_s", "bytes", "error", "finished",
+]
+
+
+# ------- Connection timing -------
+
+class _TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    def connect(self):
+        started = time.monotonic()
+        super().connect()
+        self.connect_time = time.monotonic() - started
+
+
+class _TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def connect(self):
+        started = time.monotonic()
+        super().connect()
+        self.connect_time = time.monotonic() - started
+
+
+class _TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections remember how long their TCP/TLS setup took."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+def pop_connect_time(resp):
+    """Seconds spent opening the connection behind `resp`; 0 when a kept-alive one was reused."""
+    raw = getattr(resp, "raw", None)
+    conn = getattr(raw, "connection", None) or getattr(raw, "_connection", None)
+    if conn is None:
+        return None
+    return conn.__dict__.pop("connect_time", 0.0)
+
+
+# ------- Metrics table -------
+
+class DownloadMetrics:
+    """Thread-safe collector of one row per downloaded URL."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = []
+        self.started = time.time()
+
+    def record(self, **row):
+        row.setdefault("finished", time.time())
+        with self._lock:
+            self._rows.append(row)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rows)
+
+    def to_frame(self):
+        with self._lock:
+            rows = list(self._rows)
+        return pd.DataFrame(rows, columns=METRIC_COLUMNS)
+
+    def throughput(self, frame=None, window=10.0):
+        """Overall and recent (last `window` seconds) MB/s and images/s."""
+        frame = self.to_frame() if frame is None else frame
+        now = time.time()
+        elapsed = max(now - self.started, 1e-9)
+        ok = frame[frame["ok"].astype(bool)]
+        recent = ok[ok["finished"] >= now - window]
+        span = min(window, elapsed)
+        return {
+            "mb_per_s": ok["bytes"].sum() / 1e6 / elapsed,
+            "images_per_s": len(ok) / elapsed,
+            "recent_mb_per_s": recent["bytes"].sum() / 1e6 / span,
+            "recent_images_per_s": len(recent) / span,
+        }
+
+    def latency_summary(self, by, frame=None):
+        """p50/p95/p99 of total and first-byte latency (seconds) grouped by `by`."""
+        frame = self.to_frame() if frame is None else frame
+        if frame.empty:
+            return pd.DataFrame()
+        grouped = frame.groupby(by)
+        summary = grouped["total_s"].quantile([0.5, 0.95, 0.99]).unstack()
+        summary.columns = ["p50_s", "p95_s", "p99_s"]
+        summary.insert(0, "requests", grouped.size())
+        summary["first_byte_p50_s"] = grouped["first_byte_s"].median()
+        summary["failed"] = summary["requests"] - grouped["ok"].sum()
+        summary["retries"] = grouped["retries"].sum()
+        summary["MB"] = grouped["bytes"].sum() / 1e6
+        return summary.round(3).reset_index()
+
+    def export(self, fmt="csv"):
+        """Full metrics table as CSV or Parquet bytes."""
+        frame = self.to_frame()
+        buffer = BytesIO()
+        if fmt == "parquet":
+            frame.to_parquet(buffer, index=False)
+        else:
+            frame.to_csv(buffer, index=False)
+        return buffer.getvalue()
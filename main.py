@@ -2,7 +2,35 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import io
-import appalldata, appdkoboimages, appntppk, about, appreadbooks
+import appalldata, appdkoboimages, appntppk, appweekdiff, about, appreadbooks
+from datasets import load_dataset
+import pivot_kernel
+from query_engine import aggregate, distinct, engine_selector
+from result_cache import cached_result, show_cache_panel
+
+
+@cached_result("ntp_analysis")
+def ntp_table(dataset_key, ntp_col, filters, sku_list, engine, _df):
+    """Mean NTP per SKU (rows, `sku_list` order; every SKU found when None) x BRAND; None if nothing matches."""
+    means = aggregate(_df, ["SKUS", "BRAND"], ntp_col, "mean", filters, engine, dataset_key)
+    if means.empty:
+        return None
+    pivot = pivot_kernel.pivot(means, "SKUS", "BRAND", ntp_col, "first")
+    if sku_list is None:
+        sku_list = distinct(_df, "SKUS", filters, engine, dataset_key)
+    pivot = pivot.reindex(sku_list)
+    return pivot.reset_index().rename(columns={"index": "SKU"})
+
+
+@cached_result("brand_compare")
+def brand_sku_table(dataset_key, metric_column, region, category, brands, sku_list, _df):
+    """Mean of `metric_column` per SKU (rows, `sku_list` order) x brand (columns, `brands` order)."""
+    filters = {"REGION": region, "CATEGORY": category, "Brand": list(brands), "SKUS": list(sku_list)}
+    means = aggregate(_df, ["SKUS", "Brand"], metric_column, "mean", filters, dataset_key=dataset_key)
+    if means.empty:
+        return pd.DataFrame(np.nan, index=sku_list, columns=brands)
+    table = pivot_kernel.pivot(means, "SKUS", "Brand", metric_column, "first")
+    return table.reindex(index=sku_list, columns=brands).rename_axis(index=None, columns=None)
 
 # -------------------------
 # NTP Analysis Function (Fixed)
@@ -45,10 +73,8 @@ def run_ntp_analysis():
     if uploaded_file:
         try:
             # Load dataset
-            if uploaded_file.name.endswith(".csv"):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+            dataset_key, df = load_dataset(uploaded_file)
+            engine = engine_selector()
         
             st.success("✅ File uploaded successfully!")
             
@@ -89,32 +115,14 @@ def run_ntp_analysis():
             cat = st.sidebar.selectbox("Select Category", options=cat_options)
             region = st.sidebar.selectbox("Select Region", options=region_options)
 
-            # --- Filter dataset ---
-            filtered = df[
-                (df["CHANNEL"] == channel) &
-                (df["CAT"] == cat) &
-                (df["REGION"] == region)
-            ]
+            # --- Filter, aggregate and pivot, SKUs in template order ---
+            filters = {"CHANNEL": channel, "CAT": cat, "REGION": region}
+            pivot = ntp_table(dataset_key, ntp_col, filters, SKU_TEMPLATE.get(cat), engine, df)
 
-            if filtered.empty:
+            if pivot is None:
                 st.warning("⚠️ No data available for this selection.")
                 return
 
-            # --- Pivot table ---
-            pivot = pd.pivot_table(
-                filtered,
-                index="SKUS",
-                columns="BRAND",
-                values=ntp_col,
-                aggfunc="mean"
-            )
-
-            # --- Reindex SKUs based on template ---
-            sku_list = SKU_TEMPLATE.get(cat, sorted(filtered["SKUS"].dropna().unique()))
-            pivot = pivot.reindex(sku_list)
-
-            pivot = pivot.reset_index().rename(columns={"index": "SKU"})
-
             st.subheader(f"📌 NTP Table for {cat} in {region} - Channel: {channel}")
             st.dataframe(pivot, width='stretch')
 
@@ -150,10 +158,7 @@ def run_brand_comparison():
     
     if uploaded_file:
         try:
-            if uploaded_file.name.endswith(".csv"):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+            dataset_key, df = load_dataset(uploaded_file)
 
             st.success("✅ File uploaded successfully!")
             
@@ -229,23 +234,8 @@ def run_brand_comparison():
                 ]
 
             # --- Calculations ---
-            result = pd.DataFrame(index=sku_list)
-
-            for brand in selected_brands:
-                brand_df = df_cat[df_cat["Brand"] == brand]
-                brand_values = []
-                
-                for sku in sku_list:
-                    sku_data = brand_df[brand_df["SKUS"] == sku][metric_column]
-                    
-                    if len(sku_data) > 0:
-                        value = sku_data.mean()
-                    else:
-                        value = np.nan
-                    
-                    brand_values.append(value)
-                
-                result[brand] = brand_values
+            result = brand_sku_table(dataset_key, metric_column, selected_region, selected_category,
+                                     selected_brands, sku_list, df)
 
             # --- Show table ---
             st.subheader(f"📌 {metric_column} by SKU & Brand in {selected_region} ({selected_category})")
@@ -377,7 +367,8 @@ st.markdown("""
 # Navbar with session_state
 # -------------------------
 if "selected_page" not in st.session_state:
-    st.session_state["selected_page"] = "Home"
+    # A browser refresh during a KoBo download lands back on that job's page
+    st.session_state["selected_page"] = "KoBo Images" if "kobo_job" in st.query_params else "Home"
 
 def set_page(page):
     st.session_state["selected_page"] = page
@@ -386,7 +377,7 @@ selected_page = st.session_state["selected_page"]
 
 # Create navbar with columns
 st.markdown('<div class="navbar">', unsafe_allow_html=True)
-navbar_cols = st.columns(8)
+navbar_cols = st.columns(9)
 
 pages = [
     ("🏠 Home", "Home", navbar_cols[0]),
@@ -394,9 +385,10 @@ pages = [
     ("📈 All Data", "All Data", navbar_cols[2]),
     ("🔍 NTP Analysis", "NTP Analysis", navbar_cols[3]),
     ("🆚 Brand Compare", "Brand Compare", navbar_cols[4]),
-    ("🖼️ KoBo Images", "KoBo Images", navbar_cols[5]),
-    ("📚 Read Books", "Read Books", navbar_cols[6]),
-    ("🤖 About Me", "About Me", navbar_cols[7]),
+    ("📅 Week over Week", "Week over Week", navbar_cols[5]),
+    ("🖼️ KoBo Images", "KoBo Images", navbar_cols[6]),
+    ("📚 Read Books", "Read Books", navbar_cols[7]),
+    ("🤖 About Me", "About Me", navbar_cols[8]),
 ]
 
 for page_name, page_key, col in pages:
@@ -408,6 +400,8 @@ for page_name, page_key, col in pages:
 
 st.markdown('</div>', unsafe_allow_html=True)
 
+show_cache_panel()
+
 # -------------------------
 # Render Pages
 # -------------------------
@@ -477,6 +471,13 @@ try:
     elif selected_page == "Brand Compare":
         run_brand_comparison()
 
+    elif selected_page == "Week over Week":
+        try:
+            appweekdiff.run()
+        except Exception as e:
+            st.error(f"Error loading Week over Week: {str(e)}")
+            st.info("Make sure appweekdiff.py exists in your project folder")
+
     elif selected_page == "KoBo Images":
         try:
             appdkoboimages.run()
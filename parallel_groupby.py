@@ -0,0 +1,296 @@
+"""
+Partitioned groupby over a process pool and shared memory.
+
+Streamlit runs each page script in one thread, so a pandas groupby over a
+big upload uses one core however many the server has. ParallelBackend
+copies the columns a query needs into shared memory once per dataset (key
+columns as factorized codes, value columns as float64), with the rows
+grouped by a hash of the partition key (REGION by default). Each worker
+process attaches to the blocks, filters and reduces its own partition to
+per-cell sum/count/min/max with np.bincount (see pivot_kernel), and the
+partials of the non-empty cells are merged in the calling thread.
+
+Results match query_engine's pandas path: one row per group with a row in
+the filtered data, null keys dropped, sorted by the keys. When a query can't
+run here (too many cells, no room in /dev/shm for the blocks, a worker
+failed) aggregate() returns None and the caller falls back to pandas.
+"""
+
+import atexit
+import multiprocessing
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from pivot_kernel import _fold, factorize, reduce_cells
+from spawn_pool import bare_main
+
+
+PARTITION_KEY = "REGION"
+
+# Key spaces larger than this stay on the single-threaded path; every worker
+# reduces into arrays of this size
+MAX_CELLS = 1_000_000
+
+# Default pool size: every worker is a separate interpreter holding its own imports
+DEFAULT_WORKERS = 4
+
+# Free space left in /dev/shm after exporting a block. Writing past the end of
+# a full tmpfs through a mapping kills the process with SIGBUS, so blocks that
+# don't fit are never created.
+SHM_HEADROOM_BYTES = 64 << 20
+
+_REDUCERS = ("sum", "count", "min", "max")
+
+
+# ------- Worker side -------
+
+def _reduce_partition(arrays, start, end, keys, sizes, values, filters):
+    rows = slice(start, end)
+    keep = np.ones(end - start, dtype=bool)
+    for col, codes in filters:
+        keep &= np.isin(arrays["codes", col][rows], codes)
+    cell, missing = _fold([arrays["codes", k][rows] for k in keys], sizes, end - start)
+    keep &= ~missing
+    cell = cell[keep]
+    n_cells = int(np.prod(sizes))
+    count = np.bincount(cell, minlength=n_cells)
+    present = np.flatnonzero(count)
+    out = {"cells": present, "rows": count[present]}
+    for v in values:
+        data = arrays["values", v][rows][keep]
+        for how in _REDUCERS:
+            out[(v, how)] = reduce_cells(cell, data, n_cells, how)[0][present]
+    return out
+
+
+def _partition_partials(task):
+    """Worker: row count and sum/count/min/max of every non-empty cell of one partition."""
+    blocks, start, end, keys, sizes, values, filters = task
+    # Workers share the parent's resource tracker, so attaching doesn't make them owners
+    attached = {block: SharedMemory(name=name) for block, (name, _, _) in blocks.items()}
+    try:
+        arrays = {block: np.ndarray(n, dtype=dtype, buffer=attached[block].buf)
+                  for block, (_, dtype, n) in blocks.items()}
+        result = _reduce_partition(arrays, start, end, keys, sizes, values, filters)
+        del arrays
+        return result
+    finally:
+        for shm in attached.values():
+            shm.close()
+
+
+# ------- Caller side -------
+
+class NoRoom(Exception):
+    """There isn't enough free shared memory for a block."""
+
+
+def _shm_free():
+    try:
+        return shutil.disk_usage("/dev/shm").free
+    except OSError:
+        return None
+
+
+class SharedDataset:
+    """One dataset's columns in shared memory, rows grouped by partition.
+
+    Queries hold the dataset with acquire()/release() while they use its
+    blocks; a dataset retired by the backend is only closed once the last of
+    them has released it.
+    """
+
+    def __init__(self, df, n_parts, partition_key=PARTITION_KEY):
+        self._df = df
+        self._lock = threading.Lock()
+        self._blocks = {}
+        self._uniques = {}
+        self._users = 0
+        self._retired = False
+        n = len(df)
+        if partition_key in df.columns:
+            codes = factorize(df[partition_key])[0]
+            part = np.where(codes < 0, 0, codes % n_parts)
+            self._order = np.argsort(part, kind="stable")
+            self.bounds = np.searchsorted(part[self._order], np.arange(n_parts + 1))
+        else:
+            self._order = None
+            self.bounds = np.linspace(0, n, n_parts + 1).astype(int)
+
+    def _share(self, block, array):
+        free = _shm_free()
+        if free is not None and free < array.nbytes + SHM_HEADROOM_BYTES:
+            raise NoRoom(f"{array.nbytes} bytes for {block}, {free} free in /dev/shm")
+        if self._order is not None:
+            array = array[self._order]
+        shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+        self._blocks[block] = (shm, array.dtype.str, len(array))
+
+    def codes(self, col):
+        """Uniques of key column `col`, exporting its codes on first use."""
+        with self._lock:
+            if col not in self._uniques:
+                codes, uniques = factorize(self._df[col])
+                self._share(("codes", col), np.asarray(codes, dtype=np.int32))
+                self._uniques[col] = uniques
+            return self._uniques[col]
+
+    def values(self, col):
+        """Export value column `col` as float64; False if it isn't numeric."""
+        with self._lock:
+            if ("values", col) not in self._blocks:
+                series = self._df[col]
+                if series.dtype.kind not in "iuf":
+                    return False
+                self._share(("values", col), series.to_numpy(dtype=float, na_value=np.nan))
+            return True
+
+    def block_specs(self, blocks):
+        """{(kind, column): (shared memory name, dtype, length)} for the workers."""
+        with self._lock:
+            return {b: (self._blocks[b][0].name,) + self._blocks[b][1:] for b in blocks}
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            if self._retired and not self._users:
+                self._close()
+
+    def retire(self):
+        """Close the blocks now if no query is using them, else when the last one releases them."""
+        with self._lock:
+            self._retired = True
+            if not self._users:
+                self._close()
+
+    def _close(self):
+        for shm, _, _ in self._blocks.values():
+            shm.close()
+            shm.unlink()
+        self._blocks.clear()
+
+
+def _filter_codes(uniques, value, multi):
+    """Codes of the values a filter keeps; like isin(), a NaN in a list also keeps missing values (-1)."""
+    wanted = list(value) if multi else [value]
+    codes = pd.Index(uniques).get_indexer(wanted)
+    codes = codes[codes >= 0]
+    if multi and any(pd.isna(w) for w in wanted):
+        codes = np.append(codes, -1)
+    return np.unique(codes)
+
+
+class ParallelBackend:
+    """Process pool plus the shared-memory copies of recently queried datasets."""
+
+    def __init__(self, workers=None, max_datasets=4):
+        self.workers = workers or min(os.cpu_count() or 1, DEFAULT_WORKERS)
+        self.max_datasets = max_datasets
+        self._lock = threading.Lock()
+        self._datasets = OrderedDict()
+        # spawn: the caller is a threaded Streamlit server, where forking is unsafe
+        self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                         mp_context=multiprocessing.get_context("spawn"))
+        atexit.register(self.close)
+
+    def dataset(self, df, dataset_key):
+        """The shared copy of `df`, acquired for the caller (who must release() it)."""
+        with self._lock:
+            entry = self._datasets.get(dataset_key)
+            if entry is None or entry._df is not df:
+                if entry is not None:
+                    entry.retire()
+                entry = SharedDataset(df, self.workers)
+                self._datasets[dataset_key] = entry
+            self._datasets.move_to_end(dataset_key)
+            while len(self._datasets) > self.max_datasets:
+                self._datasets.popitem(last=False)[1].retire()
+            entry.acquire()
+        return entry
+
+    def aggregate(self, df, dataset_key, keys, values, hows, filters):
+        """query_engine.aggregate() result for the pandas engine, or None when this backend can't run it."""
+        if not set(hows) <= {"mean", "sum", "count", "min", "max"} or not len(df):
+            return None
+        ds = self.dataset(df, dataset_key)
+        try:
+            return self._aggregate(ds, df, keys, values, hows, filters)
+        except (NoRoom, OSError):
+            # /dev/shm is (nearly) full: leave it to pandas
+            return None
+        finally:
+            ds.release()
+
+    def _aggregate(self, ds, df, keys, values, hows, filters):
+        from query_engine import _is_multi
+
+        uniques = [ds.codes(k) for k in keys]
+        sizes = [max(len(u), 1) for u in uniques]
+        if np.prod(sizes, dtype=float) > MAX_CELLS or not all(ds.values(v) for v in values):
+            return None
+        filter_codes = [(col, _filter_codes(ds.codes(col), value, _is_multi(value)))
+                        for col, value in (filters or {}).items()]
+        blocks = ds.block_specs({("codes", c) for c in keys + [c for c, _ in filter_codes]}
+                                | {("values", v) for v in values})
+        tasks = [(blocks, int(start), int(end), keys, sizes, values, filter_codes)
+                 for start, end in zip(ds.bounds[:-1], ds.bounds[1:]) if end > start]
+        try:
+            with bare_main():
+                futures = [self._pool.submit(_partition_partials, task) for task in tasks]
+            parts = [f.result() for f in futures]
+        except Exception:
+            # A worker failed or the pool broke (BrokenProcessPool): leave it to pandas
+            return None
+        return self._merge(df, parts, keys, uniques, sizes, values, hows)
+
+    @staticmethod
+    def _merge(df, parts, keys, uniques, sizes, values, hows):
+        from query_engine import agg_column
+
+        # Partitions share cells only when the partition key isn't a group key
+        cells, group = np.unique(np.concatenate([p["cells"] for p in parts]), return_inverse=True)
+        n = len(cells)
+
+        def gather(name):
+            return np.concatenate([p[name] for p in parts])
+
+        levels = np.unravel_index(cells, sizes)
+        out = pd.DataFrame({k: u[lv] for k, u, lv in zip(keys, uniques, levels)})
+        single = len(values) == 1 and len(hows) == 1
+        for v in values:
+            merged = {
+                "sum": np.bincount(group, weights=gather((v, "sum")), minlength=n),
+                "count": np.bincount(group, weights=gather((v, "count")), minlength=n).astype(np.int64),
+                "min": np.full(n, np.nan),
+                "max": np.full(n, np.nan),
+            }
+            np.fmin.at(merged["min"], group, gather((v, "min")))
+            np.fmax.at(merged["max"], group, gather((v, "max")))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                merged["mean"] = np.where(merged["count"] > 0, merged["sum"] / merged["count"], np.nan)
+            source = df[v].dtype
+            for how in hows:
+                col = merged[how]
+                if how in ("sum", "min", "max") and source.kind in "iu" and not np.isnan(col).any():
+                    col = col.astype(source)
+                out[agg_column(v, how, single)] = col
+        return out
+
+    def close(self):
+        with self._lock:
+            for ds in self._datasets.values():
+                ds.retire()
+            self._datasets.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,90 @@
+"""
+Benchmark pivot_kernel.pivot against pd.pivot_table.
+
+Builds a synthetic REGION x SKUS x BRAND price table (low-cardinality keys,
+many rows, ~10% missing values), pivots it both ways for each aggfunc,
+checks the two results are equal and reports the timings.
+
+Usage:
+    python pivot_bench.py --rows 100000,1000000,10000000 --aggfuncs mean,first,min --categorical
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from pivot_kernel import AGGFUNCS, pivot
+
+
+def make_table(rows, regions=13, skus=8, brands=12, categorical=False, seed=0):
+    rng = np.random.default_rng(seed)
+    region_names = np.array([f"Region {i:02d}" for i in range(regions)], dtype=object)
+    sku_names = np.array([f"SKU {i}" for i in range(skus)], dtype=object)
+    brand_names = np.array([f"Brand {i:02d}" for i in range(brands)], dtype=object)
+    value = rng.normal(800, 80, rows)
+    value[rng.random(rows) < 0.1] = np.nan
+    df = pd.DataFrame({
+        "REGION": region_names[rng.integers(0, regions, rows)],
+        "SKUS": sku_names[rng.integers(0, skus, rows)],
+        "BRAND": brand_names[rng.integers(0, brands, rows)],
+        "VALUE": value,
+    })
+    if categorical:
+        df = df.astype({"REGION": "category", "SKUS": "category", "BRAND": "category"})
+    return df
+
+
+def timed(fn, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def bench(df, aggfunc, repeat=3):
+    """One row of the report: best-of-`repeat` seconds for both implementations."""
+    index, columns = "REGION", ["SKUS", "BRAND"]
+    pandas_s, expected = timed(lambda: pd.pivot_table(df, index=index, columns=columns, values="VALUE",
+                                                      aggfunc=aggfunc), repeat)
+    kernel_s, got = timed(lambda: pivot(df, index, columns, "VALUE", aggfunc), repeat)
+    pd.testing.assert_frame_equal(expected, got, check_dtype=False, check_index_type=False,
+                                  check_column_type=False)
+    return {
+        "rows": len(df),
+        "keys": "category" if isinstance(df["REGION"].dtype, pd.CategoricalDtype) else "str",
+        "aggfunc": aggfunc,
+        "pivot_table_s": round(pandas_s, 4),
+        "kernel_s": round(kernel_s, 4),
+        "speedup": round(pandas_s / kernel_s, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", default="100000,1000000,10000000", help="comma-separated row counts")
+    parser.add_argument("--aggfuncs", default=",".join(AGGFUNCS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--categorical", action="store_true", help="also run with categorical key columns")
+    parser.add_argument("--out", default=None, help="also write the report to this CSV")
+    args = parser.parse_args()
+
+    report = []
+    for rows in [int(r) for r in args.rows.split(",")]:
+        for categorical in ([False, True] if args.categorical else [False]):
+            df = make_table(rows, categorical=categorical)
+            for aggfunc in args.aggfuncs.split(","):
+                report.append(bench(df, aggfunc, args.repeat))
+                print(report[-1], flush=True)
+
+    report = pd.DataFrame(report)
+    print(report.to_string(index=False))
+    if args.out:
+        report.to_csv(args.out, index=False)
+
+
+if __name__ == "__main__":
+    main()
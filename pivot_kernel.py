@@ -0,0 +1,142 @@
+"""
+Pivot kernel: pd.pivot_table(..., aggfunc=...) on NumPy arrays.
+
+The analysis pages pivot long tables (region/SKU/brand by a metric) where
+the key columns have few distinct values but there can be many rows.
+pivot() factorizes each index and column key once, folds the codes into
+one cell number per row and reduces the values per cell with np.bincount /
+np.minimum.at / np.maximum.at, then lays the cells out as a grid.
+Categorical key columns skip the factorizing and use their codes directly,
+which is where most of the time goes for string keys.
+
+The result matches pd.pivot_table(df, index=..., columns=..., values=...,
+aggfunc=...) for one values column: keys sorted, rows with a missing key
+dropped, cells that would be NaN left out of the table as pivot_table does
+(rows and columns without any value are not shown; sum and count keep
+every cell that has rows, as 0 when all values are missing).
+"""
+
+import numpy as np
+import pandas as pd
+
+
+AGGFUNCS = ("mean", "sum", "count", "min", "max", "first")
+
+# Above this many possible key combinations only the ones that occur get a cell
+DENSE_CELLS = 4_000_000
+
+
+def _as_list(x):
+    return list(x) if isinstance(x, (list, tuple)) else [x]
+
+
+def factorize(series):
+    """(codes, sorted uniques) of one key column; -1 marks missing keys."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        n_categories = len(series.cat.categories)
+        return series.cat.codes.to_numpy(), pd.Categorical.from_codes(np.arange(n_categories), dtype=series.dtype)
+    return pd.factorize(series, sort=True)
+
+
+def _labels(uniques, names):
+    if len(names) == 1:
+        return pd.Index(uniques[0], name=names[0])
+    return pd.MultiIndex.from_product(uniques, names=names)
+
+
+def _fold(codes, sizes, n):
+    """Mixed-radix cell number of every row (lexicographic in the keys) and the rows with a missing key."""
+    cell = np.zeros(n, dtype=np.intp)
+    missing = np.zeros(n, dtype=bool)
+    for code, size in zip(codes, sizes):
+        cell *= size
+        cell += code
+        missing |= code < 0
+    return cell, missing
+
+
+def factorize_keys(df, cols):
+    """(codes, labels) for the combined key `cols`, numbering only the combinations that occur.
+
+    `codes` numbers every row's key (-1 where any part is missing) in sorted
+    key order; `labels` is the matching Index (MultiIndex for several
+    columns).
+    """
+    parts, uniques = zip(*(factorize(df[col]) for col in cols))
+    sizes = [max(len(u), 1) for u in uniques]
+    flat, missing = _fold(parts, sizes, len(df))
+    present, combined = np.unique(flat[~missing], return_inverse=True)
+    codes = np.full(len(df), -1, dtype=np.intp)
+    codes[~missing] = combined
+    levels = np.unravel_index(present, sizes)
+    arrays = [u[lv] for u, lv in zip(uniques, levels)]
+    if len(cols) == 1:
+        return codes, pd.Index(arrays[0], name=cols[0])
+    return codes, pd.MultiIndex.from_arrays(arrays, names=cols)
+
+
+def reduce_cells(cell, values, n_cells, aggfunc):
+    """Reduce `values` per cell number; returns (result per cell, cell has a result)."""
+    if aggfunc == "first":
+        filled = np.flatnonzero(~pd.isna(values))
+        first = np.full(n_cells, len(values))
+        np.minimum.at(first, cell[filled], filled)
+        present = first < len(values)
+        out = np.full(n_cells, np.nan, dtype=object if values.dtype == object else float)
+        out[present] = values[first[present]]
+        return out, present
+
+    values = np.asarray(values, dtype=float)
+    filled = ~np.isnan(values)
+    all_filled = filled.all()
+    cell_nn = cell if all_filled else cell[filled]
+    values_nn = values if all_filled else values[filled]
+    count = np.bincount(cell_nn, minlength=n_cells)
+    if aggfunc in ("sum", "count"):
+        rows = count if all_filled else np.bincount(cell, minlength=n_cells)
+        if aggfunc == "count":
+            return count.astype(float), rows > 0
+        return np.bincount(cell_nn, weights=values_nn, minlength=n_cells), rows > 0
+    if aggfunc == "mean":
+        total = np.bincount(cell_nn, weights=values_nn, minlength=n_cells)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / count, count > 0
+    ufunc, start = (np.minimum, np.inf) if aggfunc == "min" else (np.maximum, -np.inf)
+    out = np.full(n_cells, start)
+    ufunc.at(out, cell_nn, values_nn)
+    out[count == 0] = np.nan
+    return out, count > 0
+
+
+def pivot(df, index, columns, values, aggfunc="mean"):
+    """pd.pivot_table(df, index=index, columns=columns, values=values, aggfunc=aggfunc) for one values column."""
+    if aggfunc not in AGGFUNCS:
+        raise ValueError(f"unsupported aggfunc {aggfunc!r}; expected one of {AGGFUNCS}")
+    index, columns = _as_list(index), _as_list(columns)
+    data = df[values].to_numpy()
+
+    parts, uniques = zip(*(factorize(df[col]) for col in index + columns))
+    sizes = [max(len(u), 1) for u in uniques]
+    n_rows, n_cols = int(np.prod(sizes[:len(index)])), int(np.prod(sizes[len(index):]))
+    if n_rows * n_cols <= DENSE_CELLS:
+        cell, missing = _fold(parts, sizes, len(df))
+        row_labels = _labels(uniques[:len(index)], index)
+        col_labels = _labels(uniques[len(index):], columns)
+    else:
+        row_codes, row_labels = factorize_keys(df, index)
+        col_codes, col_labels = factorize_keys(df, columns)
+        n_rows, n_cols = len(row_labels), len(col_labels)
+        cell = row_codes * n_cols + col_codes
+        missing = (row_codes < 0) | (col_codes < 0)
+    if missing.any():
+        cell, data = cell[~missing], data[~missing]
+
+    out, present = reduce_cells(cell, data, n_rows * n_cols, aggfunc)
+    grid = out.reshape(n_rows, n_cols)
+    present = present.reshape(n_rows, n_cols)
+    rows, cols = present.any(axis=1), present.any(axis=0)
+    table = pd.DataFrame(np.where(present, grid, np.nan)[rows][:, cols],
+                         index=row_labels[rows], columns=col_labels[cols])
+    if aggfunc == "first" and data.dtype != object:
+        table = table.astype(float)
+    return table
@@ -0,0 +1,128 @@
+"""
+Quick preview of a page's tables on a stratified sample of a large upload.
+
+Aggregating a multi-million row upload can take long enough that the page
+looks stuck. For datasets with at least PREVIEW_MIN_ROWS rows,
+exact_or_preview() starts the exact computation as a background job (see
+jobs.py) and meanwhile runs the same function on a stratified sample: up to
+SAMPLE_PER_CELL random rows of every REGION x BRAND x SKUS cell, so every
+cell shows up in the preview. show_preview() marks the page as a preview and
+reruns it once the job is done; the job's result is then used instead.
+
+Jobs are keyed by the function and its arguments and shared by every
+session in the server process, so reruns and other users asking for the
+same table wait for the same job. PREVIEW_MIN_ROWS can be set through the
+environment (0 turns previews off).
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+import streamlit as st
+
+from jobs import JobRegistry
+from pivot_kernel import factorize_keys
+from query_engine import PARTIALS_ATTR
+
+
+PREVIEW_MIN_ROWS = int(os.environ.get("PREVIEW_MIN_ROWS", 2_000_000))
+SAMPLE_PER_CELL = 100
+STRATA = ("REGION", "BRAND", "SKUS")
+POLL_SECONDS = 1
+
+
+def stratified_sample(df, strata=STRATA, per_cell=SAMPLE_PER_CELL, seed=0):
+    """Up to `per_cell` random rows of every combination of `strata`, in the original row order.
+
+    Cells with fewer rows are kept whole; rows with a missing key form their
+    own cell.
+    """
+    strata = [c for c in strata if c in df.columns]
+    if not strata or len(df) <= per_cell:
+        return df
+    codes, _ = factorize_keys(df, strata)
+    order = np.random.default_rng(seed).permutation(len(df))
+    order = order[np.argsort(codes[order], kind="stable")]
+    grouped = codes[order]
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    rank = np.arange(len(df)) - np.repeat(starts, np.diff(np.r_[starts, len(df)]))
+    return df.iloc[np.sort(order[rank < per_cell])]
+
+
+@st.cache_resource(max_entries=4, show_spinner="Sampling dataset...")
+def _sample(dataset_key, strata, per_cell, _df):
+    return stratified_sample(_df, strata, per_cell)
+
+
+def sample_dataset(df, dataset_key, strata=STRATA, per_cell=SAMPLE_PER_CELL):
+    """(sample key, stratified sample of the stored dataset), drawn once per dataset."""
+    strata = tuple(strata)
+    return f"{dataset_key}-sample-{'-'.join(strata)}-{per_cell}", _sample(dataset_key, strata, per_cell, df)
+
+
+@st.cache_resource
+def get_preview_jobs():
+    """Registry running the exact computations, plus which job computes which call."""
+    return {"registry": JobRegistry(max_workers=2, keep=50), "by_call": {}, "lock": threading.Lock()}
+
+
+def _compute(job, fn, args):
+    return fn(*args)
+
+
+def exact_job(fn, dataset_key, *args, df):
+    """The background job running fn(dataset_key, *args, df), started once per distinct call."""
+    jobs = get_preview_jobs()
+    call = (f"{fn.__module__}.{fn.__qualname__}", dataset_key, repr(args))
+    with jobs["lock"]:
+        job = jobs["registry"].get(jobs["by_call"].get(call, ""))
+        if job is None:
+            job = jobs["registry"].submit(_compute, fn, (dataset_key, *args, df),
+                                          label=f"{fn.__name__} {args!r}"[:120])
+            # Forget calls whose jobs the registry has pruned, so the map stays as small as the registry
+            jobs["by_call"] = {c: i for c, i in jobs["by_call"].items() if jobs["registry"].get(i) is not None}
+            jobs["by_call"][call] = job.id
+    return job
+
+
+def exact_or_preview(fn, df, dataset_key, *args, strata=STRATA):
+    """fn(dataset_key, *args, df), or the same on a stratified sample while the exact run is pending.
+
+    `fn` follows the pages' cached-function convention: dataset key first,
+    the frame last. Results already in the result cache (see
+    result_cache.cached_result) are used as they are. Returns (result, job);
+    job is None when the result is exact. A failed job is retried inline so
+    its error shows on the page.
+    """
+    if (PREVIEW_MIN_ROWS <= 0 or len(df) < PREVIEW_MIN_ROWS or PARTIALS_ATTR in df.attrs
+            or getattr(fn, "is_cached", lambda *a: False)(dataset_key, *args, df)):
+        return fn(dataset_key, *args, df), None
+    job = exact_job(fn, dataset_key, *args, df=df)
+    state = job.status.state
+    if state == "done":
+        return job.status.result, None
+    if state in ("failed", "cancelled"):
+        return fn(dataset_key, *args, df), None
+    sample_key, sample = sample_dataset(df, dataset_key, strata)
+    return fn(sample_key, *args, sample), job
+
+
+def show_preview(job, counts=None):
+    """Preview badge with the per-cell sample row counts; reruns the page when `job` finishes."""
+    st.warning(f"⏳ PREVIEW: computed on a stratified sample (up to {SAMPLE_PER_CELL} rows per "
+               f"REGION × BRAND × SKUS cell). Exact results replace it automatically when ready.")
+    if counts is not None:
+        with st.expander("Sample rows per cell"):
+            st.dataframe(counts)
+
+    @st.fragment(run_every=POLL_SECONDS)
+    def poll():
+        status = job.status.snapshot()
+        elapsed = time.time() - (status["started"] or job.created)
+        st.caption(f"Exact computation: {status['state']} ({elapsed:.0f}s)")
+        if not job.active:
+            st.rerun()
+
+    poll()
@@ -0,0 +1,440 @@
+"""
+Filter -> group -> aggregate, on pandas or on an embedded DuckDB.
+
+The analysis pages all boil down to "keep the rows matching these filters,
+group by a few keys and reduce a metric". aggregate() does exactly that on
+either engine and returns the same table: one row per group (null keys
+dropped, sorted by the keys) with one column per (value, reducer).
+
+The DuckDB engine runs in-process: the stored dataset is registered as a
+view over the pandas frame, the filters become a parameterised WHERE clause
+and DuckDB scans and aggregates it on all cores without materialising a
+filtered copy. The Polars engine converts the stored dataset once (a full
+copy; at most POLARS_CACHE_BYTES of them are kept) and runs each request as
+a lazy query, so the filters are pushed down into the scan and the group-by
+runs multithreaded; only the (small) aggregated table is converted back to
+pandas. The engine is picked per session with
+engine_selector().
+
+Datasets with at least PARALLEL_MIN_ROWS rows that end up on the pandas path
+are aggregated on several cores instead: parallel_groupby.py partitions them
+by REGION in shared memory and reduces the partitions in a process pool of
+PARALLEL_WORKERS processes (by default the CPU count, at most
+parallel_groupby.DEFAULT_WORKERS). Both settings can be changed through
+environment variables of the same name; PARALLEL_MIN_ROWS=0 turns it off.
+
+rollup() adds total rows (e.g. a National row over all regions) as extra
+grouping sets. They are merged from the same per-group partial aggregates
+(sum/count/min/max), so a total mean is sum/count over the underlying rows
+rather than a mean of means.
+
+partial_aggregates() also accepts a cube of partials built out of core by
+chunked.scan_cube() (marked by df.attrs[PARTIALS_ATTR]): the filters are
+applied to the cube's key columns and its partials merged per group, which
+gives the same result as on the raw rows.
+
+Filters are a dict {column: value}; a list/tuple/set value means "isin".
+Frames whose column names only differ by case are always run on pandas by
+the DuckDB engine, and frames Polars can't convert by the Polars engine.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+
+AGG_FUNCS = {"Average": "mean", "Minimum": "min", "Maximum": "max"}
+
+_SQL_AGGS = {
+    "mean": "AVG({col})",
+    "min": "MIN({col})",
+    "max": "MAX({col})",
+    # pandas sums an all-NaN group to 0, SQL to NULL
+    "sum": "COALESCE(SUM({col}), 0)",
+    "count": "COUNT({col})",
+}
+
+
+# Datasets this large (in rows) are aggregated in a process pool on the pandas path
+PARALLEL_MIN_ROWS = int(os.environ.get("PARALLEL_MIN_ROWS", 1_000_000))
+# Size of that pool per server process; 0 means the default (see parallel_groupby.DEFAULT_WORKERS)
+PARALLEL_WORKERS = int(os.environ.get("PARALLEL_WORKERS", 0))
+
+
+def available_engines():
+    engines = ["pandas"]
+    try:
+        import duckdb  # noqa: F401
+        engines.append("duckdb")
+    except ImportError:
+        pass
+    try:
+        import polars  # noqa: F401
+        engines.append("polars")
+    except ImportError:
+        pass
+    return engines
+
+
+def engine_selector(key="query_engine"):
+    """Sidebar switch for the aggregation engine, remembered for the whole session."""
+    engines = available_engines()
+    if len(engines) == 1:
+        return engines[0]
+    return st.sidebar.radio("Query engine", engines, key=key,
+                            help="DuckDB runs the filters and aggregations as multithreaded SQL "
+                                 "over the uploaded data without copying it; Polars runs them as "
+                                 "lazy multithreaded queries.")
+
+
+def agg_column(value, how, single=False):
+    """Name of the output column for `value` reduced with `how`."""
+    return value if single else f"{value}_{how}"
+
+
+def _as_list(x):
+    return list(x) if isinstance(x, (list, tuple)) else [x]
+
+
+def _is_multi(value):
+    return isinstance(value, (list, tuple, set, np.ndarray, pd.Index, pd.Series))
+
+
+def filter_mask(df, filters):
+    """Boolean row mask for `filters`, or None when there is nothing to filter on."""
+    mask = None
+    for col, value in (filters or {}).items():
+        cond = df[col].isin(list(value)) if _is_multi(value) else (df[col] == value)
+        mask = cond if mask is None else (mask & cond)
+    return mask
+
+
+def _aggregate_pandas(df, keys, values, hows, filters):
+    mask = filter_mask(df, filters)
+    cols = list(dict.fromkeys(keys + values))
+    sub = df.loc[mask, cols] if mask is not None else df[cols]
+    grouped = sub.groupby(keys, sort=True)
+    single = len(values) == 1 and len(hows) == 1
+    if not values:
+        return grouped.size().reset_index()[keys]
+    if single:
+        return grouped[values[0]].agg(hows[0]).reset_index()
+    out = grouped[values].agg(hows)
+    out.columns = [agg_column(v, h) for v, h in out.columns]
+    return out.reset_index()
+
+
+# ------- Process pool -------
+
+@st.cache_resource
+def get_parallel():
+    from parallel_groupby import ParallelBackend
+    return ParallelBackend(workers=PARALLEL_WORKERS or None)
+
+
+def use_parallel(df, dataset_key):
+    """Whether the pandas path should hand `df` to the process pool."""
+    return (PARALLEL_MIN_ROWS > 0 and dataset_key is not None and len(df) >= PARALLEL_MIN_ROWS
+            and (os.cpu_count() or 1) > 1)
+
+
+# ------- DuckDB -------
+
+def duckdb_compatible(df):
+    """DuckDB column names are case-insensitive, so e.g. BRAND and Brand can't both be a view column."""
+    names = [str(c).lower() for c in df.columns]
+    return len(set(names)) == len(names)
+
+
+class DuckDBBackend:
+    """One in-process DuckDB connection with the stored datasets registered as views."""
+
+    def __init__(self, max_views=16):
+        import duckdb
+        self._con = duckdb.connect()
+        self._lock = threading.Lock()
+        self._registered = OrderedDict()
+        self.max_views = max_views
+
+    def table(self, df, dataset_key=None):
+        """Register `df` (once per dataset key) and return its view name."""
+        key = dataset_key or f"frame_{id(df)}"
+        name = "ds_" + "".join(c if c.isalnum() else "_" for c in key)
+        with self._lock:
+            if self._registered.get(name) is not df:
+                self._con.register(name, df)
+                self._registered[name] = df
+            self._registered.move_to_end(name)
+            while len(self._registered) > self.max_views:
+                old, _ = self._registered.popitem(last=False)
+                self._con.unregister(old)
+        return name
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._con.execute(sql, list(params)).df()
+
+
+@st.cache_resource
+def get_duckdb():
+    return DuckDBBackend()
+
+
+def quote(col):
+    return '"' + str(col).replace('"', '""') + '"'
+
+
+def _py(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def where_clause(filters, not_null=()):
+    """SQL WHERE clause and parameters for `filters` (plus IS NOT NULL on `not_null`)."""
+    parts, params = [], []
+    for col, value in (filters or {}).items():
+        if _is_multi(value):
+            value = [_py(v) for v in value]
+            if not value:
+                parts.append("FALSE")
+                continue
+            parts.append(f"{quote(col)} IN ({', '.join('?' * len(value))})")
+            params.extend(value)
+        else:
+            parts.append(f"{quote(col)} = ?")
+            params.append(_py(value))
+    parts.extend(f"{quote(k)} IS NOT NULL" for k in not_null)
+    return (" WHERE " + " AND ".join(parts)) if parts else "", params
+
+
+def _aggregate_duckdb(df, keys, values, hows, filters, dataset_key):
+    backend = get_duckdb()
+    table = backend.table(df, dataset_key)
+    single = len(values) == 1 and len(hows) == 1
+    selects = [quote(k) for k in keys]
+    for v in values:
+        for h in hows:
+            selects.append(f"{_SQL_AGGS[h].format(col=quote(v))} AS {quote(agg_column(v, h, single))}")
+    where, params = where_clause(filters, not_null=keys)
+    group = ", ".join(quote(k) for k in keys)
+    sql = f"SELECT {', '.join(selects)} FROM {table}{where} GROUP BY {group} ORDER BY {group}"
+    return backend.query(sql, params)
+
+
+# ------- Polars -------
+
+class PolarsBackend:
+    """Polars copies of the stored datasets, converted once per dataset key.
+
+    pl.from_pandas() copies the whole frame, so every cached copy costs about
+    as much memory as the pandas frame it was made from (which the process
+    keeps too, possibly mapped from the shared dataset registry). The copies
+    are capped by their total estimated size, `max_bytes`; the least recently
+    used are dropped first, though the latest one is always kept.
+    """
+
+    def __init__(self, max_bytes=int(os.environ.get("POLARS_CACHE_BYTES", 1 << 30))):
+        self._lock = threading.Lock()
+        self._frames = OrderedDict()  # key -> (pandas frame, polars copy or None, bytes)
+        self._bytes = 0
+        self.max_bytes = max_bytes
+
+    def frame(self, df, dataset_key=None):
+        """LazyFrame over `df`, or None when it can't be converted (e.g. mixed-type object columns)."""
+        import polars as pl
+        key = dataset_key or f"frame_{id(df)}"
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is None or entry[0] is not df:
+                if entry is not None:
+                    self._bytes -= entry[2]
+                try:
+                    converted = pl.from_pandas(df)
+                    entry = (df, converted, converted.estimated_size())
+                except Exception:
+                    entry = (df, None, 0)
+                self._frames[key] = entry
+                self._bytes += entry[2]
+            self._frames.move_to_end(key)
+            while self._bytes > self.max_bytes and len(self._frames) > 1:
+                self._bytes -= self._frames.popitem(last=False)[1][2]
+        return None if entry[1] is None else entry[1].lazy()
+
+
+@st.cache_resource
+def get_polars():
+    return PolarsBackend()
+
+
+def polars_predicate(filters, not_null=()):
+    """Polars filter expression for `filters` (plus non-null `not_null`), or None."""
+    import polars as pl
+    preds = []
+    for col, value in (filters or {}).items():
+        if _is_multi(value):
+            preds.append(pl.col(col).is_in([_py(v) for v in value]))
+        else:
+            preds.append(pl.col(col) == _py(value))
+    preds.extend(pl.col(k).is_not_null() for k in not_null)
+    return pl.all_horizontal(preds) if preds else None
+
+
+def _polars_agg(col, how):
+    import polars as pl
+    expr = pl.col(col)
+    return {"mean": expr.mean(), "min": expr.min(), "max": expr.max(),
+            "sum": expr.sum(), "count": expr.count()}[how]
+
+
+def _aggregate_polars(lf, keys, values, hows, filters):
+    single = len(values) == 1 and len(hows) == 1
+    pred = polars_predicate(filters, not_null=keys)
+    if pred is not None:
+        lf = lf.filter(pred)
+    aggs = [_polars_agg(v, h).alias(agg_column(v, h, single)) for v in values for h in hows]
+    if aggs:
+        lf = lf.group_by(keys).agg(aggs)
+    else:
+        lf = lf.select(keys).unique()
+    return lf.sort(keys).collect().to_pandas()
+
+
+def aggregate(df, keys, value, how="mean", filters=None, engine="pandas", dataset_key=None):
+    """Filter `df`, group by `keys` and reduce `value` with `how`.
+
+    `value` and `how` may each be a single name or a list. With one of each
+    the output column keeps the value's name (like groupby()[value].mean());
+    otherwise there is one column per pair, named by agg_column(). With
+    `value=None` only the distinct group keys are returned.
+    """
+    keys, hows = _as_list(keys), _as_list(how)
+    values = [] if value is None else _as_list(value)
+    if engine == "duckdb" and duckdb_compatible(df):
+        return _aggregate_duckdb(df, keys, values, hows, filters, dataset_key)
+    if engine == "polars":
+        lf = get_polars().frame(df, dataset_key)
+        if lf is not None:
+            return _aggregate_polars(lf, keys, values, hows, filters)
+    if use_parallel(df, dataset_key):
+        result = get_parallel().aggregate(df, dataset_key, keys, values, hows, filters)
+        if result is not None:
+            return result
+    return _aggregate_pandas(df, keys, values, hows, filters)
+
+
+def distinct(df, column, filters=None, engine="pandas", dataset_key=None):
+    """Sorted distinct non-null values of `column` among the filtered rows."""
+    if engine == "duckdb" and duckdb_compatible(df):
+        backend = get_duckdb()
+        table = backend.table(df, dataset_key)
+        where, params = where_clause(filters, not_null=[column])
+        sql = f"SELECT DISTINCT {quote(column)} AS v FROM {table}{where} ORDER BY v"
+        return backend.query(sql, params)["v"].tolist()
+    if engine == "polars":
+        lf = get_polars().frame(df, dataset_key)
+        if lf is not None:
+            pred = polars_predicate(filters, not_null=[column])
+            if pred is not None:
+                lf = lf.filter(pred)
+            return lf.select(column).unique().sort(column).collect()[column].to_list()
+    mask = filter_mask(df, filters)
+    col = df.loc[mask, column] if mask is not None else df[column]
+    return sorted(col.dropna().unique().tolist())
+
+
+# ------- Partial aggregates and grouping sets -------
+
+PARTIAL_AGGS = ["sum", "count", "min", "max"]
+
+# How partials of the same group are merged: counts add up like sums
+_MERGE = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+# attrs entry listing the values a frame of partials (a cube) holds partials of
+PARTIALS_ATTR = "partial_values"
+
+
+def value_columns(df):
+    """Columns of `df` that can be aggregated; for a cube, the values it holds partials of."""
+    return list(df.attrs.get(PARTIALS_ATTR, df.columns))
+
+
+def _cube_partials(cube, keys, present, filters):
+    mask = filter_mask(cube, filters)
+    sub = cube[mask] if mask is not None else cube
+    if present:
+        return merge_partials(sub, keys, present)
+    return sub.groupby(keys, sort=True).size().reset_index()[keys]
+
+
+def partial_aggregates(df, keys, value, filters=None, engine="pandas", dataset_key=None):
+    """Mergeable sum/count/min/max of `value` (one name or a list) per group.
+
+    Columns missing from `df` still get a row per group, with count 0.
+    """
+    values = _as_list(value)
+    present = [v for v in values if v in value_columns(df)]
+    if PARTIALS_ATTR in df.attrs:
+        parts = _cube_partials(df, _as_list(keys), present, filters)
+    elif present:
+        parts = aggregate(df, keys, present, PARTIAL_AGGS, filters, engine, dataset_key)
+    else:
+        parts = aggregate(df, keys, None, filters=filters, engine=engine, dataset_key=dataset_key)
+    for v in values:
+        if v not in present:
+            parts[agg_column(v, "sum")] = 0.0
+            parts[agg_column(v, "count")] = 0
+            parts[agg_column(v, "min")] = np.nan
+            parts[agg_column(v, "max")] = np.nan
+    return parts
+
+
+def merge_partials(partials, keys, value):
+    """Combine partial aggregates rows that share the same `keys`."""
+    spec = {agg_column(v, h): _MERGE[h] for v in _as_list(value) for h in PARTIAL_AGGS}
+    return partials.groupby(keys, sort=True)[list(spec)].agg(spec).reset_index()
+
+
+def add_totals(partials, keys, value, totals):
+    """Append total grouping sets to per-group partial aggregates.
+
+    `totals` maps key columns to the label of their total, e.g.
+    {"REGION": "National"}. Every non-empty combination of those columns
+    becomes one grouping set, with the columns replaced by their labels
+    (for {"REGION": ..., "CAT": ...}: per-CAT national rows, per-region
+    all-CAT rows and the grand total). Rows that already carry a total
+    label (e.g. National rows in the upload) are replaced by the computed
+    ones.
+    """
+    base = partials
+    for col, label in totals.items():
+        base = base[base[col] != label]
+    sets = [base]
+    for size in range(1, len(totals) + 1):
+        for cols in combinations(totals, size):
+            labelled = base.assign(**{c: totals[c] for c in cols})
+            sets.append(merge_partials(labelled, keys, value))
+    return pd.concat(sets, ignore_index=True)
+
+
+def finalize(partials, keys, value, how="mean"):
+    """Reduce partial aggregates to `value` with `how` (mean/min/max/sum/count), sorted by the keys."""
+    if how == "mean":
+        count = partials[agg_column(value, "count")]
+        reduced = (partials[agg_column(value, "sum")] / count).where(count > 0)
+    else:
+        reduced = partials[agg_column(value, how)]
+    result = partials[keys].copy()
+    result[value] = reduced.to_numpy()
+    return result.sort_values(keys, ignore_index=True)
+
+
+def rollup(df, keys, value, how="mean", filters=None, engine="pandas", dataset_key=None, totals=None):
+    """aggregate() plus the total rows described by `totals` (see add_totals())."""
+    partials = partial_aggregates(df, keys, value, filters, engine, dataset_key)
+    if totals:
+        partials = add_totals(partials, keys, value, totals)
+    return finalize(partials, keys, value, how)
@@ -0,0 +1,345 @@
+"""
+Two-tier cache for computed tables (comparison tables, pivots, CSD tables).
+
+st.cache_data only lives as long as one server process. cached_result()
+keeps a function's results in an in-memory LRU in front of a size-capped
+pickle store on disk, shared by every session and by every server process
+on the machine. The key is (dataset key, page, normalized parameters, code
+version):
+
+- the function follows the pages' cached-function convention: a
+  `dataset_key` argument, and arguments starting with "_" (the frame) left
+  out of the key;
+- parameters are normalized so equal questions hit the same entry: dicts
+  passed as parameters are query_engine filters, so their dict order and the
+  order of their list values (isin) don't matter, and NumPy scalars count as
+  Python ones. The order of a list passed as a parameter itself (e.g. the
+  brands of a comparison, in the order the user picked them) is kept;
+- the code version is a hash of the source of the function's module, the
+  aggregation modules and any other modules the function names as
+  dependencies, so editing them retires the old results.
+
+Entries older than the TTL are misses in both tiers. invalidate() drops a
+dataset's (or a page's) results, and stats() reports hits per tier, misses
+and the hit rate. The disk tier's size is tracked as entries are written
+rather than scanned on every write or render; the store is rescanned (and
+trimmed) when the tracked size passes the cap, and at least every
+RESCAN_SECONDS to pick up what other processes wrote.
+"""
+
+import copy
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+
+RESULT_CACHE_DIR = ".result_cache"
+TTL_SECONDS = 24 * 3600
+RESCAN_SECONDS = 300
+# A full disk tier is trimmed to this fraction of its cap, so it isn't rescanned on every write after
+TRIM_TO = 0.9
+
+# Modules every cached table is computed with, besides the function's own
+_CORE_MODULES = ("query_engine.py", "pivot_kernel.py", "parallel_groupby.py")
+
+
+def normalize(value, in_filters=False):
+    """Hashable, order-insensitive where order doesn't matter, form of a parameter."""
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), normalize(v, in_filters=True)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)) or (in_filters and isinstance(value, (list, tuple, np.ndarray, pd.Index))):
+        return tuple(sorted((normalize(v) for v in value), key=repr))
+    if isinstance(value, (list, tuple, np.ndarray, pd.Index)):
+        return tuple(normalize(v) for v in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _source_hash(paths):
+    h = hashlib.sha1()
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except OSError:
+            h.update(path.encode())
+    return h.hexdigest()[:12]
+
+
+def code_version(fn, depends=()):
+    """Hash of the source of `fn`'s module, the shared aggregation modules and the `depends` modules."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    module_file = getattr(sys.modules.get(fn.__module__), "__file__", None) or fn.__module__
+    return _source_hash([module_file] + [os.path.join(here, m) for m in _CORE_MODULES + tuple(depends)])
+
+
+def _safe(name):
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(name))[:80] or "_"
+
+
+def _size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class ResultCache:
+    """In-memory LRU (by entry count and bytes) in front of a size-capped on-disk pickle store.
+
+    Disk entries live under <directory>/<dataset key>/<page>/<key>.pkl, so a
+    dataset's or a page's entries can be dropped together.
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_items=256, max_memory_bytes=256 << 20,
+                 max_disk_bytes=2 << 30, ttl=TTL_SECONDS):
+        self.directory = directory
+        self.max_items = max_items
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (created, size, dataset key, page, value)
+        self._memory_bytes = 0
+        self._counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        # Size of the disk tier as of the last scan plus this process's writes since; None until scanned
+        self._disk_entry_count = None
+        self._disk_bytes = None
+        self._scanned = 0.0
+
+    @staticmethod
+    def make_key(dataset_key, page, params, version):
+        params = tuple(sorted((k, normalize(v)) for k, v in params.items()))
+        payload = pickle.dumps((dataset_key, page, params, version), protocol=pickle.HIGHEST_PROTOCOL)
+        return hashlib.sha1(payload).hexdigest()
+
+    def _path(self, dataset_key, page, key):
+        return os.path.join(self.directory, _safe(dataset_key), _safe(page), f"{key}.pkl")
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def get(self, dataset_key, page, key):
+        """(True, value) on a hit in either tier, (False, None) otherwise."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._expired(entry[0]):
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._counts["memory_hits"] += 1
+                return True, copy.deepcopy(entry[4])
+        path = self._path(dataset_key, page, key)
+        try:
+            created = os.path.getmtime(path)
+            if self._expired(created):
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self._count("misses")
+            return False, None
+        self._remember(key, created, dataset_key, page, value)
+        self._count("disk_hits")
+        return True, copy.deepcopy(value)
+
+    def contains(self, dataset_key, page, key):
+        """Whether get() would hit, without counting it or loading the value."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                return True
+        try:
+            return not self._expired(os.path.getmtime(self._path(dataset_key, page, key)))
+        except OSError:
+            return False
+
+    def put(self, dataset_key, page, key, value):
+        created = time.time()
+        self._remember(key, created, dataset_key, page, copy.deepcopy(value))
+        path = self._path(dataset_key, page, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            self._counts["writes"] += 1
+            if self._disk_bytes is not None:
+                self._disk_entry_count += 1
+                self._disk_bytes += size
+            due = (self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+                   or time.time() - self._scanned > RESCAN_SECONDS)
+        if due:
+            self._trim_disk()
+
+    def _remember(self, key, created, dataset_key, page, value):
+        size = _size(value)
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._memory[key] = (created, size, dataset_key, page, value)
+            self._memory_bytes += size
+            while len(self._memory) > self.max_items or self._memory_bytes > self.max_memory_bytes:
+                self._drop(next(iter(self._memory)))
+                self._counts["evictions"] += 1
+
+    def _drop(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[1]
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _trim_disk(self):
+        """Rescan the store; if it's over max_disk_bytes, delete the oldest files down to TRIM_TO of it.
+
+        Other processes write here too, so this also resets the tracked size.
+        """
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        kept = len(entries)
+        target = self.max_disk_bytes * TRIM_TO if total > self.max_disk_bytes else total
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            kept -= 1
+        with self._lock:
+            self._disk_entry_count, self._disk_bytes, self._scanned = kept, total, time.time()
+
+    def invalidate(self, dataset_key=None, page=None):
+        """Drop the entries of one dataset and/or page (everything when both are None); returns memory entries dropped."""
+        with self._lock:
+            doomed = [k for k, (_, _, d, p, _) in self._memory.items()
+                      if (dataset_key is None or d == dataset_key) and (page is None or p == page)]
+            for key in doomed:
+                self._drop(key)
+        if dataset_key is not None:
+            roots = [os.path.join(self.directory, _safe(dataset_key))]
+        else:
+            roots = [os.path.join(self.directory, d) for d in os.listdir(self.directory)] \
+                if os.path.isdir(self.directory) else []
+        for root in roots:
+            target = root if page is None else os.path.join(root, _safe(page))
+            shutil.rmtree(target, ignore_errors=True)
+        self._trim_disk()
+        return len(doomed)
+
+    def stats(self, rescan=False):
+        """Hit/miss counts and the size of both tiers; the disk size is the tracked one unless `rescan`."""
+        with self._lock:
+            scan = rescan or self._disk_bytes is None
+        if scan:
+            self._trim_disk()
+        with self._lock:
+            counts = dict(self._counts)
+            counts["memory_entries"] = len(self._memory)
+            counts["memory_bytes"] = self._memory_bytes
+            counts["disk_entries"] = self._disk_entry_count
+            counts["disk_bytes"] = self._disk_bytes
+            counts["disk_scanned"] = self._scanned
+        lookups = counts["memory_hits"] + counts["disk_hits"] + counts["misses"]
+        counts["hit_rate"] = (counts["memory_hits"] + counts["disk_hits"]) / lookups if lookups else None
+        return counts
+
+
+@st.cache_resource
+def get_result_cache():
+    """One result cache per server process; the disk tier is shared by all of them."""
+    return ResultCache()
+
+
+def cached_result(page, ignore=("engine",), depends=()):
+    """Cache a page function's results in the process's ResultCache.
+
+    The function must take a `dataset_key` argument; arguments named in
+    `ignore` (by default the engine, which doesn't change the result) or
+    starting with "_" are not part of the key. `depends` names the other
+    modules (files next to this one, e.g. "time_buckets.py") the result is
+    computed with, so editing them retires it too. The wrapper's is_cached()
+    takes the same arguments and tells whether a call would be a hit.
+    """
+    def decorate(fn):
+        signature = inspect.signature(fn)
+        version = code_version(fn, depends)
+
+        def locate(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {k: v for k, v in bound.arguments.items() if not k.startswith("_") and k not in ignore}
+            dataset_key = params["dataset_key"]
+            return dataset_key, ResultCache.make_key(dataset_key, page, params, version)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = get_result_cache()
+            dataset_key, key = locate(args, kwargs)
+            hit, value = cache.get(dataset_key, page, key)
+            if hit:
+                return value
+            value = fn(*args, **kwargs)
+            cache.put(dataset_key, page, key, value)
+            return value
+
+        def is_cached(*args, **kwargs):
+            dataset_key, key = locate(args, kwargs)
+            return get_result_cache().contains(dataset_key, page, key)
+
+        wrapper.is_cached = is_cached
+        return wrapper
+    return decorate
+
+
+def show_cache_panel():
+    """Sidebar summary of the result cache with buttons to rescan the disk tier and to clear it."""
+    cache = get_result_cache()
+    with st.sidebar.expander("🗄️ Result cache"):
+        rescan = st.button("Rescan disk", key="result_cache_rescan")
+        s = cache.stats(rescan=rescan)
+        rate = "—" if s["hit_rate"] is None else f"{s['hit_rate']:.0%}"
+        st.caption(f"Hit rate {rate}: {s['memory_hits']} memory, {s['disk_hits']} disk, {s['misses']} misses")
+        st.caption(f"{s['memory_entries']} in memory ({s['memory_bytes'] / 1e6:.1f} MB), "
+                   f"~{s['disk_entries']} on disk ({s['disk_bytes'] / 1e6:.1f} MB, "
+                   f"scanned {time.time() - s['disk_scanned']:.0f}s ago)")
+        if st.button("Clear cached results", key="result_cache_clear"):
+            cache.invalidate()
+            st.rerun()
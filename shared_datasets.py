@@ -0,0 +1,243 @@
+"""
+Parsed datasets shared by every Streamlit server process on the machine.
+
+load_dataset() parses an upload once per server process, so every process
+behind the load balancer holds its own copy of the same large frame. With
+sharing on, the first process to parse an upload publishes the frame as an
+uncompressed Arrow IPC file in SHARED_DATASET_DIR (on /dev/shm by default,
+i.e. in RAM). Every process asking for the same dataset key then
+memory-maps that file instead of parsing it, the publisher included: numeric
+and string columns are used in place, so the node holds one copy of the
+data however many processes and sessions use it.
+
+A small JSON registry next to the files, updated under a file lock, records
+which processes hold a dataset and how many frames each holds. A frame's
+reference is dropped once it is garbage collected (e.g. after
+st.cache_resource evicts it and no page holds it any more); a dataset nobody
+references is deleted, and references of processes that died are pruned
+whenever the registry is touched. Frames that don't survive the round trip
+through Arrow unchanged (mixed-type object columns, non-default index) are
+not shared and stay private to their process.
+
+SHARED_DATASETS=0 in the environment turns sharing off.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): every process keeps its own copy
+    fcntl = None
+
+
+SHARED_DATASETS = os.environ.get("SHARED_DATASETS", "1") != "0"
+SHARED_DATASET_DIR = os.environ.get(
+    "SHARED_DATASET_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "retail-datasets"),
+)
+
+_REGISTRY = "registry.json"
+_LOCK = "registry.lock"
+
+
+def to_arrow(df):
+    """Arrow table with the columns of `df`, or None if it can't be shared.
+
+    Float columns keep NaN as a value rather than a null, so they convert
+    back without a copy.
+    """
+    import pyarrow as pa
+
+    index = df.index
+    if not (isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1):
+        return None
+    if not all(isinstance(c, str) for c in df.columns) or df.columns.has_duplicates:
+        return None
+    columns = {}
+    try:
+        for col in df.columns:
+            series = df[col]
+            if isinstance(series.dtype, np.dtype) and series.dtype.kind in "iufbmM":
+                columns[col] = pa.array(series.to_numpy())
+            else:
+                columns[col] = pa.array(series.array)
+    except (pa.ArrowException, TypeError, ValueError):
+        return None
+    return pa.table(columns)
+
+
+def map_frame(path):
+    """DataFrame over a memory-mapped Arrow IPC file; columns without nulls aren't copied."""
+    import pyarrow as pa
+
+    # The buffers keep the mapping alive; it stays valid after the file is deleted
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedDatasets:
+    """Registry of datasets published to SHARED_DATASET_DIR, with per-process reference counts.
+
+    The registry maps dataset key -> {"file", "rows", "bytes", "created",
+    "refs": {pid: frames held}}.
+    """
+
+    def __init__(self, directory=SHARED_DATASET_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        # Keys of collected frames; released on the next registry access, since
+        # a finalizer may run while this process already holds the file lock
+        self._released = deque()
+        atexit.register(self.close)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _registry(self):
+        """The registry, locked against other threads and processes; saved on exit."""
+        with self._lock, open(self._path(_LOCK), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self._path(_REGISTRY)) as f:
+                        registry = json.load(f)
+                except (OSError, ValueError):
+                    registry = {}
+                self._apply_releases(registry)
+                self._prune(registry)
+                yield registry
+                tmp = self._path(f"{_REGISTRY}.{self.pid}.tmp")
+                with open(tmp, "w") as f:
+                    json.dump(registry, f)
+                os.replace(tmp, self._path(_REGISTRY))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _apply_releases(self, registry):
+        pid = str(self.pid)
+        while self._released:
+            entry = registry.get(self._released.popleft())
+            if entry is not None and pid in entry["refs"]:
+                entry["refs"][pid] -= 1
+                if entry["refs"][pid] <= 0:
+                    del entry["refs"][pid]
+
+    def _prune(self, registry):
+        """Drop references of dead processes, then datasets nobody references."""
+        for key, entry in list(registry.items()):
+            entry["refs"] = {pid: n for pid, n in entry["refs"].items() if _alive(int(pid))}
+            if not entry["refs"] or not os.path.exists(self._path(entry["file"])):
+                registry.pop(key)
+                try:
+                    os.remove(self._path(entry["file"]))
+                except OSError:
+                    pass
+
+    def _hold(self, registry, key):
+        """Map dataset `key` and count a reference for this process until the frame is collected."""
+        entry = registry[key]
+        df = map_frame(self._path(entry["file"]))
+        pid = str(self.pid)
+        entry["refs"][pid] = entry["refs"].get(pid, 0) + 1
+        weakref.finalize(df, self._released.append, key)
+        return df
+
+    def attach(self, key):
+        """The shared frame of dataset `key`, or None if no process has published it."""
+        with self._registry() as registry:
+            if key not in registry:
+                return None
+            return self._hold(registry, key)
+
+    def publish(self, key, df):
+        """Share `df` as dataset `key`; returns the shared frame, or `df` itself if it can't be shared.
+
+        If another process published the key meanwhile, its copy is used.
+        """
+        table = to_arrow(df)
+        if table is None:
+            return df
+        import pyarrow as pa
+
+        name = f"{key}.arrow"
+        tmp = self._path(f"{name}.{self.pid}.tmp")
+        try:
+            with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            shared = map_frame(tmp)
+        except (OSError, pa.ArrowException):
+            # e.g. the tmpfs is full
+            self._remove(tmp)
+            return df
+        del table
+        if not (shared.dtypes.equals(df.dtypes) and shared.equals(df)):
+            self._remove(tmp)
+            return df
+        del shared
+        with self._registry() as registry:
+            if key in registry:
+                self._remove(tmp)
+            else:
+                os.replace(tmp, self._path(name))
+                registry[key] = {"file": name, "rows": len(df), "bytes": os.path.getsize(self._path(name)),
+                                 "created": time.time(), "refs": {}}
+            return self._hold(registry, key)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def datasets(self):
+        """Registry entries with the number of processes and frames holding each dataset."""
+        with self._registry() as registry:
+            return {key: {"rows": e["rows"], "bytes": e["bytes"], "created": e["created"],
+                          "processes": len(e["refs"]), "frames": sum(e["refs"].values())}
+                    for key, e in registry.items()}
+
+    def close(self):
+        """Drop every reference of this process (at exit)."""
+        pid = str(self.pid)
+        if os.getpid() != self.pid:
+            return
+        with self._registry() as registry:
+            for entry in registry.values():
+                entry["refs"].pop(pid, None)
+            self._prune(registry)
+
+
+@st.cache_resource
+def get_shared_datasets():
+    """This process's handle on the shared dataset registry, or None when sharing is off or unavailable."""
+    if not SHARED_DATASETS or fcntl is None:
+        return None
+    try:
+        return SharedDatasets()
+    except OSError:
+        return None
@@ -0,0 +1,97 @@
+"""
+Week-over-week comparison of two uploaded snapshots.
+
+Each snapshot is reduced to mergeable partial aggregates of the All Data
+metrics per REGION x BRAND x SKUS (cached per dataset with the result
+cache, so a file that was last week's "this week" isn't aggregated again).
+diff_snapshots() then joins the two per-group mean tables on the keys in one
+outer merge and reports, per metric, last week's and this week's price, the
+absolute and the percent change, and whether the group appeared, vanished or
+is in both snapshots.
+"""
+
+import numpy as np
+import pandas as pd
+
+from query_engine import PARTIAL_AGGS, add_totals, agg_column, partial_aggregates, value_columns
+from result_cache import cached_result
+
+
+KEYS = ["REGION", "BRAND", "SKUS"]
+METRICS = ["NTP/6P", "PROMO", "REG TP", "CP", "Invoice"]
+
+# merge() indicator -> Status, with last week's table on the left
+STATUSES = {"both": "in both", "left_only": "vanished", "right_only": "appeared"}
+
+
+def metric_columns(df):
+    """{metric: column} for the METRICS `df` has, matched case-insensitively like on All Data."""
+    by_name = {str(c).strip().lower(): c for c in reversed(value_columns(df))}
+    return {m: by_name[m.lower()] for m in METRICS if m.lower() in by_name}
+
+
+@cached_result("weekdiff")
+def snapshot_partials(dataset_key, filters, national, engine, _df):
+    """Partial aggregates of every metric per KEYS, with columns named after METRICS."""
+    columns = metric_columns(_df)
+    partials = partial_aggregates(_df, KEYS, list(columns.values()), filters, engine, dataset_key)
+    partials = partials.rename(columns={agg_column(col, how): agg_column(m, how)
+                                        for m, col in columns.items() for how in PARTIAL_AGGS})
+    if national:
+        partials = add_totals(partials, KEYS, list(columns), {"REGION": "National"})
+    return partials
+
+
+def snapshot_metrics(partials):
+    """The METRICS a snapshot_partials() table holds."""
+    return [m for m in METRICS if agg_column(m, "sum") in partials.columns]
+
+
+def snapshot_means(partials, metrics):
+    """One row per group with the mean of every metric (NaN where the group has no values)."""
+    means = partials.groupby(KEYS, sort=False)[[agg_column(m, h) for m in metrics for h in ("sum", "count")]].sum()
+    out = pd.DataFrame(index=means.index)
+    for m in metrics:
+        count = means[agg_column(m, "count")]
+        out[m] = (means[agg_column(m, "sum")] / count).where(count > 0)
+    return out.reset_index()
+
+
+def diff_snapshots(previous, current, metrics):
+    """Outer-join last week's and this week's snapshot_means() tables on KEYS.
+
+    Per metric there are `<metric>_last`, `<metric>_this`, `<metric>_change`
+    (this - last) and `<metric>_change_%` (change / last x 100, empty where
+    last week's price is 0 or missing) columns, plus a Status column: "in
+    both", "appeared" (only this week) or "vanished" (only last week). A
+    metric missing from one snapshot is empty on that side.
+    """
+    previous = previous.rename(columns={m: f"{m}_last" for m in metrics})
+    current = current.rename(columns={m: f"{m}_this" for m in metrics})
+    merged = pd.merge(previous, current, on=KEYS, how="outer", indicator="_merge")
+    merged = merged.reindex(columns=KEYS + ["_merge"] + [f"{m}_{s}" for m in metrics for s in ("last", "this")])
+
+    out = merged[KEYS].copy()
+    out["Status"] = merged["_merge"].map(STATUSES).astype(str)
+    for m in metrics:
+        last = merged[f"{m}_last"].to_numpy(dtype=float)
+        this = merged[f"{m}_this"].to_numpy(dtype=float)
+        change = this - last
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct = np.where(last != 0, change / last * 100, np.nan)
+        out[f"{m}_last"] = last
+        out[f"{m}_this"] = this
+        out[f"{m}_change"] = change
+        out[f"{m}_change_%"] = pct
+    return out.sort_values(KEYS, ignore_index=True)
+
+
+@cached_result("weekdiff")
+def week_diff(dataset_key, previous_key, filters, national, engine, _current, _previous):
+    """diff_snapshots() of two stored datasets, from their cached snapshot partials."""
+    current = snapshot_partials(dataset_key, filters, national, engine, _current)
+    previous = snapshot_partials(previous_key, filters, national, engine, _previous)
+    present = set(snapshot_metrics(current)) | set(snapshot_metrics(previous))
+    return diff_snapshots(snapshot_means(previous, snapshot_metrics(previous)),
+                          snapshot_means(current, snapshot_metrics(current)),
+                          [m for m in METRICS if m in present])
@@ -0,0 +1,33 @@
+"""
+Starting spawn-context process pools from inside a Streamlit page.
+
+A spawned worker re-runs the parent's __main__ from its file before it does
+any work, and under `streamlit run` __main__ is the page script being
+executed, so every worker would run the whole dashboard first. bare_main()
+hides it while a pool may start workers: submit to the pool inside it.
+"""
+
+import sys
+import threading
+import types
+from contextlib import contextmanager
+
+
+# Swapping __main__ is process-wide; pools in different threads take turns
+_swap_lock = threading.Lock()
+
+
+@contextmanager
+def bare_main():
+    """Replace __main__ with an empty module for the duration of the block.
+
+    A module without a file is skipped when a worker starts, so workers begin
+    with nothing but the modules their tasks need.
+    """
+    with _swap_lock:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            yield
+        finally:
+            sys.modules["__main__"] = main
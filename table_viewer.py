@@ -0,0 +1,127 @@
+"""
+Paged table viewer that keeps the full result on the server.
+
+st.dataframe sends the whole frame to the browser on every run, so large
+results had to be cut down (e.g. head(50)) before showing them.
+paged_table() converts a result to Arrow once (cached per result), applies
+the sort and the column filter on the server with pyarrow.compute, and sends
+only the rows of the visible page. It is a fragment: paging, sorting and
+filtering rerun just the table, not the page around it.
+"""
+
+import hashlib
+import math
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import streamlit as st
+
+
+PAGE_SIZES = (50, 100, 500, 1000)
+
+_NONE = "(none)"
+
+
+def content_key(df):
+    """Content hash of a frame, for results without a natural cache key."""
+    h = hashlib.sha1(repr((list(df.columns), [str(t) for t in df.dtypes])).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _column_name(col):
+    return " / ".join(str(c) for c in col) if isinstance(col, tuple) else str(col)
+
+
+def to_arrow_table(df):
+    """`df` as an Arrow table; a non-default index becomes leading columns.
+
+    Column names are flattened to strings and columns Arrow can't type (mixed
+    objects) are converted to text, as st.dataframe would show them.
+    """
+    index = df.index
+    if not (isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1):
+        df = df.reset_index()
+    columns = {}
+    for i, col in enumerate(df.columns):
+        series = df.iloc[:, i]
+        try:
+            array = pa.array(series, from_pandas=True)
+        except (pa.ArrowException, TypeError, ValueError):
+            array = pa.array(series.astype(str).where(series.notna()), from_pandas=True)
+        name = _column_name(col)
+        while name in columns:
+            name += " "
+        columns[name] = array
+    return pa.table(columns)
+
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _arrow(result_key, _df):
+    return to_arrow_table(_df)
+
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _row_order(result_key, filter_column, text, sort_column, descending, _table):
+    """Row indices after the column filter and the sort; None when neither applies."""
+    rows = None
+    if filter_column and text:
+        as_text = pc.cast(_table[filter_column], pa.large_string())
+        rows = pc.indices_nonzero(pc.fill_null(pc.match_substring(as_text, text, ignore_case=True), False))
+    if sort_column:
+        table = _table if rows is None else _table.take(rows)
+        # Nulls go last in either direction
+        order = pc.sort_indices(table, sort_keys=[(sort_column, "descending" if descending else "ascending")])
+        rows = order if rows is None else rows.take(order)
+    return rows
+
+
+@st.fragment
+def paged_table(df, key, result_key=None, page_size=100):
+    """Show `df` one page at a time with server-side sort and "contains" filter.
+
+    `key` prefixes the widget keys. `result_key` identifies the result for the
+    Arrow cache (e.g. dataset key plus filters); without one the frame's
+    content hash is used.
+    """
+    if result_key is None:
+        result_key = content_key(df)
+    table = _arrow(result_key, df)
+    names = table.column_names
+
+    c1, c2, c3, c4 = st.columns([2, 1, 2, 2])
+    with c1:
+        sort_column = st.selectbox("Sort by", [_NONE] + names, key=f"{key}_sort")
+    with c2:
+        descending = st.toggle("Descending", key=f"{key}_desc")
+    with c3:
+        filter_column = st.selectbox("Filter column", [_NONE] + names, key=f"{key}_filter")
+    with c4:
+        text = st.text_input("contains", key=f"{key}_text", disabled=filter_column == _NONE)
+
+    sort_column = None if sort_column == _NONE else sort_column
+    filter_column = None if filter_column == _NONE else filter_column
+    rows = _row_order(result_key, filter_column, text.strip(), sort_column, descending, table)
+    n_rows = table.num_rows if rows is None else len(rows)
+
+    p1, p2 = st.columns([1, 1])
+    with p2:
+        size = st.selectbox("Rows per page", PAGE_SIZES,
+                            index=PAGE_SIZES.index(page_size) if page_size in PAGE_SIZES else 0,
+                            key=f"{key}_size")
+    n_pages = max(math.ceil(n_rows / size), 1)
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = n_pages
+    with p1:
+        page = st.number_input("Page", min_value=1, max_value=n_pages, step=1, key=page_key)
+
+    start = (page - 1) * size
+    stop = min(start + size, n_rows)
+    visible = table.slice(start, stop - start) if rows is None else table.take(rows[start:stop])
+    st.dataframe(visible.to_pandas(), hide_index=True)
+    caption = f"Page {page:,} of {n_pages:,}: rows {start + 1 if n_rows else 0:,}–{stop:,} of {n_rows:,}"
+    if n_rows != table.num_rows:
+        caption += f" (filtered from {table.num_rows:,})"
+    st.caption(caption)
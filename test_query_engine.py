@@ -0,0 +1,76 @@
+"""
+Equivalence checks for query_engine's engines against its pandas path.
+
+Runs aggregate(), distinct() and rollup() (with computed National totals)
+on a synthetic upload with every engine available here and checks the
+results equal the pandas output.
+
+Usage:
+    python -m pytest -q test_query_engine.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from groupby_bench import KEYS, VALUES, make_upload
+from query_engine import AGG_FUNCS, PARTIAL_AGGS, aggregate, available_engines, distinct, rollup
+
+
+ENGINES = [e for e in available_engines() if e != "pandas"]
+
+FILTERS = [None, {"CHANNEL": "GT"}, {"CHANNEL": "GT", "WEEK": ["W1", "W3"]}, {"REGION": []}]
+
+
+@pytest.fixture(scope="module")
+def upload():
+    df = make_upload(20_000, seed=1)
+    # Some rows without a brand: the engines must all drop null keys
+    df.loc[np.random.default_rng(2).random(len(df)) < 0.02, "BRAND"] = None
+    return df
+
+
+def assert_same(expected, got):
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), got.reset_index(drop=True),
+                                  check_dtype=False, check_index_type=False, check_column_type=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("how", list(AGG_FUNCS.values()) + [PARTIAL_AGGS])
+def test_aggregate(upload, engine, filters, how):
+    expected = aggregate(upload, KEYS, VALUES, how, filters)
+    got = aggregate(upload, KEYS, VALUES, how, filters, engine, dataset_key="test")
+    assert_same(expected, got)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("filters", FILTERS)
+def test_aggregate_single_value_and_keys_only(upload, engine, filters):
+    assert_same(aggregate(upload, ["REGION", "BRAND"], "NTP", "mean", filters),
+                aggregate(upload, ["REGION", "BRAND"], "NTP", "mean", filters, engine, dataset_key="test"))
+    assert_same(aggregate(upload, KEYS, None, filters=filters),
+                aggregate(upload, KEYS, None, filters=filters, engine=engine, dataset_key="test"))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("column", ["REGION", "BRAND", "WEEK"])
+def test_distinct(upload, engine, filters, column):
+    assert distinct(upload, column, filters) == distinct(upload, column, filters, engine, dataset_key="test")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("how", list(AGG_FUNCS.values()))
+def test_rollup_with_national(upload, engine, filters, how):
+    totals = {"REGION": "National"}
+    expected = rollup(upload, KEYS, "NTP", how, filters, totals=totals)
+    got = rollup(upload, KEYS, "NTP", how, filters, engine, dataset_key="test", totals=totals)
+    assert_same(expected, got)
+    if filters != {"REGION": []}:
+        assert (expected["REGION"] == "National").any()
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main(["-q", __file__]))
@@ -0,0 +1,39 @@
+"""
+Checks for result_cache's keys and code versions.
+
+Usage:
+    python -m pytest -q test_result_cache.py
+"""
+
+import numpy as np
+
+from result_cache import ResultCache, code_version
+
+
+def key(**params):
+    return ResultCache.make_key("dataset", "page", params, "version")
+
+
+def test_parameter_list_order_is_kept():
+    # e.g. brand_sku_table's brands: the table's columns follow the user's order
+    assert key(brands=["A", "B"]) != key(brands=["B", "A"])
+
+
+def test_filter_order_is_ignored():
+    assert key(filters={"CHANNEL": "GT", "WEEK": ["W1", "W2"]}) == key(filters={"WEEK": ["W2", "W1"], "CHANNEL": "GT"})
+
+
+def test_numpy_scalars_match_python_ones():
+    assert key(window=np.int64(3), filters={"YEAR": np.int64(2025)}) == key(window=3, filters={"YEAR": 2025})
+
+
+def test_dependencies_are_part_of_the_code_version():
+    assert code_version(key, ("time_buckets.py",)) != code_version(key)
+
+
+if __name__ == "__main__":
+    test_parameter_list_order_is_kept()
+    test_filter_order_is_ignored()
+    test_numpy_scalars_match_python_ones()
+    test_dependencies_are_part_of_the_code_version()
+    print("ok")
@@ -0,0 +1,114 @@
+"""
+Per-dataset time-bucket aggregates for trend views.
+
+The analysis pages aggregate one month and a few weeks at a time. A trend
+over YEAR/MON/WEEK/PERIOD would otherwise rescan every raw row for each
+bucket. bucket_table() reduces a dataset once to mergeable sum/count/min/max
+partials per YEAR x MON x WEEK x PERIOD x the page's keys, and the result
+cache keeps it per dataset. Every trend is then merged from that table:
+series_partials() filters it and merges it to one row per time bucket (of
+the chosen grain) and series, and rolling_trend() applies a rolling window
+over the ordered buckets. Window means pool sums and counts, so they are
+means over the underlying rows, not means of bucket means.
+
+Buckets are ordered by YEAR, then calendar month (MON as JAN/Feb/march or
+1-12), then the number in WEEK/PERIOD ("W3" -> 3). Rows with a missing time
+key are left out of the table.
+"""
+
+import numpy as np
+import pandas as pd
+
+from pivot_kernel import pivot
+from query_engine import agg_column, filter_mask, merge_partials, partial_aggregates
+
+
+TIME_KEYS = ["YEAR", "MON", "WEEK", "PERIOD"]
+
+# Trend grain -> the time keys that identify one bucket
+GRAINS = {
+    "Week": ["YEAR", "MON", "WEEK"],
+    "Period": ["YEAR", "MON", "PERIOD"],
+    "Month": ["YEAR", "MON"],
+}
+
+MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+
+
+def bucket_table(df, keys, values, engine="pandas", dataset_key=None):
+    """Partial aggregates of `values` per time bucket x `keys` (the time keys `df` has first)."""
+    time_keys = [k for k in TIME_KEYS if k in df.columns]
+    return partial_aggregates(df, time_keys + list(keys), values, None, engine, dataset_key)
+
+
+def time_order(series):
+    """Sortable number per value of one time key column (see the module docstring)."""
+    numeric = pd.to_numeric(series, errors="coerce")
+    if series.name == "MON":
+        text = series.astype(str).str.strip().str[:3].str.upper()
+        month = text.map({m: i for i, m in enumerate(MONTHS, 1)})
+        numeric = month.where(month.notna(), numeric)
+    elif series.name != "YEAR":
+        digits = pd.to_numeric(series.astype(str).str.extract(r"(\d+)", expand=False), errors="coerce")
+        numeric = numeric.where(numeric.notna(), digits)
+    return numeric.to_numpy(dtype=float)
+
+
+def bucket_codes(parts, grain_keys):
+    """(ordered bucket number per row, bucket labels such as "2025 JAN W3" in time order)."""
+    buckets = parts[grain_keys].drop_duplicates()
+    # np.lexsort sorts by its last key first: time order, then text, key by key
+    sort_keys = []
+    for k in reversed(grain_keys):
+        sort_keys += [buckets[k].astype(str).to_numpy(), time_order(buckets[k])]
+    order = np.lexsort(sort_keys)
+    buckets = buckets.iloc[order]
+    labels = buckets.astype(str).agg(" ".join, axis=1).to_numpy()
+    index = pd.MultiIndex.from_frame(buckets)
+    return index.get_indexer(pd.MultiIndex.from_frame(parts[grain_keys])), labels
+
+
+def series_partials(buckets, grain, series_keys, value, filters=None):
+    """bucket_table() rows kept by `filters`, merged to one row per `grain` bucket x `series_keys`."""
+    grain_keys = [k for k in GRAINS[grain] if k in buckets.columns]
+    mask = filter_mask(buckets, filters)
+    sub = buckets[mask] if mask is not None else buckets
+    return merge_partials(sub, grain_keys + list(series_keys), value), grain_keys
+
+
+def rolling_trend(parts, grain_keys, series_keys, value, how="mean", window=1):
+    """Long table (Bucket, *series_keys, value) over every bucket in `parts`, in time order.
+
+    Each value covers the last `window` buckets of the timeline (buckets where
+    a series has no rows add nothing to it). The windows are computed
+    incrementally over the bucket x series grid: rolling sums of the sums and
+    counts for the mean, rolling min/max of the bucket minima/maxima.
+    """
+    series_keys = list(series_keys)
+    codes, labels = bucket_codes(parts, grain_keys)
+    parts = parts.assign(_BUCKET=codes)
+
+    def grid(how_part, fill):
+        wide = pivot(parts, "_BUCKET", series_keys, agg_column(value, how_part), "first")
+        return wide.reindex(index=range(len(labels))).fillna(fill)
+
+    if how == "mean":
+        sums = grid("sum", 0.0).rolling(window, min_periods=1).sum()
+        counts = grid("count", 0).rolling(window, min_periods=1).sum()
+        wide = (sums / counts).where(counts > 0)
+    else:
+        wide = getattr(grid(how, np.nan).rolling(window, min_periods=1), how)()
+    wide.index = pd.Index(labels, name="Bucket")
+    out = wide.stack(list(range(wide.columns.nlevels))).rename(value).reset_index()
+    out["Bucket"] = pd.Categorical(out["Bucket"], categories=labels, ordered=True)
+    return out.dropna(subset=[value]).sort_values(["Bucket"] + series_keys, ignore_index=True)
+
+
+def index_against(trend, series_key, value, base):
+    """Each series' value as an index of series `base` in the same bucket (base = 100)."""
+    base_rows = trend[trend[series_key] == base]
+    base_values = dict(zip(base_rows["Bucket"].astype(str), base_rows[value]))
+    denominator = trend["Bucket"].astype(str).map(base_values).to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        index = np.where(denominator != 0, trend[value].to_numpy(dtype=float) / denominator * 100, np.nan)
+    return trend.assign(**{value: index}).dropna(subset=[value])